@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import json
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
@@ -6,14 +7,24 @@ from telegram.ext import (Application, CommandHandler, MessageHandler, filters,
                           ConversationHandler, ContextTypes, ChatMemberHandler,
                           CallbackQueryHandler)
 from telegram.error import NetworkError, TelegramError # <--- Added NetworkError and TelegramError imports
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import tempfile
+import io
 import os
+import tempfile
+import google_clients
+from drive import upload_stream_to_drive
+from uploads import UploadTracker
+from professions import resolve_profession
+from phones import PhoneIndex, is_valid_phone_number, normalize_phone
+from profile_cache import ProfileCache
+import bot_runtime
+import export
+import metrics
+import tracing
+from sheet_index import shared_index
+from storage import AsyncWorksheet, run_io
+from local_store import get_store, ProfessionalsMirror, ProfileChangeFeed
+from persistence import SQLitePersistence
 
-import re # Import the regular expression module
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 if not TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable not set.")
@@ -23,17 +34,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Google Sheets setup
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds_json_str = os.environ.get("deboregist")
-if not creds_json_str:
-    raise ValueError("GOOGLE_CREDENTIALS_JSON environment variable not set.")
-with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=".json") as temp_creds_file:
-    temp_creds_file.write(creds_json_str)
-    temp_file_path = temp_creds_file.name
-creds = ServiceAccountCredentials.from_json_keyfile_name(temp_file_path, scope)
-client = gspread.authorize(creds)
-sheet = client.open("Professionals").sheet1
+# Google Sheets setup (credentials/client are shared with other bots in the same process).
+# The sheet is opened on first use, from on_startup(), not while this module is imported.
+CREDENTIALS_ENV = "deboregist"
+sheet = google_clients.open_sheet(CREDENTIALS_ENV, "Professionals")
+professionals_sheet = AsyncWorksheet(sheet)
+# Testimonial/educational uploads run in the background, keyed by (user_id, column name)
+uploads = UploadTracker()
+
+# Resident User ID -> row index over the Professionals sheet, loaded in on_startup()
+user_index = shared_index(sheet, key_column="User ID")
+SHEET_RECONCILE_SECONDS = int(os.environ.get("SHEET_RECONCILE_SECONDS", "300"))
+SHEET_LOAD_TIMEOUT = float(os.environ.get("SHEET_LOAD_TIMEOUT", "120"))
+# Telegram user ids allowed to use /export (comma-separated)
+ADMIN_USER_IDS = {int(user_id) for user_id in os.environ.get("ADMIN_USER_IDS", "").replace(" ", "").split(",") if user_id}
+EXPORT_TIMEOUT = float(os.environ.get("EXPORT_TIMEOUT", "900"))
+
+# Column order of the Professionals sheet (A..L), used if the header row could not be read
+PROFESSIONALS_COLUMNS = ["User ID", "Username", "Full_Name", "PROFESSION", "PHONE", "LOCATION",
+                         "Region/City/Woreda", "CONFIRM_DELETE", "COMMENT", "Testimonials",
+                         "Educational Docs", "PROFESSION_ID"]
+
+def sheet_columns():
+    """The sheet's own header names, padded with our defaults for columns it has no header for yet."""
+    header = user_index.header
+    return list(header) + PROFESSIONALS_COLUMNS[len(header):]
+
+# Profiles are read and written locally (SQLite); the mirror copies changes to the sheet
+local_store = get_store()
+mirror = ProfessionalsMirror(local_store, professionals_sheet, user_index, sheet_columns)
+# Normalized phone -> User IDs of the stored profiles, loaded in on_startup() and kept
+# in step with every local save/update/delete
+phone_index = PhoneIndex(phone_column="PHONE")
+# Profiles shown by /profile; every local write below goes through it as well
+profile_cache = ProfileCache()
+
+def follow_profile_change(user_id, row):
+    """Profile written to the store by another process (bulk_import.py), or by this one."""
+    phone_index.sync_row(user_id, row)
+    profile_cache.invalidate(user_id)
+
+profile_feed = ProfileChangeFeed(local_store, follow_profile_change)
 
 # Add new states for editing flow
 (ASK_EDIT_FIELD, GET_NEW_VALUE, GET_NEW_LOCATION, GET_NEW_TESTIMONIALS, GET_NEW_EDUCATIONAL_DOCS) = range(10, 15) # Start from 10
@@ -56,6 +97,7 @@ COLUMN_MAP = {
     "Testimonials": "J",
     "Educational Docs": "K",
     "COMMENT": "I",
+    "PROFESSION_ID": "L", # Canonical id from professions.py, derived from PROFESSION
 }
 # Map callback data (used in InlineKeyboard) to field names and states
 EDIT_OPTIONS = {
@@ -96,63 +138,109 @@ yes_no_markup = ReplyKeyboardMarkup(yes_no_keyboard, one_time_keyboard=True, res
 
 # Helper functions
 def find_user_row(user_id):
+    """
+    Returns (sheet row number or None, profile dict) from the local store, or (None, None).
+    The row number is only known once the profile has been mirrored to the sheet.
+    """
     try:
-        records = sheet.get_all_records()
-        for idx, row in enumerate(records, start=2):
-            if str(row.get("User ID")) == str(user_id):
-                return idx, row
-    except:
+        row = local_store.get_professional(user_id)
+        if row is None:
+            return None, None
+        row_idx, _ = user_index.get(user_id)
+        return row_idx, row
+    except Exception as e:
+        logger.error(f"Error looking up user {user_id}: {e}")
         return None, None
-    return None, None
 
-# Helper function to validate phone number
-def is_valid_phone_number(phone_number: str) -> bool:
+#upload_to_drive
+def upload_to_drive(stream, folder_id, filename, mimetype=None):
+    creds = google_clients.get_credentials(CREDENTIALS_ENV)
+    return upload_stream_to_drive(creds, stream, folder_id, filename, mimetype)
+
+def message_filename(message):
+    file = message.document or message.photo[-1]
+    return getattr(file, 'file_name', None) or f"photo_{file.file_id}.jpg"
+
+async def upload_message_file(context: ContextTypes.DEFAULT_TYPE, message, folder_id):
+    """Downloads the message's document/photo into memory and uploads it to Drive."""
+    file = message.document or message.photo[-1]
+    file_obj = await context.bot.get_file(file.file_id)
+    buffer = io.BytesIO()
+    await file_obj.download_to_memory(buffer)
+    mimetype = getattr(file, 'mime_type', None) or ("image/jpeg" if message.photo else None)
+    return await run_io(upload_to_drive, buffer, folder_id, message_filename(message), mimetype)
+
+async def upload_and_remember(context: ContextTypes.DEFAULT_TYPE, message, folder_id, kind):
+    """Uploads the file and keeps its link in user_data, so it is persisted with the conversation."""
+    link = await upload_message_file(context, message, folder_id)
+    context.user_data.setdefault('uploaded_links', {}).setdefault(kind, []).append(link)
+    context.application.mark_data_for_update_persistence(user_ids=message.from_user.id)
+    return link
+
+def queue_message_upload(context: ContextTypes.DEFAULT_TYPE, message, folder_id, kind):
+    """Starts the upload in the background so the user gets an instant reply."""
+    uploads.submit(message.from_user.id, kind, message_filename(message),
+                   upload_and_remember(context, message, folder_id, kind))
+
+def has_uploads(context: ContextTypes.DEFAULT_TYPE, user_id, kind):
+    return bool(uploads.pending(user_id, kind) or context.user_data.get('uploaded_links', {}).get(kind))
+
+async def collect_uploads(context: ContextTypes.DEFAULT_TYPE, user_id, kind):
     """
-    Validates if the input string looks like a valid phone number.
-    This is a basic check and might need adjustment for specific formats.
-    Allows digits, spaces, hyphens, parentheses, and an optional leading plus sign.
-    Requires at least 7 digits.
+    Waits for the user's background uploads of this kind. Links of uploads finished
+    before a restart come from user_data; the tracker only knows about this process.
+    Only this user's updates wait meanwhile (bot_runtime.per_user_update_processor).
     """
-    # Remove common non-digit characters except '+' at the start
-    cleaned_number = re.sub(r'[()\s-]', '', phone_number)
+    with tracing.span("drive.wait_uploads"):
+        links, failed = await uploads.collect(user_id, kind)
+    saved = context.user_data.get('uploaded_links', {}).pop(kind, [])
+    return list(dict.fromkeys(saved + links)), failed
+
+def discard_uploads(context: ContextTypes.DEFAULT_TYPE, user_id, kind=None):
+    uploads.discard(user_id, kind)
+    saved = context.user_data.get('uploaded_links', {})
+    if kind is None:
+        saved.clear()
+    else:
+        saved.pop(kind, None)
 
-    # Check if the number starts with '+' and then digits, or just digits
-    # Ensure there are enough digits (e.g., at least 7 after cleaning)
-    if re.fullmatch(r'^\+?\d{7,}$', cleaned_number):
-        return True
-    return False
+def phone_taken_by_other(phone_number, user_id):
+    """True if another profile is already registered with this number (in any format)."""
+    return bool(phone_index.owners_other_than(phone_number, user_id))
 
-#upload_to_drive
-def upload_to_drive(file_path, folder_id, filename):
-    drive_service = build('drive', 'v3', credentials=creds)
-    file_metadata = {
-        'name': filename,
-        'parents': [folder_id]
-    }
-    media = MediaFileUpload(file_path, resumable=True)
-    file = drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-    file_id = file.get('id')  # fixed variable name
-    return f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
+async def report_phone_taken(message):
+    await message.reply_text("⚠️ This phone number is already registered to another profile. Please enter a different number.\n"
+                             "ይህ ስልክ ቁጥር በሌላ መገለጫ ተመዝግቧል። እባክዎ ሌላ ስልክ ቁጥር ያስገቡ።")
 
-# --- Sheet Update Helper ---
-async def update_sheet_cell(context: ContextTypes.DEFAULT_TYPE, field_name: str, new_value):
-    """Updates a specific cell in the user's row."""
-    row_idx = context.user_data.get('edit_row_idx')
-    if not row_idx:
-        logger.error("update_sheet_cell called without row_idx in user_data")
-        return False # Indicate failure
+async def report_failed_uploads(message, failed):
+    names = "\n".join(f"• {label}" for label, _ in failed)
+    await message.reply_text(f"⚠️ These files could not be uploaded. Please send them again with /editprofile:\n"
+                             f"የሚከተሉት ፋይሎች መጫን አልተቻለም። እባክዎ /editprofile ተጠቅመው እንደገና ይላኩ።\n{names}")
 
-    col_letter = COLUMN_MAP.get(field_name)
-    if not col_letter:
-        logger.error(f"Invalid field name '{field_name}' provided for update.")
+# --- Sheet Update Helper ---
+async def update_profile_fields(context: ContextTypes.DEFAULT_TYPE, fields):
+    """
+    Commits {field name: value} to the user's profile in one local write; the mirror
+    then updates the sheet row in a single request, however many fields changed.
+    """
+    unknown = [name for name in fields if name not in COLUMN_MAP]
+    if unknown:
+        logger.error(f"Invalid field names {unknown} provided for update.")
         return False # Indicate failure
 
+    user_id = context.user_data.get('user_id')
     try:
-        sheet.update(f"{col_letter}{row_idx}", [[new_value]]) # Use update with range
-        logger.info(f"Updated row {row_idx}, column {col_letter} for user {context.user_data.get('user_id')}")
+        if not local_store.update_professional(user_id, fields):
+            logger.error(f"update_profile_fields: no profile stored for user {user_id}")
+            return False # Indicate failure
+        profile_cache.update(user_id, fields)
+        if "PHONE" in fields:
+            phone_index.add(user_id, fields["PHONE"])
+        mirror.notify()
+        logger.info(f"Updated {', '.join(fields)} (columns {', '.join(COLUMN_MAP[name] for name in fields)}) for user {user_id}")
         return True # Indicate success
     except Exception as e:
-        logger.error(f"Failed to update sheet for row {row_idx}, column {col_letter}: {e}")
+        logger.error(f"Failed to update {', '.join(fields)} for user {user_id}: {e}")
         return False # Indicate failure
 
 
@@ -192,6 +280,7 @@ async def get_full_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def get_profession(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['PROFESSION'] = update.message.text
+    context.user_data['PROFESSION_ID'] = resolve_profession(update.message.text) or ""
     await update.message.reply_text("📞Enter your phone number: / ስል ቁጥርዎን ያስገቡ")
     return PHONE
 
@@ -201,7 +290,11 @@ async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Invalid phone number format. Please enter a valid phone number \n የተሳሳተ መረጃ አስገብተዋል እባክዎ ትክክለኝ የስልክ ቁጥር ፎርማት ይጠቀሙ (e.g., +251912345678 or 0912345678): / የስልክ ቁጥርዎ ትክክል አይደለም። ትክክለኛ ስልክ ቁጥር ያስገቡ (ለምሳሌ +251912345678 ወይም 0912345678):")
         return PHONE # Stay in the PHONE state to ask again
 
-    context.user_data['phone'] = phone_number
+    if phone_taken_by_other(phone_number, update.message.from_user.id):
+        await report_phone_taken(update.message)
+        return PHONE
+
+    context.user_data['phone'] = normalize_phone(phone_number) # Stored in E.164 (+2519...)
     location_button = [[KeyboardButton("📍Share Location / የርስዎን ወይም የቢሮዎን መገኛ ያጋሩ ", request_location=True)], [KeyboardButton("Skip / አሳልፍ")]]
     await update.message.reply_text(
         "Share your location or press Skip:/ የርስዎን ወይም የቢሮዎን መገኛ ያጋሩ ወይም Skip / አሳልፍ ይጫኑ",
@@ -232,7 +325,7 @@ async def ask_for_testimonials(update: Update, context: ContextTypes.DEFAULT_TYP
         "📄Please upload your testimonial documents or images. You can upload multiple. use the buttons below skip or finish : \n እርስዎ ከዚ በፊት የሰርዋቸው እንደማስረጃ የሚያገለግሉ ስራዎችዎን ያስገቡ። \n \n ✅ የትኛውንም የፋይል አይነት ማስገባት ይችላሉ። \n \n ✅ከአንድ በላይ ፋይል ማስግባት ይችላሉ። \n \n ✅ አስገብተው ሲጨርሱ Done /ጨርሻለው የሚለውን ይጫኑ። \n \n ✅ የሚያስገቡት ማስረጃ ከሌሎት skip /አሳልፍን ይጫኑ።ይጫኑ።",
         reply_markup=skip_done_markup # Show keyboard immediately
     )
-    context.user_data['testimonial_links'] = []
+    discard_uploads(context, update.message.from_user.id) # Drop leftovers from an abandoned registration
     return TESTIMONIALS
 
 
@@ -247,33 +340,14 @@ async def handle_testimonials(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Check if 'Done' button text is included - handle both English and Amharic if possible
         elif "done" in text or "ተጠናቋል" in text:
              # User clicked done, proceed to next step (ask for educational docs)
-             if not context.user_data.get('testimonial_links'):
+             if not has_uploads(context, update.message.from_user.id, "Testimonials"):
                  await update.message.reply_text("No testimonial files were uploaded. Skipping.  \n ምንም አይነት የሰሯቸውን ስራዎች ማስርጃ አላስገቡም!", reply_markup=ReplyKeyboardRemove())
              return await ask_for_educational_docs(update, context)
 
     if update.message.document or update.message.photo:
         testimonial_folder_id = "1TMehhfN9tExqoaHIYya-B-SCcFeBTj2y"
 
-        file = update.message.document or update.message.photo[-1]
-        file_id = file.file_id
-        file_obj = await context.bot.get_file(file_id)
-        # Create temp file and download into it
-        with tempfile.NamedTemporaryFile(delete=False) as tf:
-
-            temp_path = tf.name
-            await file_obj.download_to_drive(temp_path)
-
-        # Now the temp file is closed and safe to use
-        filename = file.file_name if update.message.document else f"photo_{file_id}.jpg"
-        link = upload_to_drive(temp_path, testimonial_folder_id, filename)
-
-        # Safely append to testimonial_links
-        if 'testimonial_links' not in context.user_data:
-            context.user_data['testimonial_links'] = []
-        context.user_data['testimonial_links'].append(link)
-
-        # Now it's safe to delete the temp file
-        os.remove(temp_path)
+        queue_message_upload(context, update.message, testimonial_folder_id, "Testimonials")
 
         await update.message.reply_text("File received. Upload more or select an option: ማስረጃዎን በትክክል አስገብተዋል። ተጨማሪ ማስረጃ ያስገቡ ወይም ታች ካሉት አማርጮች አንዱን ይጠቀሙ።", reply_markup=skip_done_markup)
         return TESTIMONIALS
@@ -287,7 +361,6 @@ async def ask_for_educational_docs(update: Update, context: ContextTypes.DEFAULT
         "🎓Please upload your educational background documents or images. You can upload multiple files. Or use the buttons below:  \n የትምህርት ማስረጃ ካልዎትያስገቡ። \n✅ የትኛውንም የፋይል አይነት ማስገባት ይችላሉ። \n ✅ከአንድ በላይ ፋይል ማስግባት ይችላሉ። ✅ አስገብተው ሲጨርሱ Done /ጨርሻለው የሚለውን ይጫኑ። \n ✅ የሚያስገቡት ማስረጃ ከሌሎት skip /አሳልፍን ይጫኑ።ይጫኑ።",
          reply_markup=skip_done_markup # Show keyboard immediately
     )
-    context.user_data['education_links'] = []
     return EDUCATIONAL_DOCS
 
 
@@ -300,7 +373,7 @@ async def handle_educational_docs(update: Update, context: ContextTypes.DEFAULT_
         # Check if 'Done' button text is included - handle both English and Amharic if possible
         elif "done" in text or "ተጠናቋል" in text:
             # User clicked done, proceed to finish registration
-            if not context.user_data.get('educational_links'):
+            if not has_uploads(context, update.message.from_user.id, "Educational Docs"):
                  await update.message.reply_text("No educational files were uploaded. Skipping. ምንም አይነት የሰሯቸውን ስራዎች ማስርጃ አላስገቡም!", reply_markup=ReplyKeyboardRemove())
             return await finish_registration(update, context)
 
@@ -308,24 +381,7 @@ async def handle_educational_docs(update: Update, context: ContextTypes.DEFAULT_
     if update.message.document or update.message.photo:
         education_folder_id = "1i9a2G7EXByrY9LxXtv4yY-CMExDWI7hM"
 
-        file = update.message.document or update.message.photo[-1]
-        file_id = file.file_id
-        file_obj = await context.bot.get_file(file_id)
-
-        # Create and close the temp file first
-        with tempfile.NamedTemporaryFile(delete=False) as tf:
-            temp_path = tf.name
-            await file_obj.download_to_drive(temp_path)
-
-        filename = file.file_name if update.message.document else f"photo_{file_id}.jpg"
-        link = upload_to_drive(temp_path, education_folder_id, filename)
-
-        # Ensure educational_links is initialized and append the link
-        if 'educational_links' not in context.user_data:
-            context.user_data['educational_links'] = []
-        context.user_data['educational_links'].append(link)
-
-        os.remove(temp_path)
+        queue_message_upload(context, update.message, education_folder_id, "Educational Docs")
 
         await update.message.reply_text("Educational file received. Upload more or select an option:የትምህርት ማስረጃዎን በትክክል አስገብተዋል። ተጨማሪ ማስረጃ ያስገቡ ወይም ታች ካሉት አማርጮች አንዱን ይጠቀሙ።", reply_markup=skip_done_markup)
         return EDUCATIONAL_DOCS
@@ -337,9 +393,15 @@ async def handle_educational_docs(update: Update, context: ContextTypes.DEFAULT_
 async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
 
+    # Wait for the uploads still running in the background and collect their links
+    testimonial_links, failed_testimonials = await collect_uploads(context, user_id, "Testimonials")
+    education_links, failed_education = await collect_uploads(context, user_id, "Educational Docs")
+    if failed_testimonials or failed_education:
+        await report_failed_uploads(update.message, failed_testimonials + failed_education)
+
     # Join testimonial and educational links into separate strings
-    testimonial_links = ", ".join(context.user_data.get('testimonial_links', []))
-    education_links = ", ".join(context.user_data.get('educational_links', []))
+    testimonial_links = ", ".join(testimonial_links)
+    education_links = ", ".join(education_links)
 
     # Prepare the data to be written to the Google Sheet
     data = [
@@ -353,21 +415,16 @@ async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
         "",  # CONFIRM_DELETE column (empty for now)
         "",  # COMMENT column (empty for now)
         testimonial_links,  # TESTIMONIALS column
-        education_links  # EDUCATIONAL_DOCS column
+        education_links,  # EDUCATIONAL_DOCS column
+        context.user_data.get('PROFESSION_ID', '')  # PROFESSION_ID column
     ]
     print("DATA TO WRITE:", data)
     try:
-        worksheet = sheet  # Use the global `sheet` variable
-
-        # Update the row if it exists, otherwise append a new row
-        # Need to find the row again here in case the sheet changed since registration started
-        # This part might need refinement if concurrent registrations are expected.
-        # For simplicity, let's assume find_user_row is reliable here after gathering all data.
-        row_idx, _ = find_user_row(user_id)
-        if row_idx:
-             worksheet.update(f"A{row_idx}:K{row_idx}", [data]) # Use found row_idx
-        else:
-            worksheet.append_row(data)
+        # Save locally (creates or replaces the profile); the mirror appends/updates the sheet row
+        local_store.save_professional(user_id, dict(zip(sheet_columns(), data)))
+        profile_cache.put(user_id, dict(zip(sheet_columns(), data)))
+        phone_index.add(user_id, context.user_data.get('phone', ''))
+        mirror.notify()
 
 
         # Notify the user of successful registration
@@ -385,7 +442,11 @@ async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    _, row = find_user_row(user_id)
+    row = profile_cache.get(user_id)
+    if row is None:
+        _, row = find_user_row(user_id)
+        if row:
+            profile_cache.put(user_id, row)
     if not row:
         await update.message.reply_text("You are not registered. please click regiser. / አልተመዘገቡም. እባክዎ ምዝገባ የሚለውን ተጭነው ይመዝገቡ", reply_markup=main_menu_markup)
         return
@@ -414,7 +475,13 @@ async def editprofile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     context.user_data['edit_row_idx'] = row_idx
     context.user_data['user_id'] = user_id # Store user_id for logging if needed
+    context.user_data['pending_edits'] = {} # Changes staged until the user presses Save
 
+    await update.message.reply_text("Which information would you like to update? / የትኛውን መረጃዎን ማስተካከል ይፈልጋሉ?", reply_markup=edit_menu_markup({}))
+    return ASK_EDIT_FIELD
+
+def edit_menu_markup(pending):
+    """Field menu of the edit flow; offers Save once at least one change is staged."""
     keyboard = [
         [InlineKeyboardButton("📝 Full Name / ሙሉ ስም", callback_data="edit_name")],
         [InlineKeyboardButton("🛠️ Profession / ሙያ", callback_data="edit_profession")],
@@ -423,13 +490,45 @@ async def editprofile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("🗺️ Region/City/Woreda / ክልል/ከተማ/ወረዳ", callback_data="edit_address")],
         [InlineKeyboardButton("📄 Testimonials / ምስክር ወረቀቶች", callback_data="edit_testimonials")],
         [InlineKeyboardButton("🎓 Educational Docs / የትምህርት ማስረጃ", callback_data="edit_education")],
-        [InlineKeyboardButton("❌ Cancel / አቋርጥ", callback_data="edit_cancel")],
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.message.reply_text("Which information would you like to update? / የትኛውን መረጃዎን ማስተካከል ይፈልጋሉ?", reply_markup=reply_markup)
+    if pending:
+        keyboard.append([InlineKeyboardButton("💾 Save changes / ለውጦቹን አስቀምጥ", callback_data="edit_save")])
+    keyboard.append([InlineKeyboardButton("❌ Cancel / አቋርጥ", callback_data="edit_cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+def staged_field_names(pending):
+    # PROFESSION_ID follows PROFESSION and is not shown to the user
+    return ", ".join(name.lower() for name in pending if name != "PROFESSION_ID")
+
+async def stage_edit(message, context: ContextTypes.DEFAULT_TYPE, fields, note):
+    """Adds changes to the edit session and shows the field menu again."""
+    pending = context.user_data.setdefault('pending_edits', {})
+    pending.update(fields)
+    await message.reply_text(note, reply_markup=ReplyKeyboardRemove())
+    return await show_edit_menu(message, context)
+
+async def show_edit_menu(message, context: ContextTypes.DEFAULT_TYPE):
+    pending = context.user_data.get('pending_edits', {})
+    text = "Choose another field to change, or Save. / ሌላ መረጃ ይምረጡ ወይም ለማስቀመጥ Save ይጫኑ።"
+    if pending:
+        text = f"Changes not saved yet: {staged_field_names(pending)}\n" + text
+    await message.reply_text(text, reply_markup=edit_menu_markup(pending))
     return ASK_EDIT_FIELD
 
+async def save_edits(query, context: ContextTypes.DEFAULT_TYPE):
+    """Commits every staged change of the edit session in one write."""
+    pending = context.user_data.get('pending_edits', {})
+    await query.edit_message_reply_markup(reply_markup=None)
+    if not pending:
+        text = "Nothing to save. / ምንም ለውጥ የለም።"
+    elif await update_profile_fields(context, pending):
+        text = f"✅ Your {staged_field_names(pending)} have been updated. / መረጃዎ ተስተካክሏል።"
+    else:
+        text = "❌ Sorry, there was an error updating your information. Please try again later."
+    context.user_data.clear()
+    await context.bot.send_message(chat_id=query.message.chat_id, text=text, reply_markup=main_menu_markup)
+    return ConversationHandler.END
+
 async def ask_edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles the user's choice of field to edit."""
     query = update.callback_query
@@ -441,6 +540,9 @@ async def ask_edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=query.message.chat_id, text="Main Menu:", reply_markup=main_menu_markup) # Send main menu again
         return ConversationHandler.END
 
+    if query.data == "edit_save":
+        return await save_edits(query, context)
+
     edit_option = EDIT_OPTIONS.get(query.data)
     if not edit_option:
         await query.edit_message_text("Invalid option selected. Please try again። / የተሳሳተ አማርጭ መርጠዋል። እንደገና ይሞክሩ።")
@@ -462,7 +564,7 @@ async def ask_edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
          reply_markup_to_send=ReplyKeyboardMarkup(location_button, one_time_keyboard=True, resize_keyboard=True)
     elif edit_option['name'] in ["Testimonials", "Educational Docs"]:
          # Prepare for file uploads and show skip/done keyboard
-         context.user_data['new_file_links'] = []
+         discard_uploads(context, query.from_user.id, edit_option['name'])
          context.user_data['file_type_being_edited'] = edit_option['name'] # Track which file type
          reply_markup_to_send = skip_done_markup # Show skip/done keyboard
 
@@ -486,17 +588,16 @@ async def get_new_text_value(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if not is_valid_phone_number(new_value):
             await update.message.reply_text("Invalid phone number format. Please enter a valid phone number (e.g., +251912345678 or 0912345678): / የስልክ ቁጥርዎ ትክክል አይደለም። ትክክለኛ ስልክ ቁጥር ያስገቡ (ለምሳሌ +251912345678 ወይም 0912345678):")
             return GET_NEW_VALUE # Stay in the GET_NEW_VALUE state for phone
+        if phone_taken_by_other(new_value, context.user_data.get('user_id')):
+            await report_phone_taken(update.message)
+            return GET_NEW_VALUE
+        new_value = normalize_phone(new_value)
 
-    # If it's not the phone field or if the phone number is valid
-    success = await update_sheet_cell(context, field_name, new_value)
-
-    if success:
-        await update.message.reply_text(f"✅ Your {field_name.lower()} has been updated.", reply_markup=main_menu_markup)
-    else:
-        await update.message.reply_text("❌ Sorry, there was an error updating your information. Please try again later.", reply_markup=main_menu_markup)
-
-    context.user_data.clear()
-    return ConversationHandler.END
+    changes = {field_name: new_value}
+    if field_name == "PROFESSION":
+        # Keep the canonical profession id in step with the free text
+        changes["PROFESSION_ID"] = resolve_profession(new_value) or ""
+    return await stage_edit(update.message, context, changes, f"✅ New {field_name.lower()} noted. / ተመዝግቧል።")
 
 async def get_new_location_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles updated location input (GPS or skip)."""
@@ -511,9 +612,8 @@ async def get_new_location_value(update: Update, context: ContextTypes.DEFAULT_T
         new_value = "Not shared"
     else:
         # If user sent text other than 'skip' when location was expected
-         await update.message.reply_text("Invalid input. Please share location or use the 'Skip' button.", reply_markup=main_menu_markup) # Guide user to use button
-         context.user_data.clear()
-         return ConversationHandler.END
+         await update.message.reply_text("Invalid input. Please share location or use the 'Skip' button.") # Guide user to use button
+         return GET_NEW_LOCATION
 
 
     if not field_name:
@@ -521,15 +621,7 @@ async def get_new_location_value(update: Update, context: ContextTypes.DEFAULT_T
          context.user_data.clear()
          return ConversationHandler.END
 
-    success = await update_sheet_cell(context, field_name, new_value)
-
-    if success:
-        await update.message.reply_text(f"✅ Your {field_name.lower()} has been updated.", reply_markup=main_menu_markup)
-    else:
-        await update.message.reply_text("❌ Sorry, there was an error updating your information. Please try again later.", reply_markup=main_menu_markup)
-
-    context.user_data.clear()
-    return ConversationHandler.END
+    return await stage_edit(update.message, context, {field_name: new_value}, f"✅ New {field_name.lower()} noted. / ተመዝግቧል።")
 
 async def handle_new_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles file uploads (testimonials/educational docs) during edit."""
@@ -544,24 +636,18 @@ async def handle_new_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text:
         text = update.message.text.lower()
         if "done" in text or "skip" in text or "ተጠናቋል" in text or "አሳልፍ" in text:
-            # Combine collected links
-            final_links = ", ".join(context.user_data.get('new_file_links', []))
+            # Wait for the background uploads and combine their links
+            new_links, failed = await collect_uploads(context, update.message.from_user.id, field_name)
+            if failed:
+                await report_failed_uploads(update.message, failed)
+            final_links = ", ".join(new_links)
             if ("skip" in text or "አሳልፍ" in text) and not final_links:
                 final_links = "Skipped"
             elif ("done" in text or "ተጠናቋል" in text) and not final_links:
-                 await update.message.reply_text(f"No new files uploaded. Keeping existing {field_name.lower()}.", reply_markup=main_menu_markup)
-                 context.user_data.clear()
-                 return ConversationHandler.END
-
-
-            success = await update_sheet_cell(context, field_name, final_links)
-            if success:
-                 await update.message.reply_text(f"✅ Your {field_name.lower()} have been updated.", reply_markup=main_menu_markup)
-            else:
-                 await update.message.reply_text(f"❌ Error saving your {field_name.lower()}. Please try again.", reply_markup=main_menu_markup)
+                 await update.message.reply_text(f"No new files uploaded. Keeping existing {field_name.lower()}.", reply_markup=ReplyKeyboardRemove())
+                 return await show_edit_menu(update.message, context)
 
-            context.user_data.clear()
-            return ConversationHandler.END
+            return await stage_edit(update.message, context, {field_name: final_links}, f"✅ New {field_name.lower()} noted. / ተመዝግቧል።")
 
     # Process uploaded file
     if update.message.document or update.message.photo:
@@ -571,23 +657,8 @@ async def handle_new_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         folder_id = testimonial_folder_id if field_name == "Testimonials" else education_folder_id
 
-        file = update.message.document or update.message.photo[-1]
-        file_id = file.file_id
         try:
-            file_obj = await context.bot.get_file(file_id)
-
-            with tempfile.NamedTemporaryFile(delete=False) as tf:
-                temp_path = tf.name
-                await file_obj.download_to_drive(temp_path)
-
-            filename = getattr(file, 'file_name', None) or f"photo_{file_id}.jpg"
-            link = upload_to_drive(temp_path, folder_id, filename)
-
-            if 'new_file_links' not in context.user_data:
-                context.user_data['new_file_links'] = []
-            context.user_data['new_file_links'].append(link)
-
-            os.remove(temp_path)
+            queue_message_upload(context, update.message, folder_id, field_name)
 
             await update.message.reply_text("File received. Upload more or select an option:", reply_markup=skip_done_markup)
             return context.user_data['next_edit_state']
@@ -617,7 +688,10 @@ async def confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check for 'Yes' button text (case-insensitive, considering both English and Amharic button text)
     if update.message.text and ("yes" in update.message.text.lower() or "አዎ" in update.message.text.lower()):
         try:
-            sheet.delete_rows(context.user_data['row_idx'])
+            local_store.delete_professional(update.message.from_user.id)
+            phone_index.remove(update.message.from_user.id)
+            profile_cache.invalidate(update.message.from_user.id)
+            mirror.notify() # The mirror deletes the sheet row
             await update.message.reply_text("Profile deleted. / መረጃዎ ተደምስሷል", reply_markup=main_menu_markup) # Add main menu markup
         except:
             await update.message.reply_text("Service is temporarily unavailable. Please try again later.", reply_markup=main_menu_markup) # Add main menu markup
@@ -637,19 +711,54 @@ async def comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def save_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     comment_text = update.message.text
-    row_idx = context.user_data.get('row_idx')
-    if not row_idx:
-        await update.message.reply_text("Could not locate your registration. ምዝገባዎን ማገኘት አልቻልንም", reply_markup=main_menu_markup)
-        return ConversationHandler.END
+    user_id = update.message.from_user.id
     try:
-        sheet.update(range_name=f'I{row_idx}', values=[[comment_text]])
-        await update.message.reply_text("Comment saved.", reply_markup=main_menu_markup)
+        saved = local_store.update_professional(user_id, {"COMMENT": comment_text})
+        if saved:
+            profile_cache.update(user_id, {"COMMENT": comment_text})
+            mirror.notify()
     except:
         await update.message.reply_text("Service is temporarily unavailable. Please try again later.", reply_markup=main_menu_markup)
+        return ConversationHandler.END
+    if not saved:
+        await update.message.reply_text("Could not locate your registration. ምዝገባዎን ማገኘት አልቻልንም", reply_markup=main_menu_markup)
+        return ConversationHandler.END
+    await update.message.reply_text("Comment saved.", reply_markup=main_menu_markup)
     return ConversationHandler.END
 
 
 
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export professionals|requests [csv|jsonl|parquet] [region=...] [profession=...], for ADMIN_USER_IDS only."""
+    if update.message.from_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("This command is only available to administrators. / ይህ ትዕዛዝ ለአስተዳዳሪዎች ብቻ ነው።")
+        return
+    args = [arg for arg in context.args if "=" not in arg]
+    options = dict(arg.split("=", 1) for arg in context.args if "=" in arg)
+    sheet_name = args[0].lower() if args else ""
+    fmt = args[1].lower() if len(args) > 1 else "csv"
+    if sheet_name not in export.SHEETS or fmt not in export.FORMATS:
+        await update.message.reply_text("Usage: /export professionals|requests [csv|jsonl|parquet] [region=...] [profession=...]")
+        return
+    # Runs in the background: an export can take minutes and the bot keeps answering meanwhile
+    context.application.create_task(send_export(update.message, sheet_name, fmt, options), update=update)
+    await update.message.reply_text("⏳ Export started, the file will be sent here when it is ready (a few minutes for large sheets).")
+
+
+async def send_export(message, sheet_name, fmt, options):
+    """Exports the sheet to a temporary file and sends it as a reply to the /export message."""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, f"{sheet_name}.{fmt}")
+        try:
+            read, written = await run_io(export.export_to_file, sheet_name, fmt, path,
+                                         options.get("region"), options.get("profession"), timeout=EXPORT_TIMEOUT)
+            with open(path, "rb") as f:
+                await message.reply_document(f, filename=f"{sheet_name}.{fmt}", caption=f"{written} of {read} rows")
+        except Exception as e:
+            logger.error(f"Export of {sheet_name} failed: {e}")
+            await message.reply_text(f"❌ Export failed: {e}")
+
+
 # --- NEW: Global Error Handler ---
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -682,16 +791,89 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    discard_uploads(context, update.message.from_user.id)
     await update.message.reply_text("Cancelled.", reply_markup=main_menu_markup)
     return ConversationHandler.END
 
-def main():
-    app = Application.builder().token(TOKEN).build()
+sheets_loader = None # Background task of connect_sheets() when the local store was already warm
+
+def index_phone_numbers():
+    for user_id, row in local_store.professionals():
+        phone_index.sync_row(user_id, row)
+    logger.info(f"Indexed {len(phone_index)} profile phone numbers")
+
+async def connect_sheets():
+    """Loads the User ID index from the sheet, then starts mirroring local changes to it."""
+    with bot_runtime.startup_phase("debo.sheets"):
+        # Build the User ID index once (from the previous process's snapshot after a
+        # restart), then keep it in step with manual sheet edits
+        if not user_index.loaded:
+            await run_io(user_index.load_warm, timeout=SHEET_LOAD_TIMEOUT)
+    user_index.run_reconcile_loop(SHEET_RECONCILE_SECONDS)
+    # Profiles only on the sheet (all of them on the first start; registered before a
+    # bulk import filled the store) are taken into the store
+    sheet_rows = dict(user_index.items())
+    seeded = local_store.seed_professionals(sheet_rows.items())
+    if seeded:
+        logger.info(f"Seeded local store with {len(seeded)} profiles from the sheet")
+        for user_id in seeded:
+            phone_index.sync_row(user_id, sheet_rows[user_id])
+    mirror.start() # Needs the index: it gives the sheet row of each profile
+
+async def connect_sheets_in_background(retry_seconds=30):
+    while True:
+        try:
+            return await connect_sheets()
+        except Exception as e:
+            logger.error(f"Error connecting to the Professionals sheet, retrying in {retry_seconds}s: {e}")
+            await asyncio.sleep(retry_seconds)
+
+async def on_startup(application):
+    global sheets_loader
+    index_phone_numbers()
+    profile_feed.start()
+    if local_store.count_professionals():
+        # Profiles are served from the local store, so answer right away and let
+        # the sheet connect in the background
+        sheets_loader = asyncio.create_task(connect_sheets_in_background())
+    else:
+        # Nothing stored locally yet (first start, fresh disk): the sheet is the only copy
+        await connect_sheets()
+
+async def on_shutdown(application):
+    await profile_feed.stop()
+    if sheets_loader is not None and not sheets_loader.done():
+        # The mirror was never started: local changes stay in the outbox for the next start
+        sheets_loader.cancel()
+        return
+    await mirror.stop()
+    # Hand the index over to the next process (see sheet_index.SHEET_SNAPSHOT_MAX_AGE)
+    try:
+        await run_io(user_index.save_snapshot)
+    except Exception as e:
+        logger.error(f"Error saving the User ID index snapshot: {e}")
+    logger.info(f"Profile mirror stopped: {mirror.metrics()}")
+    logger.info(f"Profile cache: {profile_cache.metrics()}")
+
+def build_application(request=None):
+    builder = (Application.builder().token(TOKEN)
+               .persistence(SQLitePersistence("debo")) # In-progress conversations survive restarts
+               .post_init(on_startup)
+               .post_shutdown(on_shutdown))
+    # Pool shared with other bots in this process, or a private one; both trace Bot API calls
+    builder = builder.request(request or bot_runtime.new_request())
+    builder = bot_runtime.configure_api_server(builder)
+    # Users are served concurrently; each user's own updates still run one at a time
+    builder = builder.concurrent_updates(bot_runtime.per_user_update_processor())
+    app = builder.build()
     app.add_handler(ChatMemberHandler(greet_new_user, ChatMemberHandler.MY_CHAT_MEMBER))
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("profile", profile))
+    app.add_handler(CommandHandler("export", export_command))
 
     register_conv = ConversationHandler(
+        name="register",
+        persistent=True,
         entry_points=[CommandHandler("register", register)],
         states={
             FULL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_full_name)],
@@ -707,6 +889,8 @@ def main():
 
      # --- Edit Profile Conversation --- (NEW/MODIFIED)
     edit_conv = ConversationHandler(
+        name="edit",
+        persistent=True,
         entry_points=[CommandHandler("editprofile", editprofile)],
         states={
             ASK_EDIT_FIELD: [CallbackQueryHandler(ask_edit_field)],
@@ -725,6 +909,8 @@ def main():
     )
 
     delete_conv = ConversationHandler(
+        name="delete",
+        persistent=True,
         entry_points=[CommandHandler("deleteprofile", deleteprofile)],
         states={
             CONFIRM_DELETE: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_delete)],
@@ -733,6 +919,8 @@ def main():
     )
 
     comment_conv = ConversationHandler(
+        name="comment",
+        persistent=True,
         entry_points=[CommandHandler("comment", comment)],
         states={
             COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_comment)],
@@ -743,10 +931,6 @@ def main():
     app.add_handler(edit_conv)
     app.add_handler(delete_conv)
     app.add_handler(comment_conv)
-    app.add_handler(register_conv)
-    app.add_handler(edit_conv)
-    app.add_handler(delete_conv)
-    app.add_handler(comment_conv)
     app.add_handler(CommandHandler("cancel", cancel))
     app.add_handler(CommandHandler("editprofile", editprofile))
     app.add_handler(CommandHandler("profile", profile))
@@ -754,7 +938,19 @@ def main():
     # Add the error handler to catch exceptions during update processing
     app.add_error_handler(error_handler) # <--- This line adds the new feature
 
-    app.run_polling()
+    # Per-handler counts/latency and queue depths for GET /metrics
+    metrics.instrument_application(app, "debo")
+    metrics.queue_depth.add_source(lambda: {
+        ("drive_uploads",): uploads.depth(),
+        ("professionals_mirror",): local_store.outbox_depth("Professionals"),
+    })
+    return app
+
+bot_runtime.record_startup_phase("debo.imported", bot_runtime.process_uptime())
+
+def main():
+    app = build_application()
+    bot_runtime.run({"debo": app}) # Webhook or polling, see bot_runtime.WEBHOOK_BASE_URL
 
 if __name__ == '__main__':
     main()
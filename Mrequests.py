@@ -1,30 +1,26 @@
 # Professional_request_bot.py
 
+import asyncio
 import logging
-from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import (Application, CommandHandler, MessageHandler, filters,
-                          ConversationHandler, ContextTypes)
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import re
+import os
+import uuid
 from datetime import datetime
-import logging
-import json
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (Application, CommandHandler, MessageHandler, filters,
-                          ConversationHandler, ContextTypes, ChatMemberHandler,
-                          CallbackQueryHandler)
-from telegram.error import NetworkError, TelegramError # <--- Added NetworkError and TelegramError imports
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import tempfile
-import os
-
+                          ConversationHandler, ContextTypes)
+import google_clients
+from storage import AsyncWorksheet, run_io
+from write_queue import BatchAppender, FileJournal
+from local_store import get_store, ProfileChangeFeed
+from sheet_index import shared_index
+from geo_index import GeoIndex, parse_lat_lon
+from professions import profession_key, resolve_profession
+from phones import PhoneIndex, is_valid_phone_number, normalize_phone
+from persistence import SQLitePersistence
+import bot_runtime
+import metrics
+import tracing
 
-import re # Import the regular expression module
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN2")
 if not TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable not set.")
@@ -37,27 +33,49 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-# Google Sheets setup
-# Make sure you have your service account key file named 'service_account_key.json'
-# in the same directory as your script, or provide the correct path.
-# Replace 'YOUR_SERVICE_ACCOUNT_FILE.json' with the actual name of your JSON key file
+# Google Sheets setup (service-account JSON is read from the environment).
+# Sheets are opened on first use, from on_startup() and the request writer, not at import.
+CREDENTIALS_ENV = "deboregistration"
 try:
-    
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    # Replace 'YOUR_SERVICE_ACCOUNT_FILE.json' with the actual name of your JSON key file
-    creds_json_str = os.environ.get("deboregistration")
-    if not creds_json_str:
-        raise ValueError("GOOGLE_CREDENTIALS_JSON environment variable not set.")
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=".json") as temp_creds_file:
-        temp_creds_file.write(creds_json_str)
-        temp_file_path = temp_creds_file.name
-    creds = ServiceAccountCredentials.from_json_keyfile_name(temp_file_path, scope)
-    client = gspread.authorize(creds)
-    sheet = client.open("Requests").sheet1
+    # Credentials/client are shared with other bots in the same process
+    sheet = google_clients.open_sheet(CREDENTIALS_ENV, "Requests")
+    requests_sheet = AsyncWorksheet(sheet)
+    # Requests are stored locally (SQLite) and appended to the sheet in batches from the outbox
+    requests_journal = get_store().requests_journal()
+    legacy_queue_path = os.environ.get("REQUESTS_QUEUE_PATH", "requests_queue.jsonl")
+    if os.path.exists(legacy_queue_path):
+        # Move rows left in the old file queue into the store
+        for _, row in FileJournal(legacy_queue_path).replay():
+            requests_journal.append(row)
+        os.remove(legacy_queue_path)
+    request_writer = BatchAppender(
+        requests_sheet,
+        journal=requests_journal,
+        row_key=lambda row: request_key(row),
+        sheet_keys=lambda: requests_on_sheet(),
+        batch_size=int(os.environ.get("REQUESTS_BATCH_SIZE", "50")),
+        flush_interval=float(os.environ.get("REQUESTS_FLUSH_SECONDS", "2")),
+    )
   
 except Exception as e:
     logger.error(f"Error connecting to Google Sheet: {e}")
     sheet = None # Handle the case where sheet connection fails
+    requests_sheet = None
+    request_writer = None
+
+# Registered professionals, for matching "Near Me" requests. Loaded from the sheet,
+# then kept in step with the registration bot's writes through the shared local
+# store (within PROFILE_CHANGES_POLL_SECONDS, even when it runs in another process)
+# and with manual sheet edits by periodically reconciling against the sheet.
+NEAR_ME_MAX_MATCHES = int(os.environ.get("NEAR_ME_MAX_MATCHES", "30"))
+professionals_geo = GeoIndex(profession_key=profession_key)
+profile_feed = ProfileChangeFeed(get_store(), professionals_geo.sync_row)
+try:
+    professionals_index = shared_index(google_clients.open_sheet(CREDENTIALS_ENV, "Professionals"), key_column="User ID")
+    professionals_index.subscribe(professionals_geo.sync_row)
+except Exception as e:
+    logger.error(f"Error connecting to Professionals sheet, Near Me matching disabled: {e}")
+    professionals_index = None
 
 # States for conversation
 (REQUEST_PROFESSIONAL_FULL_NAME, REQUEST_PROFESSIONAL_PHONE, REQUEST_PROFESSIONAL_TYPE,
@@ -92,31 +110,113 @@ location_request_keyboard = ReplyKeyboardMarkup(
 def is_main_menu_button(text):
     return text in ["REQUEST PROFESSIONAL | ባለሙያ ይጠይቁ", "COMPLAINT OR COMMENT | ቅሬታ ወይም አስተያየት"]
 
-# Helper function to validate phone number
-def is_valid_phone_number(phone_number: str) -> bool:
-    """
-    Validates if the input string looks like a valid phone number.
-    Allows digits, spaces, hyphens, parentheses, and an optional leading plus sign.
-    Requires at least 7 digits.
-    """
-    cleaned_number = re.sub(r'[()\s-]', '', phone_number)
-    if re.fullmatch(r'^\+?\d{7,}$', cleaned_number):
-        return True
-    return False
-
-# Helper function to save data to Google Sheet
-def save_request_data(data):
-    if sheet is None:
+# Helper function to save data to Google Sheet (queued, flushed in the background)
+async def save_request_data(data):
+    if request_writer is None:
         logger.error("Google Sheet connection failed, cannot save data.")
         return False
     try:
-        sheet.append_row(data)
-        logger.info("Data successfully appended to Google Sheet.")
+        await request_writer.enqueue(data)
+        logger.info(f"Data queued for Google Sheet ({request_writer.depth} pending).")
         return True
     except Exception as e:
-        logger.error(f"Error appending data to Google Sheet: {e}")
+        logger.error(f"Error queueing data for Google Sheet: {e}")
         return False
 
+# Normalized requester phone -> request_key() of each request made with it,
+# so repeat requesters are recognised without scanning the Requests sheet
+requester_history = PhoneIndex()
+
+def request_key(data_row):
+    """The row's Request ID (column M); "user_id@timestamp" for rows saved before it existed."""
+    if len(data_row) > 12 and data_row[12]:
+        return data_row[12]
+    return f"{data_row[8]}@{data_row[10]}"
+
+async def requests_on_sheet():
+    """request_key() of every row on the Requests sheet (User ID is column I, Timestamp K, Request ID M)."""
+    rows = await requests_sheet.get("I2:M")
+    return {row[4] if len(row) > 4 and row[4] else f"{row[0]}@{row[2]}" for row in rows if len(row) > 2}
+
+def load_requester_history():
+    for _, row in get_store().requests():
+        if isinstance(row, list) and len(row) > 10:
+            requester_history.add(request_key(row), row[1])
+    logger.info(f"Indexed {len(requester_history)} requester phone numbers")
+
+professionals_loader = None # Background task of load_professionals()
+
+async def load_professionals():
+    """Loads the Professionals sheet for Near Me matching; until then requests get no matches."""
+    if not professionals_index.loaded:
+        try:
+            with bot_runtime.startup_phase("mrequests.sheets"):
+                await run_io(professionals_index.load_warm, timeout=float(os.environ.get("SHEET_LOAD_TIMEOUT", "120")))
+        except Exception as e:
+            logger.error(f"Error loading Professionals sheet, will retry on next reconcile: {e}")
+    # After the load, so the sheet's rows do not overwrite newer local changes;
+    # the feed starts by replaying the recent ones the sheet may not have yet
+    profile_feed.start()
+    professionals_index.run_reconcile_loop(int(os.environ.get("SHEET_RECONCILE_SECONDS", "300")))
+
+async def on_startup(application):
+    global professionals_loader
+    try:
+        await run_io(load_requester_history)
+    except Exception as e:
+        logger.error(f"Error indexing requester phone numbers: {e}")
+    if professionals_index is not None:
+        # Requests are saved locally, so start answering while the sheet loads
+        professionals_loader = asyncio.create_task(load_professionals())
+    if request_writer is not None:
+        request_writer.start()
+
+async def stop_request_writer(application):
+    await profile_feed.stop()
+    if professionals_loader is not None and not professionals_loader.done():
+        professionals_loader.cancel()
+    elif professionals_index is not None:
+        try:
+            await run_io(professionals_index.save_snapshot) # Warm start for the next process
+        except Exception as e:
+            logger.error(f"Error saving the Professionals index snapshot: {e}")
+    if request_writer is not None:
+        await request_writer.stop()
+        logger.info(f"Request writer stopped: {request_writer.metrics()}")
+
+def requested_match_count(text):
+    """Maps the count button ("3", "5", ..., "More than 20") to how many matches to return."""
+    try:
+        return max(1, min(int(text), NEAR_ME_MAX_MATCHES))
+    except (TypeError, ValueError):
+        return NEAR_ME_MAX_MATCHES
+
+def find_nearby_professionals(location_text, professional_type, count):
+    """
+    Returns [(distance_km, row)] for the closest registered professionals of that type.
+    Rows come from the local store, like the geo index's updates, so a profile saved
+    moments ago is shown as saved; the sheet index only covers profiles not in the store.
+    """
+    location = parse_lat_lon(location_text)
+    if professionals_index is None or location is None:
+        return []
+    with tracing.span("geo.nearest"):
+        nearest = professionals_geo.nearest(location[0], location[1], count, professional_type)
+    store = get_store()
+    matches = []
+    for distance, user_id in nearest:
+        row = store.get_professional(user_id) or professionals_index.get(user_id)[1]
+        if row:
+            matches.append((distance, row))
+    return matches
+
+def format_matches(matches):
+    lines = ["Professionals near you / በአቅራቢያዎ ያሉ ባለሙያዎች:"]
+    for number, (distance, row) in enumerate(matches, start=1):
+        lines.append(f"{number}. {row.get('Full_Name', '')} - {row.get('PROFESSION', '')} - "
+                     f"{row.get('PHONE', '')} ({distance:.1f} km)")
+    return "\n".join(lines)
+
 # Handlers for REQUEST PROFESSIONAL flow
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -153,6 +253,10 @@ async def get_requester_phone(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Invalid phone number format. Please enter a valid phone number (e.g., +251912345678 or 0912345678):\nየስልክ ቁጥር ቅርጸት ትክክል አይደለም። እባክዎ ትክክለኛ የስልክ ቁጥር ያስገቡ (ለምሳሌ +251912345678 ወይም 0912345678):")
         return REQUEST_PROFESSIONAL_PHONE # Stay in the PHONE state
 
+    phone_number = normalize_phone(phone_number) # Stored in E.164 (+2519...)
+    previous_requests = len(requester_history.keys(phone_number))
+    if previous_requests:
+        logger.info(f"Requester {update.message.from_user.id} has {previous_requests} earlier request(s) from this number")
     context.user_data['requester_phone'] = phone_number
     await update.message.reply_text("What type of professional are you looking for?\nየምን አይነት ባለሙያ ይፈልጋሉ?")
     return REQUEST_PROFESSIONAL_TYPE
@@ -164,6 +268,7 @@ async def get_professional_type(update: Update, context: ContextTypes.DEFAULT_TY
         return REQUEST_PROFESSIONAL_TYPE # Stay in the current state
 
     context.user_data['professional_type'] = update.message.text
+    context.user_data['professional_type_id'] = resolve_profession(update.message.text) or ""
     await update.message.reply_text(
         "How should the professionals be filtered?\nባለሙያዎቹ እንዴት ተደርገው ይፈለጉ?",
         reply_markup=professional_filter_markup
@@ -245,14 +350,25 @@ async def get_professional_count(update: Update, context: ContextTypes.DEFAULT_T
         "", # Placeholder for Complaint/Comment
         update.message.from_user.id, # User ID
         update.message.from_user.username if update.message.from_user.username else "N/A", # Username
-        request_timestamp # Add the timestamp here
+        request_timestamp, # Add the timestamp here
+        context.user_data.get('professional_type_id', ''), # Canonical profession id
+        uuid.uuid4().hex # Request ID: tells rows apart when the timestamps are equal
     ]
 
-    if save_request_data(data_row):
+    if await save_request_data(data_row):
+        requester_history.add(request_key(data_row), data_row[1])
         await update.message.reply_text(
             "Thank you! Your request has been submitted. We will get back to you shortly.\nአመሰግናለሁ! ጥያቄዎ ገብቷል. በቅርቡ ምላሽ እንሰጥዎታለን።",
             reply_markup=main_menu_markup
         )
+        if context.user_data.get('professional_filter') == "Near Me":
+            matches = find_nearby_professionals(
+                context.user_data.get('requester_location'),
+                context.user_data.get('professional_type', ''),
+                requested_match_count(count)
+            )
+            if matches:
+                await update.message.reply_text(format_matches(matches), reply_markup=main_menu_markup)
     else:
         await update.message.reply_text(
             "Sorry, there was an error submitting your request. Please try again later.\nይቅርታ፣ ጥያቄዎን በማስገባት ላይ ስህተት ተፈጥሯል። እባክዎ ቆይተው እንደገና ይሞክሩ።",
@@ -288,10 +404,12 @@ async def save_complaint_comment(update: Update, context: ContextTypes.DEFAULT_T
         comment_text, # Complaint/Comment
         update.message.from_user.id, # User ID
         update.message.from_user.username if update.message.from_user.username else "N/A", # Username
-        comment_timestamp # Add the timestamp here as well
+        comment_timestamp, # Add the timestamp here as well
+        "", # No profession for comments
+        uuid.uuid4().hex # Request ID
     ]
 
-    if save_request_data(data_row):
+    if await save_request_data(data_row):
         await update.message.reply_text(
             "Thank you! Your complaint or comment has been submitted.\nአመሰግናለሁ! ቅሬታዎ ወይም አስተያየትዎ ገብቷል።",
             reply_markup=main_menu_markup
@@ -315,14 +433,25 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     return ConversationHandler.END
 
-def main():
+def build_application(request=None):
     # Replace with your new bot token
-    app = Application.builder().token(TOKEN).build()
+    builder = (Application.builder().token(TOKEN)
+               .persistence(SQLitePersistence("mrequests")) # In-progress conversations survive restarts
+               .post_init(on_startup)
+               .post_shutdown(stop_request_writer))
+    # Pool shared with other bots in this process, or a private one; both trace Bot API calls
+    builder = builder.request(request or bot_runtime.new_request())
+    builder = bot_runtime.configure_api_server(builder)
+    # Users are served concurrently; each user's own updates still run one at a time
+    builder = builder.concurrent_updates(bot_runtime.per_user_update_processor())
+    app = builder.build()
     # Handler for the /start command
     app.add_handler(CommandHandler("start", start))
 
     # Conversation handler for REQUEST PROFESSIONAL
     request_professional_conv = ConversationHandler(
+        name="request_professional",
+        persistent=True,
         entry_points=[MessageHandler(filters.Regex("^REQUEST PROFESSIONAL | ባለሙያ ይጠይቁ$"), request_professional_entry)],
         states={
             REQUEST_PROFESSIONAL_FULL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_requester_full_name)],
@@ -338,6 +467,8 @@ def main():
 
     # Conversation handler for COMPLAINT OR COMMENT
     complaint_comment_conv = ConversationHandler(
+        name="complaint_comment",
+        persistent=True,
         entry_points=[MessageHandler(filters.Regex("^COMPLAINT OR COMMENT | ቅሬታ ወይም አስተያየት$"), complaint_comment_entry)],
         states={
             COMPLAINT_COMMENT_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_complaint_comment)],
@@ -351,8 +482,17 @@ def main():
     # Add a handler for any other text that is not part of a conversation, to show the main menu
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, start))
 
+    # Per-handler counts/latency and queue depths for GET /metrics
+    metrics.instrument_application(app, "mrequests")
+    if request_writer:
+        metrics.queue_depth.add_source(lambda: {("requests_writer",): request_writer.depth})
+    return app
+
+bot_runtime.record_startup_phase("mrequests.imported", bot_runtime.process_uptime())
 
-    app.run_polling()
+def main():
+    app = build_application()
+    bot_runtime.run({"mrequests": app}) # Webhook or polling, see bot_runtime.WEBHOOK_BASE_URL
 
 if __name__ == '__main__':
     main()
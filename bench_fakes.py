@@ -0,0 +1,354 @@
+# bench_fakes.py
+"""
+In-process stand-ins for the Telegram Bot API, Google Sheets and Drive, with
+configurable latency, so the real handlers can be benchmarked offline.
+Used by benchmark.py and loadgen.py; nothing here is imported by the bots.
+"""
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+PROFESSIONALS_HEADER = ["User ID", "Username", "Full_Name", "PROFESSION", "PHONE", "LOCATION",
+                        "Region/City/Woreda", "CONFIRM_DELETE", "COMMENT", "Testimonials",
+                        "Educational Docs", "PROFESSION_ID"]
+REQUESTS_HEADER = ["Full Name", "Phone", "Professional Type", "Filter", "Location", "Address",
+                   "Count", "Complaint/Comment", "User ID", "Username", "Timestamp", "Profession ID", "Request ID"]
+
+# Addis Ababa, where generated profiles and requests are placed
+CENTER_LAT, CENTER_LON = 9.02, 38.75
+
+
+class Latency:
+    """Injected latency in seconds per backend; `jitter` is the +/- fraction applied to each call."""
+
+    def __init__(self, telegram=0.05, sheets=0.3, drive=0.8, jitter=0.2):
+        self.telegram = telegram
+        self.sheets = sheets
+        self.drive = drive
+        self.jitter = jitter
+
+    def sample(self, base):
+        return max(0.0, base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+# --- Google ---
+class FakeCredentials:
+    service_account_email = "bench@example.iam.gserviceaccount.com"
+
+
+class FakeSpreadsheet:
+    def __init__(self, spreadsheet_id):
+        self.id = spreadsheet_id
+
+
+class FakeWorksheet:
+    """The gspread worksheet calls the bots make, on an in-memory grid, each sleeping `latency.sheets`."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, title, header, latency):
+        self.title = title
+        self.id = next(self._ids)
+        self.spreadsheet = FakeSpreadsheet(f"fake-{title}")
+        self.latency = latency
+        self.values = [list(header)]
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _io(self):
+        self.calls += 1
+        time.sleep(self.latency.sample(self.latency.sheets))
+
+    @property
+    def row_count(self):
+        with self._lock:
+            return len(self.values)
+
+    def get_all_values(self):
+        self._io()
+        with self._lock:
+            return [list(row) for row in self.values]
+
+    def row_values(self, row):
+        self._io()
+        with self._lock:
+            return list(self.values[row - 1]) if row <= len(self.values) else []
+
+    def get(self, range_name, **kwargs):
+        """
+        Rows of an "A2:L5001" (or open-ended "I2:K") range as the API returns them:
+        only the range's columns, without trailing blank cells or rows.
+        """
+        self._io()
+        with self._lock:
+            return self._range(range_name)
+
+    def batch_get(self, ranges, **kwargs):
+        self._io()
+        with self._lock:
+            return [self._range(range_name) for range_name in ranges]
+
+    def _range(self, range_name):
+        first, _, last = range_name.partition(":")
+        last = last or first
+
+        def parse(ref):
+            letters = "".join(ch for ch in ref if ch.isalpha())
+            digits = "".join(ch for ch in ref if ch.isdigit())
+            column = 0
+            for ch in letters.upper():
+                column = column * 26 + ord(ch) - ord("A") + 1
+            return column, int(digits) if digits else None
+
+        first_col, start = parse(first)
+        last_col, end = parse(last)
+        rows = []
+        for row in self.values[(start or 1) - 1:end or len(self.values)]:
+            cells = list(row[first_col - 1:last_col])
+            while cells and cells[-1] == "":
+                cells.pop()
+            rows.append(cells)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        return [dict(zip(values[0], row)) for row in values[1:]]
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values])
+
+    def append_rows(self, rows, **kwargs):
+        self._io()
+        with self._lock:
+            first = len(self.values) + 1
+            self.values.extend([str(value) for value in row] for row in rows)
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:L{first + len(rows) - 1}",
+                            "updatedRows": len(rows)}}
+
+    def update(self, range_name, values, **kwargs):
+        self.batch_update([{"range": range_name, "values": values}])
+
+    def batch_update(self, data, **kwargs):
+        self._io()
+        with self._lock:
+            for request in data:
+                row_idx = int("".join(ch for ch in request["range"].split(":")[0] if ch.isdigit()))
+                for offset, row in enumerate(request["values"]):
+                    while len(self.values) < row_idx + offset:
+                        self.values.append([])
+                    self.values[row_idx + offset - 1] = [str(value) for value in row]
+
+    def delete_rows(self, start_index, end_index=None):
+        self._io()
+        with self._lock:
+            del self.values[start_index - 1:(end_index or start_index)]
+
+
+def generate_professionals(count, seed=1):
+    """Rows for `count` registered professionals spread within ~30 km of the center."""
+    from professions import PROFESSIONS
+
+    rng = random.Random(seed)
+    profession_ids = list(PROFESSIONS)
+    rows = []
+    for n in range(count):
+        profession_id = rng.choice(profession_ids)
+        lat = CENTER_LAT + rng.uniform(-0.27, 0.27)
+        lon = CENTER_LON + rng.uniform(-0.27, 0.27)
+        rows.append([str(10_000_000 + n), f"pro{n}", f"Professional {n}", PROFESSIONS[profession_id]["en"],
+                     f"+2519{rng.randrange(10_000_000, 99_999_999)}", f"{lat:.6f}, {lon:.6f}",
+                     "Addis Ababa, Bole, 03", "", "", "", "", profession_id])
+    return rows
+
+
+def fake_drive_upload(latency, uploads):
+    """Replacement for Debo_registration.upload_to_drive; records each upload in `uploads`."""
+    def upload_to_drive(stream, folder_id, filename, mimetype=None):
+        time.sleep(latency.sample(latency.drive))
+        file_id = f"fake{len(uploads)}"
+        uploads.append((folder_id, filename, len(stream.getvalue())))
+        return f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
+    return upload_to_drive
+
+
+# --- Telegram ---
+FILE_SIZE = 256 * 1024
+_message_ids = itertools.count(1)
+
+
+def bot_api_result(method, params):
+    """The `result` the Bot API would return for the methods the bots call."""
+    if method == "getMe":
+        return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+    if method in ("sendMessage", "editMessageText", "sendPhoto", "sendDocument"):
+        chat_id = int(params.get("chat_id") or 0)
+        return {"message_id": next(_message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+    if method == "getFile":
+        file_id = params.get("file_id")
+        return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": FILE_SIZE,
+                "file_path": f"documents/{file_id}"}
+    if method == "getUpdates":
+        return []
+    return True
+
+
+def parse_bot_api_url(url):
+    """("method", is_file_download) from a Bot API or file download URL."""
+    if "/file/bot" in url:
+        return url.rsplit("/", 1)[-1], True
+    return url.rsplit("/", 1)[-1], False
+
+
+def make_fake_request(latency, stats=None):
+    """A telegram.request.BaseRequest answering every Bot API call in-process after `latency.telegram`."""
+    import asyncio
+    from telegram.request import BaseRequest
+
+    class FakeBotAPI(BaseRequest):
+        def __init__(self):
+            self.calls = stats if stats is not None else {}
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def do_request(self, url, method, request_data=None, *args, **kwargs):
+            await asyncio.sleep(latency.sample(latency.telegram))
+            api_method, is_file = parse_bot_api_url(url)
+            self.calls[api_method] = self.calls.get(api_method, 0) + 1
+            if is_file:
+                return 200, os.urandom(FILE_SIZE)
+            params = request_data.parameters if request_data is not None else {}
+            return 200, json.dumps({"ok": True, "result": bot_api_result(api_method, params)}).encode()
+
+    return FakeBotAPI()
+
+
+class UpdateFactory:
+    """Builds Bot API update dicts for a private chat with one user."""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    @property
+    def phone(self):
+        """A mobile number unique to this user, so registrations do not collide as duplicates."""
+        return f"09{self.user_id % 100_000_000:08d}"
+
+    def _message(self, **fields):
+        message = {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": {"id": self.user_id, "is_bot": False, "first_name": "Bench", "username": f"user{self.user_id}"},
+        }
+        message.update(fields)
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def text(self, text):
+        fields = {"text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return self._message(**fields)
+
+    def location(self, lat, lon):
+        return self._message(location={"latitude": lat, "longitude": lon})
+
+    def document(self, name="certificate.pdf"):
+        file_id = f"doc{next(_message_ids)}"
+        return self._message(document={"file_id": file_id, "file_unique_id": f"u{file_id}", "file_name": name,
+                                       "mime_type": "application/pdf", "file_size": FILE_SIZE})
+
+    def photo(self):
+        file_id = f"photo{next(_message_ids)}"
+        return self._message(photo=[{"file_id": file_id, "file_unique_id": f"u{file_id}",
+                                     "width": 1280, "height": 960, "file_size": FILE_SIZE}])
+
+    def callback(self, data):
+        return {"update_id": next(self._update_ids), "callback_query": {
+            "id": str(next(_message_ids)), "chat_instance": str(self.user_id), "data": data,
+            "from": {"id": self.user_id, "is_bot": False, "first_name": "Bench", "username": f"user{self.user_id}"},
+            "message": {"message_id": next(_message_ids), "date": int(time.time()),
+                        "chat": {"id": self.user_id, "type": "private"}, "text": "menu"},
+        }}
+
+
+# --- Wiring ---
+def install(workdir, latency, professionals=0):
+    """
+    Points the bots at the fakes. Must run before Debo_registration / Mrequests are
+    imported: sets their environment (tokens, credentials, local database in
+    `workdir`, quotas high enough not to throttle) and replaces google_clients'
+    credentials and sheets. Returns {title: FakeWorksheet}.
+    """
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:BENCH")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN2", "2:BENCH")
+    os.environ.setdefault("deboregist", json.dumps({"client_email": FakeCredentials.service_account_email}))
+    os.environ.setdefault("deboregistration", os.environ["deboregist"])
+    os.environ["LOCAL_DB_PATH"] = os.path.join(workdir, "muya.db")
+    os.environ["REQUESTS_QUEUE_PATH"] = os.path.join(workdir, "requests_queue.jsonl")
+    os.environ.setdefault("SHEET_RECONCILE_SECONDS", "3600")
+    os.environ.setdefault("SLOW_UPDATE_SECONDS", "3600")
+    for name in ("SHEETS_READS_PER_MINUTE", "SHEETS_WRITES_PER_MINUTE", "DRIVE_REQUESTS_PER_MINUTE"):
+        os.environ.setdefault(name, "100000000")
+    os.environ.setdefault("QUOTA_BURST", "100000000")
+
+    import google_clients
+    from quota import QuotaWorksheet
+
+    sheets = {
+        "Professionals": FakeWorksheet("Professionals", PROFESSIONALS_HEADER, latency),
+        "Requests": FakeWorksheet("Requests", REQUESTS_HEADER, latency),
+    }
+    sheets["Professionals"].values.extend(generate_professionals(professionals))
+
+    def open_sheet(env_var, title):
+        return QuotaWorksheet(sheets[title], FakeCredentials.service_account_email)
+
+    google_clients.get_credentials = lambda env_var: FakeCredentials()
+    google_clients.open_sheet = open_sheet
+    return sheets
+
+
+async def start_bots(latency, telegram_calls=None):
+    """Imports both bots, builds their Applications on the fake Bot API and runs their startup hooks."""
+    import Debo_registration
+    import Mrequests
+
+    drive_uploads = []
+    Debo_registration.upload_to_drive = fake_drive_upload(latency, drive_uploads)
+    apps = {
+        "debo": Debo_registration.build_application(request=make_fake_request(latency, telegram_calls)),
+        "mrequests": Mrequests.build_application(request=make_fake_request(latency, telegram_calls)),
+    }
+    for application in apps.values():
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()  # no updater: updates are fed in directly
+    return apps, drive_uploads
+
+
+async def stop_bots(apps):
+    for application in apps.values():
+        await application.stop()
+    for application in apps.values():
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,153 @@
+# benchmark.py
+"""
+Offline benchmark of the bots' real handlers against in-process fakes of the
+Bot API, Google Sheets and Drive (see bench_fakes.py). No network is used.
+
+    python benchmark.py --rows 100,1000,10000,100000 --users 200 --concurrency 20
+
+Each sheet size runs in its own process, since the bots keep module-level state.
+Reports conversations per second for each flow and p50/p95/p99 latency per step.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import bench_fakes
+
+# (flow, [(step label, update builder)]): every step is one update through Application.process_update
+def register_flow(factory):
+    return [
+        ("/register", lambda: factory.text("/register")),
+        ("full_name", lambda: factory.text("Abebe Kebede")),
+        ("profession", lambda: factory.text("plumber")),
+        ("phone", lambda: factory.text(factory.phone)),
+        ("location", lambda: factory.location(bench_fakes.CENTER_LAT, bench_fakes.CENTER_LON)),
+        ("region_city_woreda", lambda: factory.text("Addis Ababa, Bole, 03")),
+        ("testimonial_document", lambda: factory.document()),
+        ("testimonial_photo", lambda: factory.photo()),
+        ("testimonials_done", lambda: factory.text("Done ጨርሻያለው✅ ")),
+        ("educational_skip", lambda: factory.text("Skip እለፍ⏭️")),
+    ]
+
+
+def request_flow(factory):
+    return [
+        ("request_entry", lambda: factory.text("REQUEST PROFESSIONAL | ባለሙያ ይጠይቁ")),
+        ("requester_name", lambda: factory.text("Almaz Tesfaye")),
+        ("requester_phone", lambda: factory.text("0911223344")),
+        ("professional_type", lambda: factory.text("Plumber")),
+        ("filter_near_me", lambda: factory.text("Near Me | ባቅራብያዬ")),
+        ("requester_location", lambda: factory.location(bench_fakes.CENTER_LAT + 0.01, bench_fakes.CENTER_LON)),
+        ("requester_address", lambda: factory.text("Addis Ababa, Bole")),
+        ("professional_count", lambda: factory.text("5")),
+    ]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_flow(application, steps, timings):
+    from telegram import Update
+
+    for label, build in steps:
+        update = Update.de_json(build(), application.bot)
+        started = time.perf_counter()
+        await application.process_update(update)
+        timings.setdefault(label, []).append(time.perf_counter() - started)
+
+
+async def run_scenario(application, flow, users, concurrency, first_user_id):
+    """Runs `users` conversations of the flow, `concurrency` at a time; returns (seconds, step timings)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = {}
+
+    async def one(user_id):
+        async with semaphore:
+            await run_flow(application, flow(bench_fakes.UpdateFactory(user_id)), timings)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(first_user_id + n) for n in range(users)))
+    return time.perf_counter() - started, timings
+
+
+async def run_single(rows, users, concurrency, latency):
+    with tempfile.TemporaryDirectory() as workdir:
+        bench_fakes.install(workdir, latency, professionals=rows)
+        startup = time.perf_counter()
+        apps, _ = await bench_fakes.start_bots(latency)
+        results = {"rows": rows, "users": users, "concurrency": concurrency,
+                   "startup_seconds": time.perf_counter() - startup, "flows": {}, "steps": {}}
+
+        scenarios = [
+            ("register", apps["debo"], register_flow, 1),
+            ("profile", apps["debo"], lambda f: [("/profile", lambda: f.text("/profile"))], 10_000_000),
+            ("request", apps["mrequests"], request_flow, 1_000_000_000),
+        ]
+        for name, application, flow, first_user_id in scenarios:
+            if name == "profile" and not rows:
+                continue  # needs registered professionals
+            elapsed, timings = await run_scenario(application, flow, users, concurrency, first_user_id)
+            results["flows"][name] = {"seconds": elapsed, "conversations_per_second": users / elapsed}
+            for label, values in timings.items():
+                results["steps"][label] = {
+                    "count": len(values),
+                    "p50_ms": percentile(values, 0.50) * 1000,
+                    "p95_ms": percentile(values, 0.95) * 1000,
+                    "p99_ms": percentile(values, 0.99) * 1000,
+                }
+        await bench_fakes.stop_bots(apps)
+        return results
+
+
+def print_report(results):
+    print(f"\n== {results['rows']} sheet rows, {results['users']} users, concurrency {results['concurrency']} "
+          f"(startup {results['startup_seconds']:.2f}s) ==")
+    for name, flow in results["flows"].items():
+        print(f"  {name:<22} {flow['conversations_per_second']:8.1f} conversations/s")
+    print(f"  {'step':<22} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, step in results["steps"].items():
+        print(f"  {label:<22} {step['count']:>6} {step['p50_ms']:9.1f} {step['p95_ms']:9.1f} {step['p99_ms']:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="100,1000,10000,100000", help="comma-separated Professionals sheet sizes")
+    parser.add_argument("--users", type=int, default=100, help="conversations per flow")
+    parser.add_argument("--concurrency", type=int, default=10, help="conversations in progress at once")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="seconds per Bot API call")
+    parser.add_argument("--sheets-latency", type=float, default=0.3, help="seconds per Sheets call")
+    parser.add_argument("--drive-latency", type=float, default=0.8, help="seconds per Drive upload")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)  # one sheet size, in this process
+    args = parser.parse_args()
+
+    latency = bench_fakes.Latency(args.telegram_latency, args.sheets_latency, args.drive_latency)
+    if args.single is not None:
+        results = asyncio.run(run_single(args.single, args.users, args.concurrency, latency))
+        print(json.dumps(results))
+        return
+
+    all_results = []
+    for rows in [int(value) for value in args.rows.split(",") if value]:
+        command = [sys.executable, os.path.abspath(__file__), "--single", str(rows)] + [
+            arg for arg in sys.argv[1:] if not arg.startswith("--rows") and arg != args.rows]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results = json.loads(output.strip().splitlines()[-1])
+        print_report(results)
+        all_results.append(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
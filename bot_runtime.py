@@ -0,0 +1,251 @@
+# bot_runtime.py
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import signal
+import threading
+import time
+
+import health
+
+logger = logging.getLogger(__name__)
+
+# When set (e.g. https://muya-bot.example.com), bots receive updates by webhook on
+# PORT instead of long polling, on the same HTTP server as the health check.
+WEBHOOK_BASE_URL = os.environ.get("WEBHOOK_BASE_URL", "").rstrip("/")
+PORT = int(os.environ.get("PORT", "8000"))
+HTTP_THREADS = int(os.environ.get("HTTP_THREADS", "8"))
+BOT_CONNECTION_POOL_SIZE = int(os.environ.get("BOT_CONNECTION_POOL_SIZE", "16"))
+# Self-hosted Bot API server (or loadgen.py's stand-in) instead of api.telegram.org
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL", "").rstrip("/")
+# Updates each bot handles at once; one user's updates are still handled in order
+BOT_CONCURRENT_UPDATES = int(os.environ.get("BOT_CONCURRENT_UPDATES", "32"))
+
+_shared_request = None
+
+# Seconds taken by each startup phase ("debo.import", "mrequests.sheets", "debo.ready", ...)
+startup_phases = {}
+
+
+def process_uptime():
+    """Seconds since this process was started (not since this module was imported)."""
+    try:
+        # Linux: start time in clock ticks since boot, exact to the tick (psutil's
+        # create_time() adds a boot time rounded to whole seconds)
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        import psutil
+
+        return time.time() - psutil.Process(os.getpid()).create_time()
+
+
+def record_startup_phase(name, seconds):
+    startup_phases[name] = seconds
+    logger.info(f"[startup] {name}: {seconds:.2f}s")
+
+
+@contextlib.contextmanager
+def startup_phase(name):
+    """Times a block of startup work as phase `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_phase(name, time.perf_counter() - started)
+
+
+def webhook_mode():
+    return bool(WEBHOOK_BASE_URL)
+
+
+def webhook_secret(name, application):
+    """
+    Secret token Telegram sends back in X-Telegram-Bot-Api-Secret-Token.
+    Taken from <NAME>_WEBHOOK_SECRET if set, otherwise derived from the bot token
+    so it is stable across restarts without extra configuration.
+    """
+    configured = os.environ.get(f"{name.upper()}_WEBHOOK_SECRET")
+    if configured:
+        return configured
+    return hashlib.sha256(f"webhook:{name}:{application.bot.token}".encode()).hexdigest()
+
+
+def configure_api_server(builder):
+    """Points an ApplicationBuilder at TELEGRAM_API_BASE_URL when it is set."""
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_BASE_URL}/bot").base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+    return builder
+
+
+def new_request():
+    """Pooled Bot API client that records each call as a "telegram.<method>" span of the update."""
+    from telegram.request import HTTPXRequest
+    import tracing
+
+    class TracedRequest(HTTPXRequest):
+        async def do_request(self, url, method, *args, **kwargs):
+            with tracing.span(f"telegram.{url.rsplit('/', 1)[-1]}"):
+                return await super().do_request(url, method, *args, **kwargs)
+
+    return TracedRequest(connection_pool_size=BOT_CONNECTION_POOL_SIZE)
+
+
+def per_user_update_processor(max_concurrent_updates=BOT_CONCURRENT_UPDATES):
+    """
+    Update processor for ApplicationBuilder.concurrent_updates(): up to
+    `max_concurrent_updates` updates run at once, so a Sheets call or upload for one
+    user no longer holds up the others, but updates from the same user (or chat,
+    when there is no user) wait for each other. ConversationHandler state and
+    user_data therefore see one update per user at a time, as with serial updates.
+    """
+    from telegram import Update
+    from telegram.ext import BaseUpdateProcessor
+
+    class PerUserUpdateProcessor(BaseUpdateProcessor):
+        def __init__(self, max_concurrent_updates):
+            super().__init__(max_concurrent_updates)
+            self._locks = {}   # user/chat id -> [lock, updates holding or waiting for it]
+
+        async def do_process_update(self, update, coroutine):
+            key = None
+            if isinstance(update, Update):
+                key = update.effective_user.id if update.effective_user else (
+                    update.effective_chat.id if update.effective_chat else None)
+            if key is None:
+                await coroutine
+                return
+            entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    await coroutine
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+    return PerUserUpdateProcessor(max_concurrent_updates)
+
+
+def shared_request():
+    """One pooled HTTP client for the Bot API calls of every bot hosted in this process."""
+    global _shared_request
+    if _shared_request is None:
+        _shared_request = new_request()
+    return _shared_request
+
+
+def serve_http(port=PORT):
+    """
+    Serves health_check_server.app with waitress from a background thread and
+    returns the server. It has to run in this process, next to the event loop the
+    webhook routes hand updates to, which rules out gunicorn's forked workers.
+    """
+    from waitress.server import create_server
+    from health_check_server import app
+
+    server = create_server(app, host="0.0.0.0", port=port, threads=HTTP_THREADS, ident="muya")
+    threading.Thread(target=server.run, name="http", daemon=True).start()
+    logger.info(f"HTTP server listening on port {port} ({HTTP_THREADS} threads)")
+    return server
+
+
+async def start_bot(name, application):
+    """Starts one Application on the running loop, by webhook or polling."""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    if webhook_mode():
+        from health_check_server import register_bot
+        from telegram import Update
+
+        secret = webhook_secret(name, application)
+        register_bot(name, application, asyncio.get_running_loop(), secret)
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_BASE_URL}/webhook/{name}",
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"[{name}] Receiving updates by webhook at {WEBHOOK_BASE_URL}/webhook/{name}")
+    else:
+        await application.updater.start_polling()
+        logger.info(f"[{name}] Receiving updates by polling")
+    await application.start()
+    health.start_monitor(name)
+    # Time from process start until this bot can answer updates
+    record_startup_phase(f"{name}.ready", process_uptime())
+
+
+async def stop_bot(name, application):
+    """Stops fetching and processing updates; the HTTP pool is left open for shutdown_bot."""
+    await health.stop_monitor(name)
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+
+
+async def shutdown_bot(name, application):
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    logger.info(f"[{name}] Stopped")
+
+
+async def _serve(applications, serve_health):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # not on the main thread / platform without signals
+
+    server = serve_http() if serve_health else None
+    if not server:
+        # /metrics is served by another process (gunicorn in the default subprocess mode)
+        import metrics
+
+        metrics.export_state("-".join(applications))
+    started = []
+    try:
+        for name, application in applications.items():
+            await start_bot(name, application)
+            started.append((name, application))
+        await stop_event.wait()
+    finally:
+        # Stop every bot before shutting any down: bots may share one HTTP pool
+        for step in (stop_bot, shutdown_bot):
+            for name, application in reversed(started):
+                try:
+                    await step(name, application)
+                except Exception as e:
+                    logger.error(f"[{name}] Error while stopping: {e}")
+        if server:
+            server.close()
+            server.task_dispatcher.shutdown()  # lets the worker threads finish their requests
+        else:
+            metrics.stop_export()
+
+
+def run(applications, serve_health=None):
+    """
+    Runs {name: Application} on one event loop until SIGINT/SIGTERM.
+    The HTTP server (health check + webhooks) is started when webhooks are used,
+    or when serve_health is True.
+    """
+    if serve_health is None:
+        serve_health = webhook_mode()
+    asyncio.run(_serve(applications, serve_health))
@@ -0,0 +1,294 @@
+# bulk_import.py
+"""
+Bulk import of professionals from a CSV file, for onboarding partner agencies.
+
+    python bulk_import.py agency.csv [--batch-rows 100] [--rejects rejected.csv] [--sync] [--restart]
+
+The CSV uses the Professionals sheet's column names (case, spaces and "_" do not
+matter). User ID, Full_Name, PROFESSION and PHONE are required. Username,
+LOCATION ("lat, lon") and Region/City/Woreda are optional. Each row is validated
+(phone and location format) and checked against the User IDs and phone numbers
+already registered, locally, on the sheet and earlier in the file. Rejected rows
+are copied to the rejects file with the reason.
+
+Every batch is saved to the local store in one transaction, outbox entries included.
+The registration bot's mirror then copies the new profiles to the sheet, and the
+bot checks new registrations against the imported phone numbers within
+PROFILE_CHANGES_POLL_SECONDS (through the store's profile_changes table).
+Progress is checkpointed after each batch, so an interrupted import carries on
+where it stopped when run again.
+
+--sync writes each batch to the sheet from this process instead, with a
+ProfessionalsMirror of its own: one append_rows (plus one batch_update for profiles
+already on the sheet) per batch, within the Sheets quota. Only use it while the
+registration bot is stopped: two mirrors working the same outbox append the same
+profiles twice.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+from local_store import get_store, ProfessionalsMirror
+from phones import PhoneIndex, normalize_phone
+from professions import resolve_profession
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_ROWS = int(os.environ.get("IMPORT_BATCH_ROWS", "100"))
+
+# The Professionals sheet's columns A..L, as in Debo_registration.PROFESSIONALS_COLUMNS
+PROFESSIONALS_COLUMNS = ["User ID", "Username", "Full_Name", "PROFESSION", "PHONE", "LOCATION",
+                         "Region/City/Woreda", "CONFIRM_DELETE", "COMMENT", "Testimonials",
+                         "Educational Docs", "PROFESSION_ID"]
+IMPORTED_COLUMNS = ("User ID", "Username", "Full_Name", "PROFESSION", "PHONE", "LOCATION", "Region/City/Woreda")
+REQUIRED_COLUMNS = ("User ID", "Full_Name", "PROFESSION", "PHONE")
+ALREADY_IMPORTED = "already imported"
+
+
+def _column_key(name):
+    return " ".join(str(name).replace("_", " ").lower().split())
+
+
+def map_header(header):
+    """{sheet column: CSV column} for the columns imported; ValueError if a required one is missing."""
+    by_key = {_column_key(name): name for name in header}
+    mapping = {column: by_key[_column_key(column)] for column in IMPORTED_COLUMNS if _column_key(column) in by_key}
+    missing = [column for column in REQUIRED_COLUMNS if column not in mapping]
+    if missing:
+        raise ValueError(f"CSV has no {', '.join(missing)} column")
+    return mapping
+
+
+def parse_location(text):
+    """"lat, lon" the way the bot stores a shared location, "Not shared" when empty, None if malformed."""
+    text = (text or "").strip()
+    if not text or text.lower() == "not shared":
+        return "Not shared"
+    parts = text.split(",")
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return f"{lat}, {lon}"
+
+
+def build_row(record, mapping):
+    """(profile row, None) for a valid CSV record, or (None, reason)."""
+    values = {column: (record.get(source) or "").strip() for column, source in mapping.items()}
+    if not values["User ID"].isdigit():
+        return None, f"User ID {values['User ID']!r} is not a Telegram user id"
+    for column in ("Full_Name", "PROFESSION"):
+        if not values[column]:
+            return None, f"{column} is empty"
+    phone = normalize_phone(values["PHONE"])
+    if phone is None:
+        return None, f"invalid phone number {values['PHONE']!r}"
+    location = parse_location(values.get("LOCATION"))
+    if location is None:
+        return None, f"invalid location {values['LOCATION']!r}, expected \"lat, lon\""
+    row = dict.fromkeys(PROFESSIONALS_COLUMNS, "")
+    row.update({
+        "User ID": values["User ID"],
+        "Username": values.get("Username") or "Not set",
+        "Full_Name": values["Full_Name"],
+        "PROFESSION": values["PROFESSION"],
+        "PHONE": phone,
+        "LOCATION": location,
+        "Region/City/Woreda": values.get("Region/City/Woreda", ""),
+        "PROFESSION_ID": resolve_profession(values["PROFESSION"]) or "",
+    })
+    return row, None
+
+
+class Checkpoint:
+    """How far an import of `csv_path` got, in "<csv_path>.progress.json"; reset when the CSV changes."""
+
+    def __init__(self, csv_path):
+        self.path = csv_path + ".progress.json"
+        stat = os.stat(csv_path)
+        self.source = {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def load(self):
+        """(rows done, counts) of the previous run, or None."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("source") != self.source:
+            logger.warning(f"{self.path} is for another version of the CSV, starting over")
+            return None
+        return state["rows_done"], state["counts"]
+
+    def save(self, rows_done, counts):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"source": self.source, "rows_done": rows_done, "counts": counts}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Importer:
+    """
+    Validates, de-duplicates and saves CSV rows batch by batch. `index` is the
+    Professionals sheet's User ID index; `mirror` (optional) copies each saved
+    batch to the sheet before the next one starts.
+    """
+
+    def __init__(self, store, index, mirror=None, batch_rows=IMPORT_BATCH_ROWS):
+        self.store = store
+        self.index = index
+        self.mirror = mirror
+        self.batch_rows = batch_rows
+        self.user_ids = set()
+        self.phones = PhoneIndex(phone_column="PHONE")
+        self.counts = {"imported": 0, "already_imported": 0, "invalid": 0, "duplicate": 0}
+
+    def load_existing(self):
+        """User IDs and phone numbers on the sheet and in the local store (which wins for a user in both)."""
+        for user_id, row in self.index.items() + self.store.professionals():
+            self.user_ids.add(str(user_id))
+            self.phones.sync_row(user_id, row)
+        logger.info(f"Checking against {len(self.user_ids)} registered profiles and {len(self.phones)} phone numbers")
+
+    def check(self, row):
+        """None if the row can be imported, ALREADY_IMPORTED if it is saved as is, otherwise why not."""
+        user_id = row["User ID"]
+        if user_id in self.user_ids:
+            stored = self.store.get_professional(user_id)
+            if stored and all(stored.get(column) == row[column] for column in ("Full_Name", "PROFESSION", "PHONE")):
+                return ALREADY_IMPORTED  # saved by an interrupted run, or registered with the same details
+            return f"User ID {user_id} is already registered or earlier in the file"
+        owners = self.phones.owners_other_than(row["PHONE"], user_id)
+        if owners:
+            return f"phone {row['PHONE']} is already registered to User ID {', '.join(sorted(owners))}"
+        return None
+
+    async def sync(self):
+        """Writes everything in the Professionals outbox to the sheet."""
+        if self.mirror is None:
+            return 0
+        synced = 0
+        while True:
+            count = await self.mirror.sync_once()
+            if not count:
+                return synced
+            synced += count
+
+    async def run(self, csv_path, rejects_path=None, restart=False):
+        """Imports the file, resuming from its checkpoint unless `restart`. Returns the counts."""
+        checkpoint = Checkpoint(csv_path)
+        resumed = None if restart else checkpoint.load()
+        rows_done = 0
+        if resumed:
+            rows_done, self.counts = resumed
+            logger.info(f"Resuming {csv_path} after row {rows_done}: {self.counts}")
+        # Changes saved by an interrupted run that never reached the sheet go first
+        leftover = await self.sync()
+        if leftover:
+            logger.info(f"Mirrored {leftover} pending profile changes to the sheet")
+
+        with open(csv_path, newline="", encoding="utf-8-sig") as f:
+            total = max(0, sum(1 for values in csv.reader(f) if values) - 1)  # DictReader skips blank lines too
+        rejects_path = rejects_path or os.path.splitext(csv_path)[0] + ".rejected.csv"
+        started = time.monotonic()
+        with open(csv_path, newline="", encoding="utf-8-sig") as f, \
+                open(rejects_path, "a" if resumed else "w", newline="", encoding="utf-8") as rejects_file:
+            reader = csv.DictReader(f)
+            mapping = map_header(reader.fieldnames or [])
+            rejects = csv.DictWriter(rejects_file, fieldnames=["Row"] + reader.fieldnames + ["Error"],
+                                     extrasaction="ignore")
+            if not resumed:
+                rejects.writeheader()
+            batch, first = [], rows_done + 1
+            for number, record in enumerate(reader, start=1):
+                if number <= rows_done:
+                    continue
+                row, error = build_row(record, mapping)
+                if row is not None:
+                    error = self.check(row)
+                if error is None:
+                    batch.append(row)
+                    self.user_ids.add(row["User ID"])
+                    self.phones.sync_row(row["User ID"], row)
+                elif error == ALREADY_IMPORTED:
+                    self.counts["already_imported"] += 1
+                else:
+                    self.counts["invalid" if row is None else "duplicate"] += 1
+                    rejects.writerow(dict(record, Row=number, Error=error))
+                if number - first + 1 == self.batch_rows:
+                    await self._commit(batch, first, number, total, checkpoint, rejects_file, started)
+                    batch, first = [], number + 1
+            if first <= total or batch:
+                await self._commit(batch, first, total, total, checkpoint, rejects_file, started)
+        checkpoint.clear()
+        logger.info(f"Import of {csv_path} finished in {time.monotonic() - started:.1f}s: {self.counts}"
+                    + (f", rejected rows in {rejects_path}" if self.counts["invalid"] + self.counts["duplicate"] else ""))
+        return self.counts
+
+    async def _commit(self, batch, first, last, total, checkpoint, rejects_file, started):
+        """Saves one batch, records the progress and mirrors the batch to the sheet."""
+        if batch:
+            self.store.save_professionals([(row["User ID"], row) for row in batch])
+        self.counts["imported"] += len(batch)
+        rejects_file.flush()
+        checkpoint.save(last, self.counts)
+        sync_started = time.monotonic()
+        synced = await self.sync()
+        elapsed = time.monotonic() - started
+        logger.info(f"Rows {first}-{last} of {total} ({100 * last / max(total, 1):.0f}%): {len(batch)} saved"
+                    + (f", {synced} mirrored in {time.monotonic() - sync_started:.2f}s" if self.mirror else "")
+                    + f"; totals {self.counts}, {elapsed:.1f}s")
+
+
+def import_file(csv_path, batch_rows=IMPORT_BATCH_ROWS, rejects_path=None, sync=False, restart=False):
+    """Opens the Professionals sheet and the local store and imports `csv_path` into both."""
+    import google_clients
+    from sheet_index import shared_index
+    from storage import AsyncWorksheet
+
+    sheet = google_clients.open_sheet("deboregist", "Professionals")
+    index = shared_index(sheet, key_column="User ID")
+    index.load()  # a fresh read, not a snapshot: duplicates are checked against it
+
+    def sheet_columns():
+        return list(index.header) + PROFESSIONALS_COLUMNS[len(index.header):]
+
+    store = get_store()
+    mirror = ProfessionalsMirror(store, AsyncWorksheet(sheet), index, sheet_columns,
+                                 batch_size=batch_rows) if sync else None
+    importer = Importer(store, index, mirror, batch_rows)
+    importer.load_existing()
+    return asyncio.run(importer.run(csv_path, rejects_path, restart))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv")
+    parser.add_argument("--batch-rows", type=int, default=IMPORT_BATCH_ROWS, help="CSV rows per batch")
+    parser.add_argument("--rejects", help="where rejected rows go (default <csv>.rejected.csv)")
+    parser.add_argument("--sync", action="store_true",
+                        help="also write the profiles to the sheet; only while the registration bot is stopped")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of a previous run")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO,
+                        stream=sys.stderr)
+    import_file(args.csv, args.batch_rows, args.rejects, args.sync, args.restart)
+
+
+if __name__ == "__main__":
+    main()
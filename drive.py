@@ -0,0 +1,51 @@
+# drive.py
+import logging
+import os
+import threading
+
+import quota
+
+logger = logging.getLogger(__name__)
+
+# Resumable uploads are sent in chunks of this size (must be a multiple of 256 KB)
+DRIVE_UPLOAD_CHUNK_SIZE = int(os.environ.get("DRIVE_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# The httplib2 connection inside a Drive client is not thread-safe, so each storage
+# worker thread builds its client once and reuses it for every later upload.
+_local = threading.local()
+
+
+def get_drive_service(creds):
+    service = getattr(_local, "service", None)
+    if service is None:
+        from googleapiclient.discovery import build  # slow import, deferred to the first upload
+
+        service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+        _local.service = service
+        logger.info(f"Built Drive client for thread {threading.current_thread().name}")
+    return service
+
+
+def upload_stream_to_drive(creds, stream, folder_id, filename, mimetype=None):
+    """
+    Uploads a file-like object to Drive with a chunked resumable upload and returns
+    its sharing link. Blocking: call it through storage.run_io.
+    """
+    from googleapiclient.http import MediaIoBaseUpload
+
+    drive_service = get_drive_service(creds)
+    file_metadata = {
+        'name': filename,
+        'parents': [folder_id]
+    }
+    stream.seek(0)
+    media = MediaIoBaseUpload(stream, mimetype=mimetype or 'application/octet-stream',
+                              chunksize=DRIVE_UPLOAD_CHUNK_SIZE, resumable=True)
+    request = drive_service.files().create(body=file_metadata, media_body=media, fields='id')
+    response = None
+    account = quota.account_of(creds)
+    while response is None:
+        # A resumable chunk can be re-sent after a 5xx, so every chunk is retryable
+        _, response = quota.call(account, "drive", request.next_chunk)
+    file_id = response.get('id')
+    return f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
@@ -1,11 +1,15 @@
+import collections
 import subprocess
 import threading
 import os
 import logging
+import signal
+import sys
 import time
-import psutil
 import traceback
 
+import resources
+
 # Setup logging to file
 logging.basicConfig(
     level=logging.INFO,
@@ -16,50 +20,140 @@ logging.basicConfig(
     ]
 )
 
-def monitor_system():
-    """Log memory and CPU usage every 10s"""
-    try:
-        while True:
-            mem = psutil.virtual_memory()
-            cpu = psutil.cpu_percent()
-            logging.info(f"[MONITOR] RAM used: {mem.percent}%, CPU: {cpu}%")
-            time.sleep(10)
-    except Exception as e:
-        logging.error("[MONITOR ERROR] " + str(e))
-        traceback.print_exc()
-
-def run_bot():
-    try:
-        logging.info("[BOT] Starting Mrequests.py")
-        subprocess.run(["python3", "Mrequests.py"], check=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"[BOT ERROR] Process failed: {e}")
-    except Exception as e:
-        logging.error("[BOT EXCEPTION] " + str(e))
-        traceback.print_exc()
-
-def run_web():
-    try:
-        port = os.environ.get("PORT", "8000")
-        logging.info(f"[WEB] Starting Flask health check on port {port}")
-        subprocess.run(["gunicorn", "health_check_server:app", "--bind", f"0.0.0.0:{port}"], check=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"[WEB ERROR] Process failed: {e}")
-    except Exception as e:
-        logging.error("[WEB EXCEPTION] " + str(e))
-        traceback.print_exc()
+# Crashed processes are restarted after BOT_RESTART_BASE_DELAY, doubling per crash up
+# to BOT_RESTART_MAX_DELAY; a run longer than BOT_STABLE_SECONDS resets the backoff.
+# CRASH_LOOP_CRASHES exits within CRASH_LOOP_WINDOW seconds count as a crash loop and
+# pause restarts for CRASH_LOOP_COOLDOWN seconds (the health checks report it meanwhile).
+BOT_RESTART_BASE_DELAY = float(os.environ.get("BOT_RESTART_BASE_DELAY", "0.5"))
+BOT_RESTART_MAX_DELAY = float(os.environ.get("BOT_RESTART_MAX_DELAY", "60"))
+BOT_STABLE_SECONDS = float(os.environ.get("BOT_STABLE_SECONDS", "60"))
+CRASH_LOOP_CRASHES = int(os.environ.get("CRASH_LOOP_CRASHES", "5"))
+CRASH_LOOP_WINDOW = float(os.environ.get("CRASH_LOOP_WINDOW", "300"))
+CRASH_LOOP_COOLDOWN = float(os.environ.get("CRASH_LOOP_COOLDOWN", "300"))
+
+stopping = threading.Event()
+
+
+class Supervisor:
+    """
+    Runs a command as a child process and starts it again whenever it exits, until
+    stop(). The bots save their warm state (sheet index snapshot) on the way down
+    and keep pending writes in the local database, so a restarted bot picks up
+    where the previous one stopped.
+    """
+
+    def __init__(self, name, command):
+        self.name = name
+        self.command = command
+        self.process = None
+        self.restarts = 0
+        self._exits = collections.deque()   # monotonic times of recent exits
+
+    def next_delay(self, consecutive):
+        now = time.monotonic()
+        self._exits.append(now)
+        while self._exits and now - self._exits[0] > CRASH_LOOP_WINDOW:
+            self._exits.popleft()
+        if len(self._exits) >= CRASH_LOOP_CRASHES:
+            logging.error(f"[{self.name}] Crash loop: {len(self._exits)} exits in {CRASH_LOOP_WINDOW:.0f}s, "
+                          f"pausing restarts for {CRASH_LOOP_COOLDOWN:.0f}s")
+            self._exits.clear()
+            return CRASH_LOOP_COOLDOWN
+        return min(BOT_RESTART_MAX_DELAY, BOT_RESTART_BASE_DELAY * 2 ** consecutive)
+
+    def run(self):
+        consecutive = 0   # quick exits in a row, for the backoff
+        while not stopping.is_set():
+            started = time.monotonic()
+            logging.info(f"[{self.name}] Starting {' '.join(self.command)}")
+            try:
+                self.process = subprocess.Popen(self.command)
+                code = self.process.wait()
+            except Exception as e:
+                logging.error(f"[{self.name}] Could not start: {e}")
+                traceback.print_exc()
+                code = None
+            if stopping.is_set():
+                break
+            ran_for = time.monotonic() - started
+            if ran_for >= BOT_STABLE_SECONDS:
+                consecutive = 0
+            delay = self.next_delay(consecutive)
+            consecutive += 1
+            self.restarts += 1
+            logging.error(f"[{self.name}] Exited with code {code} after {ran_for:.1f}s, restarting in {delay:.1f}s")
+            stopping.wait(delay)
+        logging.info(f"[{self.name}] Supervisor stopped")
+
+    def stop(self, timeout=20):
+        """Asks the child to shut down (SIGTERM: bots flush their queues and snapshot) and waits."""
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logging.error(f"[{self.name}] Did not stop within {timeout}s, killing it")
+            process.kill()
+
+
+def supervise(supervisors):
+    """Runs each Supervisor in a thread until SIGTERM/SIGINT, then stops the children."""
+    def shutdown(signum, frame):
+        logging.info(f"[MAIN] Signal {signum} received, stopping children")
+        stopping.set()
+        for supervisor in supervisors:
+            supervisor.stop()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, shutdown)
+    threads = [threading.Thread(target=supervisor.run, name=supervisor.name) for supervisor in supervisors]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def run_single_process():
+    """Hosts both bots and the health endpoint on one asyncio loop in this process."""
+    import bot_runtime
+    import Debo_registration
+    import Mrequests
+
+    request = bot_runtime.shared_request()
+    bot_runtime.run({
+        "debo": Debo_registration.build_application(request=request),
+        "mrequests": Mrequests.build_application(request=request),
+    }, serve_health=True)
 
 if __name__ == "__main__":
-    logging.info("[MAIN] Starting entrypoint")
-    threading.Thread(target=monitor_system, daemon=True).start()
+    if "--single-child" in sys.argv:
+        # The supervised child of RUNTIME_MODE=single
+        run_single_process()
+        raise SystemExit(0)
 
-    t1 = threading.Thread(target=run_bot)
-    t2 = threading.Thread(target=run_web)
+    logging.info("[MAIN] Starting entrypoint")
+    # Per-process RSS/CPU/threads/fds of this process and its children, served at /health/resources
+    resources.start_sampler()
 
-    t1.start()
-    t2.start()
+    # RUNTIME_MODE=single runs both bots and the health check in one (supervised) process;
+    # the default keeps the subprocess fan-out
+    if os.environ.get("RUNTIME_MODE", "subprocess") == "single":
+        os.environ.setdefault("HEALTH_EXPECTED_BOTS", "debo,mrequests")
+        logging.info("[MAIN] Single-process runtime: Debo_registration + Mrequests + health check")
+        supervise([Supervisor("SINGLE", [sys.executable, os.path.abspath(__file__), "--single-child"])])
+        raise SystemExit(0)
 
-    t1.join()
-    t2.join()
+    # The health checks (gunicorn, or the bot itself in webhook mode) fail while it has not reported
+    os.environ.setdefault("HEALTH_EXPECTED_BOTS", "mrequests")
+    supervisors = [Supervisor("BOT", ["python3", "Mrequests.py"])]
+    # In webhook mode the bot process serves the health check and webhooks on PORT itself
+    if os.environ.get("WEBHOOK_BASE_URL"):
+        logging.info("[WEB] Webhook mode: health check is served by the bot process")
+    else:
+        port = os.environ.get("PORT", "8000")
+        logging.info(f"[WEB] Starting Flask health check on port {port}")
+        supervisors.append(Supervisor("WEB", ["gunicorn", "health_check_server:app", "--bind", f"0.0.0.0:{port}"]))
+    supervise(supervisors)
 
-    logging.info("[MAIN] Both threads finished — this usually means crash or shutdown.")
+    logging.info("[MAIN] All supervised processes stopped.")
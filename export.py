@@ -0,0 +1,214 @@
+# export.py
+"""
+Streaming export of the Professionals and Requests sheets to CSV, JSONL or Parquet.
+
+    python export.py professionals --format csv --out professionals.csv --region bole --profession plumber
+    python export.py requests --format jsonl --out - > requests.jsonl
+
+Rows are read in fixed-size range chunks (EXPORT_CHUNK_ROWS per Sheets call) and
+written as they arrive, so memory stays flat however long the sheet is. Parquet
+needs the optional pyarrow package and is written one row group per chunk.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+
+from local_store import column_letter
+from professions import normalize_text, profession_key
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "5000"))
+FORMATS = ("csv", "jsonl", "parquet")
+
+# name -> (credentials env var, spreadsheet title, region column, profession id column, profession text column).
+# The column names must match the sheet's header row; export() checks them before reading.
+# The bots write Requests rows by position, so its header is whatever was typed into
+# row 1: set the EXPORT_REQUESTS_*_COLUMN variables if it differs from the defaults.
+SHEETS = {
+    "professionals": ("deboregist", "Professionals", "Region/City/Woreda", "PROFESSION_ID", "PROFESSION"),
+    "requests": ("deboregistration", "Requests",
+                 os.environ.get("EXPORT_REQUESTS_REGION_COLUMN", "Address"),
+                 os.environ.get("EXPORT_REQUESTS_PROFESSION_ID_COLUMN", "Profession ID"),
+                 os.environ.get("EXPORT_REQUESTS_PROFESSION_COLUMN", "Professional Type")),
+}
+
+
+def iter_rows(worksheet, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Yields the header, then every non-blank row as a list padded to the header,
+    reading `chunk_rows` rows per range request.
+    """
+    header = worksheet.row_values(1)
+    yield header
+    if not header:
+        return
+    last_column = column_letter(len(header))
+    # A chunk comes back short whenever it ends in blank rows, including blank rows in
+    # the middle of the sheet, so read on to the sheet's last row. row_count is from
+    # when the worksheet was opened; rows appended since are read until a chunk is empty.
+    row_count = worksheet.row_count
+    start = 2
+    while True:
+        end = start + chunk_rows - 1
+        values = worksheet.get(f"A{start}:{last_column}{end}")
+        for raw in values:
+            if any(cell != "" for cell in raw):
+                yield list(raw) + [""] * (len(header) - len(raw))
+        if not values and end >= row_count:
+            return
+        start += chunk_rows
+
+
+def check_filter_columns(sheet_name, header, region=None, profession=None):
+    """
+    Raises ValueError if the sheet has no column for a filter that is used. The
+    profession id column is optional (added by hand): without it rows match on text.
+    """
+    _, title, region_column, _, text_column = SHEETS[sheet_name]
+    needed = ([region_column] if region else []) + ([text_column] if profession else [])
+    missing = [column for column in needed if column not in header]
+    if missing:
+        raise ValueError(f"The {title} sheet has no {', '.join(missing)} column (header: {', '.join(header)})")
+
+
+def row_filter(sheet_name, region=None, profession=None):
+    """Predicate on row dicts for the optional --region (substring) and --profession filters."""
+    _, _, region_column, id_column, text_column = SHEETS[sheet_name]
+    region_text = normalize_text(region) if region else None
+    wanted = profession_key(profession) if profession else None
+
+    def keep(row):
+        if region_text and region_text not in normalize_text(row.get(region_column, "")):
+            return False
+        if wanted and (row.get(id_column) or profession_key(row.get(text_column, ""))) != wanted:
+            return False
+        return True
+
+    return keep
+
+
+class CsvWriter:
+    def __init__(self, stream, header):
+        self.writer = csv.writer(stream)
+        self.writer.writerow(header)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class JsonlWriter:
+    def __init__(self, stream, header):
+        self.stream = stream
+        self.header = header
+
+    def write(self, rows):
+        for row in rows:
+            self.stream.write(json.dumps(dict(zip(self.header, row)), ensure_ascii=False) + "\n")
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """All columns as strings, the way the sheet stores them; one row group per write()."""
+
+    def __init__(self, stream, header):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+        self.pyarrow = pyarrow
+        self.header = header
+        schema = pyarrow.schema([(name, pyarrow.string()) for name in header])
+        self.writer = pyarrow.parquet.ParquetWriter(stream, schema)
+
+    def write(self, rows):
+        columns = [[row[i] for row in rows] for i in range(len(self.header))]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(columns, names=self.header))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+def export(worksheet, sheet_name, fmt, stream, region=None, profession=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Streams the worksheet to `stream` (text for csv/jsonl, binary for parquet).
+    Returns (rows read, rows written).
+    """
+    rows = iter_rows(worksheet, chunk_rows)
+    header = next(rows)
+    check_filter_columns(sheet_name, header, region, profession)
+    keep = row_filter(sheet_name, region, profession)
+    writer = WRITERS[fmt](stream, header)
+    read = written = 0
+    batch = []
+    for row in rows:
+        read += 1
+        if keep(dict(zip(header, row))):
+            batch.append(row)
+        if len(batch) >= chunk_rows:
+            writer.write(batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        writer.write(batch)
+        written += len(batch)
+    writer.close()
+    return read, written
+
+
+def open_output(path, fmt):
+    binary = fmt == "parquet"
+    if path == "-":
+        return sys.stdout.buffer if binary else sys.stdout, False
+    if binary:
+        return open(path, "wb"), True
+    return open(path, "w", encoding="utf-8", newline=""), True
+
+
+def export_to_file(sheet_name, fmt, path, region=None, profession=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Opens the sheet with the bots' credentials and exports it to `path` ("-" for stdout)."""
+    import google_clients
+
+    env_var, title = SHEETS[sheet_name][:2]
+    worksheet = google_clients.open_sheet(env_var, title)
+    stream, owned = open_output(path, fmt)
+    try:
+        read, written = export(worksheet, sheet_name, fmt, stream, region, profession, chunk_rows)
+    finally:
+        if owned:
+            stream.close()
+        else:
+            stream.flush()
+    logger.info(f"Exported {written} of {read} {sheet_name} rows to {path} ({fmt})")
+    return read, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sheet", choices=sorted(SHEETS))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--out", default="-", help="output file, - for stdout")
+    parser.add_argument("--region", help="keep rows whose region/address contains this text")
+    parser.add_argument("--profession", help="keep rows of this profession (any spelling the bots accept)")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS, help="rows per Sheets range request")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO,
+                        stream=sys.stderr)
+    export_to_file(args.sheet, args.format, args.out, args.region, args.profession, args.chunk_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# geo_index.py
+import collections
+import heapq
+import logging
+import math
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+CELL_DEGREES = 0.05  # ~5.5 km grid cells
+
+_LAT_LON_RE = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+
+def parse_lat_lon(text):
+    """Parses the "lat, lon" strings stored in the LOCATION column. Returns None for "Not shared" etc."""
+    match = _LAT_LON_RE.match(str(text or ""))
+    if not match:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def normalize_profession(text):
+    return " ".join(str(text or "").casefold().split())
+
+
+class GeoIndex:
+    """
+    Grid index of professionals' locations, bucketed by profession.
+
+    nearest() searches rings of grid cells outwards from the query point and stops
+    as soon as no unseen cell can hold anything closer than the k-th match found,
+    so a query only touches the neighbourhood of the requester. When the rings
+    would cover more cells than are occupied it scans the occupied cells instead.
+    """
+
+    def __init__(self, cell_degrees=CELL_DEGREES, profession_key=normalize_profession):
+        self.cell_degrees = cell_degrees
+        self.profession_key = profession_key
+        self._points = {}   # user_id -> (lat, lon, profession key)
+        self._cells = collections.defaultdict(lambda: collections.defaultdict(set))  # profession -> cell -> {user_id}
+        self._lock = threading.RLock()
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def __len__(self):
+        return len(self._points)
+
+    # --- Updates ---
+    def upsert(self, user_id, lat, lon, profession):
+        with self._lock:
+            self.remove(user_id)
+            key = self.profession_key(profession)
+            cell = self._cell(lat, lon)
+            self._points[user_id] = (lat, lon, key)
+            self._cells[key][cell].add(user_id)
+            self._cells[None][cell].add(user_id)  # bucket for "any profession"
+
+    def remove(self, user_id):
+        with self._lock:
+            point = self._points.pop(user_id, None)
+            if point is None:
+                return
+            lat, lon, key = point
+            cell = self._cell(lat, lon)
+            for bucket in (key, None):
+                cells = self._cells[bucket]
+                cells[cell].discard(user_id)
+                if not cells[cell]:
+                    del cells[cell]
+                if not cells:
+                    del self._cells[bucket]
+
+    def sync_row(self, user_id, row, location_column="LOCATION", profession_column="PROFESSION"):
+        """SheetIndex listener: indexes a sheet row, or drops it when row is None / has no location."""
+        location = parse_lat_lon(row.get(location_column)) if row else None
+        if location is None:
+            self.remove(user_id)
+        else:
+            self.upsert(user_id, location[0], location[1], row.get(profession_column, ""))
+
+    # --- Queries ---
+    def nearest(self, lat, lon, k, profession=None):
+        """Returns up to k (distance_km, user_id) pairs, closest first."""
+        if k <= 0:
+            return []
+        key = self.profession_key(profession) if profession is not None else None
+        with self._lock:
+            cells = self._cells.get(key)
+            if not cells:
+                return []
+            qy, qx = self._cell(lat, lon)
+            best = []  # max-heap of (-distance, user_id), size <= k
+            max_ring = int(math.ceil(360 / self.cell_degrees))
+            ring = 0
+            while ring <= max_ring:
+                if (2 * ring + 1) ** 2 > len(cells):
+                    # Cheaper to look at every occupied cell we have not covered yet
+                    for (cy, cx), members in cells.items():
+                        if max(abs(cy - qy), abs(cx - qx)) >= ring:
+                            self._consider(members, lat, lon, k, best)
+                    break
+                for cell in self._ring_cells(qy, qx, ring):
+                    members = cells.get(cell)
+                    if members:
+                        self._consider(members, lat, lon, k, best)
+                if len(best) == k and -best[0][0] <= self._ring_bound_km(lat, ring):
+                    break
+                ring += 1
+            return sorted((-d, uid) for d, uid in best)
+
+    def _consider(self, members, lat, lon, k, best):
+        for user_id in members:
+            plat, plon, _ = self._points[user_id]
+            d = haversine_km(lat, lon, plat, plon)
+            if len(best) < k:
+                heapq.heappush(best, (-d, user_id))
+            elif d < -best[0][0]:
+                heapq.heapreplace(best, (-d, user_id))
+
+    @staticmethod
+    def _ring_cells(qy, qx, ring):
+        if ring == 0:
+            yield qy, qx
+            return
+        for dx in range(-ring, ring + 1):
+            yield qy - ring, qx + dx
+            yield qy + ring, qx + dx
+        for dy in range(-ring + 1, ring):
+            yield qy + dy, qx - ring
+            yield qy + dy, qx + ring
+
+    def _ring_bound_km(self, lat, ring):
+        """Lower bound on the distance to any point outside the rings searched so far."""
+        span = ring * self.cell_degrees
+        widest_lat = min(abs(lat) + span + self.cell_degrees, 89.9)
+        return span * KM_PER_DEGREE * math.cos(math.radians(widest_lat))
@@ -0,0 +1,105 @@
+# google_clients.py
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from quota import QuotaWorksheet, account_of
+
+logger = logging.getLogger(__name__)
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+# Seconds a single Sheets HTTP request may take; appends and row deletes are awaited
+# without a timeout of their own (see storage.run_io), so this is what bounds them
+GOOGLE_HTTP_TIMEOUT = float(os.environ.get("GOOGLE_HTTP_TIMEOUT", "60"))
+
+# Credentials, gspread clients and worksheets are cached per service-account JSON,
+# so bots hosted in one process that use the same account share one set of each.
+# gspread/oauth2client are imported on first use: they are slow to import and the
+# bots should be answering before Google is contacted at all.
+_lock = threading.Lock()
+_credentials = {}   # credentials JSON -> ServiceAccountCredentials
+_clients = {}       # credentials JSON -> gspread client
+_worksheets = {}    # (credentials JSON, spreadsheet title) -> LazyWorksheet
+
+
+def _credentials_json(env_var):
+    creds_json_str = os.environ.get(env_var)
+    if not creds_json_str:
+        raise ValueError(f"{env_var} environment variable not set.")
+    return creds_json_str
+
+
+def get_credentials(env_var):
+    """Service-account credentials built in memory from the JSON in env_var."""
+    creds_json_str = _credentials_json(env_var)
+    with _lock:
+        creds = _credentials.get(creds_json_str)
+        if creds is None:
+            from oauth2client.service_account import ServiceAccountCredentials
+
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(creds_json_str), SCOPE)
+            _credentials[creds_json_str] = creds
+        return creds
+
+
+def get_client(env_var):
+    creds = get_credentials(env_var)
+    creds_json_str = _credentials_json(env_var)
+    with _lock:
+        client = _clients.get(creds_json_str)
+        if client is None:
+            import gspread
+
+            client = gspread.authorize(creds)
+            client.set_timeout(GOOGLE_HTTP_TIMEOUT)
+            _clients[creds_json_str] = client
+        return client
+
+
+class LazyWorksheet:
+    """
+    Worksheet handle returned by open_sheet(). The spreadsheet is opened (credentials
+    parsed, client authorized, sheet fetched) on the first attribute access, which
+    the bots make from a storage worker, not at import time.
+    """
+
+    def __init__(self, env_var, title, shared_key):
+        self.env_var = env_var
+        self.title = title
+        self.shared_key = shared_key   # identifies the sheet without opening it (see sheet_index.shared_index)
+        self._worksheet = None
+        self._open_lock = threading.Lock()
+
+    def connect(self):
+        if self._worksheet is None:
+            with self._open_lock:
+                if self._worksheet is None:
+                    client = get_client(self.env_var)
+                    self._worksheet = QuotaWorksheet(client.open(self.title).sheet1,
+                                                     account_of(get_credentials(self.env_var)))
+                    logger.info(f"Opened Google Sheet {self.title!r}")
+        return self._worksheet
+
+    @property
+    def connected(self):
+        return self._worksheet is not None
+
+    def __getattr__(self, name):
+        return getattr(self.connect(), name)
+
+
+def open_sheet(env_var, title):
+    """
+    First worksheet of the spreadsheet called `title`, opened once per account (on
+    first use) and wrapped so its calls respect the account's Sheets quota (see quota.py).
+    """
+    creds_json_str = _credentials_json(env_var)
+    key = (creds_json_str, title)
+    with _lock:
+        worksheet = _worksheets.get(key)
+        if worksheet is None:
+            digest = hashlib.sha256(creds_json_str.encode()).hexdigest()[:16]
+            worksheet = _worksheets[key] = LazyWorksheet(env_var, title, shared_key=(digest, title))
+        return worksheet
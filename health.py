@@ -0,0 +1,218 @@
+# health.py
+import asyncio
+import collections
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Each bot's event loop is sampled every LOOP_LAG_INTERVAL seconds: a sleep that wakes
+# up late means the loop was busy (or blocked by a synchronous call) for that long.
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.25"))
+LOOP_LAG_WINDOW = int(os.environ.get("LOOP_LAG_WINDOW", "240"))   # samples kept (one minute at 0.25s)
+# Liveness fails when a loop has not woken up for this long (it is stuck)
+LIVENESS_MAX_STALL_SECONDS = float(os.environ.get("LIVENESS_MAX_STALL_SECONDS", "10"))
+# Readiness also fails on a slow loop or when Sheets calls have stopped succeeding
+READINESS_MAX_LAG_SECONDS = float(os.environ.get("READINESS_MAX_LAG_SECONDS", "1"))
+READINESS_MAX_SHEETS_AGE = float(os.environ.get("READINESS_MAX_SHEETS_AGE", "900"))
+# Bots running in another process than the HTTP server (the default subprocess mode)
+# report through a small JSON file per bot in this directory
+HEALTH_STATE_DIR = os.environ.get("HEALTH_STATE_DIR", ".")
+HEALTH_STATE_WRITE_SECONDS = float(os.environ.get("HEALTH_STATE_WRITE_SECONDS", "5"))
+# Bots that must be reporting, comma separated (set by entrypoint.py for its children).
+# One that never started (crashed during startup) fails liveness once this process
+# has been up for HEALTH_STARTUP_GRACE_SECONDS, and readiness straight away.
+HEALTH_EXPECTED_BOTS = [bot for bot in os.environ.get("HEALTH_EXPECTED_BOTS", "").split(",") if bot]
+HEALTH_STARTUP_GRACE_SECONDS = float(os.environ.get("HEALTH_STARTUP_GRACE_SECONDS", "180"))
+
+_lock = threading.Lock()
+_monitors = {}              # bot -> LoopLagMonitor
+_last_update = {}           # bot -> time the last update was handled
+_last_google_success = {}   # quota class -> time of the last successful Google API call
+_process_started = time.time()
+
+
+def note_update(bot):
+    _last_update[bot] = time.time()
+
+
+def note_google_success(quota_class):
+    _last_google_success[quota_class] = time.time()
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _state_path(bot):
+    return os.path.join(HEALTH_STATE_DIR, f"health_{bot}.json")
+
+
+class LoopLagMonitor:
+    """Samples the scheduling delay of the running event loop in a background task."""
+
+    def __init__(self, bot, interval=LOOP_LAG_INTERVAL, window=LOOP_LAG_WINDOW):
+        self.bot = bot
+        self.interval = interval
+        self.samples = collections.deque(maxlen=window)
+        self.heartbeat = time.time()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if HEALTH_STATE_DIR:
+            try:
+                os.remove(_state_path(self.bot))  # stopped on purpose, not stalled
+            except OSError:
+                pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        written = 0.0
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            with _lock:
+                self.samples.append(lag)
+                self.heartbeat = time.time()
+            if HEALTH_STATE_DIR and self.heartbeat - written >= HEALTH_STATE_WRITE_SECONDS:
+                written = self.heartbeat
+                self._write_state()
+
+    def _write_state(self):
+        path = _state_path(self.bot)
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not write health state {path}: {e}")
+
+    def snapshot(self):
+        """Wall-clock timestamps and lag percentiles; ages are computed by the reader."""
+        with _lock:
+            ordered = sorted(self.samples)
+            heartbeat = self.heartbeat
+        sheets = [_last_google_success[name] for name in ("sheets_read", "sheets_write") if name in _last_google_success]
+        return {
+            "bot": self.bot,
+            "pid": os.getpid(),
+            "process_started_at": _process_started,
+            "heartbeat_at": heartbeat,
+            "loop_lag": {
+                "p50": _percentile(ordered, 0.50),
+                "p95": _percentile(ordered, 0.95),
+                "p99": _percentile(ordered, 0.99),
+                "max": ordered[-1] if ordered else 0.0,
+                "samples": len(ordered),
+            },
+            "last_update_at": _last_update.get(self.bot),
+            "last_sheets_success_at": max(sheets) if sheets else None,
+        }
+
+
+def start_monitor(bot):
+    """Starts sampling the running loop for `bot`; call from that bot's event loop."""
+    monitor = LoopLagMonitor(bot)
+    with _lock:
+        _monitors[bot] = monitor
+    monitor.start()
+    return monitor
+
+
+async def stop_monitor(bot):
+    with _lock:
+        monitor = _monitors.pop(bot, None)
+    if monitor:
+        await monitor.stop()
+
+
+def lag_percentiles():
+    """{(bot, quantile): seconds} for the bots hosted in this process."""
+    with _lock:
+        monitors = list(_monitors.values())
+    values = {}
+    for monitor in monitors:
+        lag = monitor.snapshot()["loop_lag"]
+        for quantile in ("p50", "p95", "p99", "max"):
+            values[(monitor.bot, quantile)] = lag[quantile]
+    return values
+
+
+def snapshots():
+    """Latest snapshot of every known bot: hosted in this process, or reported through its state file."""
+    with _lock:
+        monitors = dict(_monitors)
+    result = {bot: monitor.snapshot() for bot, monitor in monitors.items()}
+    if HEALTH_STATE_DIR:
+        for path in glob.glob(os.path.join(HEALTH_STATE_DIR, "health_*.json")):
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            result.setdefault(state.get("bot"), state)
+    return result
+
+
+def _age(now, timestamp):
+    return round(now - timestamp, 3) if timestamp else None
+
+
+def check(ready=False):
+    """
+    (healthy, report) for the liveness check, or the readiness check when `ready`.
+    Live: every known bot's loop woke up within LIVENESS_MAX_STALL_SECONDS, and every
+    bot in HEALTH_EXPECTED_BOTS has reported (after the startup grace period).
+    Ready: live, every expected bot (at least one bot) has reported, loop lag p95 is under
+    READINESS_MAX_LAG_SECONDS and a Sheets call succeeded within READINESS_MAX_SHEETS_AGE
+    (counted from process start until the first one).
+    """
+    now = time.time()
+    bots = {}
+    healthy = True
+    for bot, state in sorted(snapshots().items()):
+        problems = []
+        heartbeat_age = now - state["heartbeat_at"]
+        if heartbeat_age > LIVENESS_MAX_STALL_SECONDS:
+            problems.append(f"event loop has not run for {heartbeat_age:.1f}s")
+        sheets_age = now - (state["last_sheets_success_at"] or state["process_started_at"])
+        if ready:
+            if state["loop_lag"]["p95"] > READINESS_MAX_LAG_SECONDS:
+                problems.append(f"loop lag p95 {state['loop_lag']['p95']:.2f}s")
+            if sheets_age > READINESS_MAX_SHEETS_AGE:
+                problems.append(f"no successful Sheets call for {sheets_age:.0f}s")
+        healthy = healthy and not problems
+        bots[bot] = {
+            "pid": state["pid"],
+            "heartbeat_age": round(heartbeat_age, 3),
+            "loop_lag": state["loop_lag"],
+            "last_update_age": _age(now, state["last_update_at"]),
+            "last_sheets_success_age": _age(now, state["last_sheets_success_at"]),
+            "problems": problems,
+        }
+    starting = now - _process_started < HEALTH_STARTUP_GRACE_SECONDS
+    for bot in HEALTH_EXPECTED_BOTS:
+        if bot not in bots:
+            bots[bot] = {"problems": ["no state: not started, or crashed before it could report"]}
+            if ready or not starting:
+                healthy = False
+    if ready and not bots:
+        healthy = False  # nothing has started yet
+    return healthy, {"status": "ok" if healthy else "fail", "bots": bots}
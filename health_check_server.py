@@ -1,13 +1,75 @@
 # health_check_server.py
-from flask import Flask
+from flask import Flask, Response, request, abort, jsonify
+import asyncio
+import hmac
+import logging
 import os
 
+import health
+import metrics
+
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
+
+# Bots receiving updates by webhook: name -> (Application, event loop, secret token)
+bots = {}
+
+def register_bot(name, application, loop, secret_token):
+    """Routes POST /webhook/<name> to the application's update queue."""
+    bots[name] = (application, loop, secret_token)
 
 @app.route('/')
 def hello_world():
+    live, _ = health.check()
+    if not live:
+        return 'Bot is not responding (see /health/live)', 503
     return 'Bot is running (health check)!'
 
+@app.route('/health/live')
+def liveness():
+    """200 while every bot's event loop keeps running; restart the process on 503."""
+    live, report = health.check()
+    return jsonify(report), 200 if live else 503
+
+@app.route('/health/ready')
+def readiness():
+    """200 when the bots are live, responsive and reaching Google Sheets; route away on 503."""
+    ready, report = health.check(ready=True)
+    return jsonify(report), 200 if ready else 503
+
+@app.route('/health/resources')
+def resource_samples():
+    """RSS, CPU, threads, fds and temp files of every process started by entrypoint.py; ?limit=N for the latest N."""
+    import resources
+
+    state = resources.read_samples(request.args.get('limit', type=int))
+    if state is None:
+        return jsonify({"error": "no resource sampler is running"}), 404
+    return jsonify(state)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/webhook/<name>', methods=['POST'])
+def telegram_webhook(name):
+    from telegram import Update  # only needed when a bot is actually hosted here
+
+    if name not in bots:
+        abort(404)
+    application, loop, secret_token = bots[name]
+    received = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(received, secret_token):
+        logger.warning(f"Rejected webhook call for {name} with a bad secret token")
+        abort(403)
+    data = request.get_json(silent=True)
+    if not data:
+        abort(400)
+    update = Update.de_json(data, application.bot)
+    # The bot runs on its own event loop; hand the update over and answer Telegram at once
+    asyncio.run_coroutine_threadsafe(application.update_queue.put(update), loop)
+    return '', 200
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,323 @@
+# loadgen.py
+"""
+Concurrent-user load generator for both bots.
+
+Starts a local stand-in Bot API server, runs Debo_registration and Mrequests in
+a child process against it (long polling, Google Sheets/Drive replaced by the
+fakes in bench_fakes.py), and simulates users arriving at increasing rates.
+Each user goes through a whole conversation: register (with a document and a
+photo upload and a location share), edit their name and delete their profile,
+or request a professional near them. The latency measured is the user's view:
+from sending a message to the bot's reply arriving.
+
+    python loadgen.py --rates 1,2,5,10,20 --stage-seconds 60 --slo 2
+
+The report shows per arrival rate how many users were active at once and the
+p50/p95/p99 reply latency, and the first rate at which p95 exceeds --slo.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bench_fakes
+
+REPLY_METHODS = {"sendMessage", "editMessageText", "sendPhoto", "sendDocument"}
+
+
+class StandInBotAPI:
+    """Bot API state shared by the HTTP handler threads: pending updates per bot token, replies per chat."""
+
+    def __init__(self, latency, on_reply):
+        self.latency = latency
+        self.on_reply = on_reply          # called as on_reply(token, chat_id, method, params) from server threads
+        self._updates = {}                # token -> [update dict]
+        self._next_update_id = 1
+        self._cond = threading.Condition()
+        self.polling = set()              # tokens that have called getUpdates
+        self.calls = {}
+
+    def push(self, token, update):
+        with self._cond:
+            update["update_id"] = self._next_update_id
+            self._next_update_id += 1
+            self._updates.setdefault(token, []).append(update)
+            self._cond.notify_all()
+
+    def get_updates(self, token, offset, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.polling.add(token)
+            while True:
+                pending = self._updates.setdefault(token, [])
+                if offset:
+                    pending[:] = [update for update in pending if update["update_id"] >= offset]
+                if pending:
+                    return list(pending[:100])
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+
+    def call(self, token, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return self.get_updates(token, int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        time.sleep(self.latency.sample(self.latency.telegram))
+        if method in REPLY_METHODS and params.get("chat_id"):
+            self.on_reply(token, int(params["chat_id"]), method, params)
+        return bench_fakes.bot_api_result(method, params)
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith("/file/bot"):
+                time.sleep(api.latency.sample(api.latency.telegram))
+                self._send(200, os.urandom(bench_fakes.FILE_SIZE), "application/octet-stream")
+            else:
+                self._send(404, b"{}")
+
+        def do_POST(self):
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 2 or not parts[0].startswith("bot"):
+                self._send(404, b"{}")
+                return
+            token, method = parts[0][3:], parts[1]
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(body or b"{}")
+            else:
+                params = {key: values[-1] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+            result = api.call(token, method, params)
+            self._send(200, json.dumps({"ok": True, "result": result}).encode())
+
+    return Handler
+
+
+# --- Simulated users ---
+def register_scenario(factory):
+    return [
+        ("/register", factory.text("/register")),
+        ("full_name", factory.text("Abebe Kebede")),
+        ("profession", factory.text("plumber")),
+        ("phone", factory.text(factory.phone)),
+        ("location", factory.location(bench_fakes.CENTER_LAT, bench_fakes.CENTER_LON)),
+        ("region_city_woreda", factory.text("Addis Ababa, Bole, 03")),
+        ("testimonial_document", factory.document()),
+        ("testimonial_photo", factory.photo()),
+        ("testimonials_done", factory.text("Done ጨርሻያለው✅ ")),
+        ("educational_skip", factory.text("Skip እለፍ⏭️")),
+        ("/editprofile", factory.text("/editprofile")),
+        ("edit_name", factory.callback("edit_name")),
+        ("new_name", factory.text("Abebe K. Bekele")),
+        ("save_edit", factory.callback("edit_save")),
+        ("/deleteprofile", factory.text("/deleteprofile")),
+        ("confirm_delete", factory.text("Yes አዎ✅")),
+    ]
+
+
+def request_scenario(factory):
+    return [
+        ("request_entry", factory.text("REQUEST PROFESSIONAL | ባለሙያ ይጠይቁ")),
+        ("requester_name", factory.text("Almaz Tesfaye")),
+        ("requester_phone", factory.text("0911223344")),
+        ("professional_type", factory.text("Plumber")),
+        ("filter_near_me", factory.text("Near Me | ባቅራብያዬ")),
+        ("requester_location", factory.location(bench_fakes.CENTER_LAT + 0.01, bench_fakes.CENTER_LON)),
+        ("requester_address", factory.text("Addis Ababa, Bole")),
+        ("professional_count", factory.text("5")),
+    ]
+
+
+SCENARIOS = {
+    "register": (os.environ.get("TELEGRAM_BOT_TOKEN", "1:BENCH"), register_scenario),
+    "request": (os.environ.get("TELEGRAM_BOT_TOKEN2", "2:BENCH"), request_scenario),
+}
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.loop = None
+        self.inboxes = {}        # (token, chat id) -> asyncio.Queue of reply times
+        self.samples = []        # (stage, step, seconds or None on timeout)
+        self.active = 0
+        self.activity = {}       # stage -> [active users sampled every 0.5s]
+        self.completed = {}
+        self.stage = None
+
+    def on_reply(self, token, chat_id, method, params):
+        inbox = self.inboxes.get((token, chat_id))
+        if inbox is not None:
+            self.loop.call_soon_threadsafe(inbox.put_nowait, time.perf_counter())
+
+    async def run_user(self, api, stage, user_id, scenario):
+        token, build = SCENARIOS[scenario]
+        inbox = self.inboxes[(token, user_id)] = asyncio.Queue()
+        self.active += 1
+        try:
+            for step, update in build(bench_fakes.UpdateFactory(user_id)):
+                while not inbox.empty():   # extra messages from the previous step
+                    inbox.get_nowait()
+                sent = time.perf_counter()
+                api.push(token, update)
+                try:
+                    replied = await asyncio.wait_for(inbox.get(), self.args.reply_timeout)
+                except asyncio.TimeoutError:
+                    self.samples.append((stage, step, None))
+                    return
+                self.samples.append((stage, step, replied - sent))
+                await asyncio.sleep(random.expovariate(1 / self.args.think) if self.args.think else 0)
+            self.completed[stage] = self.completed.get(stage, 0) + 1
+        finally:
+            self.active -= 1
+            del self.inboxes[(token, user_id)]
+
+    async def sample_activity(self):
+        while True:
+            if self.stage is not None:
+                self.activity.setdefault(self.stage, []).append(self.active)
+            await asyncio.sleep(0.5)
+
+    async def run(self, api):
+        self.loop = asyncio.get_running_loop()
+        mix = [(name, float(weight)) for name, weight in
+               (item.split(":") for item in self.args.mix.split(","))]
+        sampler = asyncio.create_task(self.sample_activity())
+        users = []
+        user_id = 5_000_000_000
+        for rate in self.args.rates:
+            self.stage = rate
+            stage_end = time.monotonic() + self.args.stage_seconds
+            while time.monotonic() < stage_end:
+                scenario = random.choices([name for name, _ in mix], [weight for _, weight in mix])[0]
+                user_id += 1
+                users.append(asyncio.create_task(self.run_user(api, rate, user_id, scenario)))
+                await asyncio.sleep(random.expovariate(rate))
+        self.stage = "drain"
+        await asyncio.gather(*users)
+        sampler.cancel()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def report(generator, args):
+    print(f"{'users/s':>8} {'users':>6} {'done':>6} {'active avg':>10} {'active max':>10} "
+          f"{'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'timeouts':>8}")
+    breakdown = None
+    for rate in args.rates:
+        latencies = [seconds for stage, _, seconds in generator.samples if stage == rate and seconds is not None]
+        timeouts = sum(1 for stage, _, seconds in generator.samples if stage == rate and seconds is None)
+        started = sum(1 for stage, step, _ in generator.samples
+                      if stage == rate and step in ("/register", "request_entry"))
+        activity = generator.activity.get(rate, [0])
+        p95 = percentile(latencies, 0.95)
+        print(f"{rate:>8g} {started:>6} {generator.completed.get(rate, 0):>6} "
+              f"{sum(activity) / len(activity):>10.1f} {max(activity):>10} "
+              f"{percentile(latencies, 0.5):>7.2f} {p95:>7.2f} {percentile(latencies, 0.99):>7.2f} {timeouts:>8}")
+        if breakdown is None and (p95 > args.slo or timeouts > 0.01 * max(1, len(latencies))):
+            breakdown = (rate, max(activity))
+    if breakdown:
+        print(f"\nReply latency breaks down at {breakdown[0]:g} new users/s "
+              f"(up to {breakdown[1]} users in a conversation at once): p95 > {args.slo}s or >1% timeouts")
+    else:
+        print(f"\nNo breakdown up to {args.rates[-1]:g} new users/s (p95 <= {args.slo}s)")
+
+    steps = sorted({step for _, step, _ in generator.samples})
+    print(f"\n{'step':<22} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7}")
+    for step in steps:
+        values = [seconds for _, name, seconds in generator.samples if name == step and seconds is not None]
+        print(f"{step:<22} {percentile(values, 0.5):>7.2f} {percentile(values, 0.95):>7.2f} "
+              f"{percentile(values, 0.99):>7.2f}")
+
+
+def serve_bots(args, latency):
+    """Child process: both bots on one loop, polling the stand-in server."""
+    with tempfile.TemporaryDirectory() as workdir:
+        bench_fakes.install(workdir, latency, professionals=args.rows)
+        import bot_runtime
+        import Debo_registration
+        import Mrequests
+
+        Debo_registration.upload_to_drive = bench_fakes.fake_drive_upload(latency, [])
+        request = bot_runtime.shared_request()
+        bot_runtime.run({
+            "debo": Debo_registration.build_application(request=request),
+            "mrequests": Mrequests.build_application(request=request),
+        }, serve_health=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rates", default="1,2,5,10,20", help="comma-separated new users per second, one stage each")
+    parser.add_argument("--stage-seconds", type=float, default=60)
+    parser.add_argument("--mix", default="register:1,request:1", help="scenario weights")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds a user waits between messages")
+    parser.add_argument("--slo", type=float, default=2.0, help="p95 reply latency considered broken, seconds")
+    parser.add_argument("--reply-timeout", type=float, default=30.0)
+    parser.add_argument("--rows", type=int, default=10000, help="registered professionals in the fake sheet")
+    parser.add_argument("--port", type=int, default=8081, help="port of the stand-in Bot API server")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--sheets-latency", type=float, default=0.3)
+    parser.add_argument("--drive-latency", type=float, default=0.8)
+    parser.add_argument("--bots", action="store_true", help=argparse.SUPPRESS)  # child process mode
+    args = parser.parse_args()
+    args.rates = [float(rate) for rate in args.rates.split(",") if rate]
+    latency = bench_fakes.Latency(args.telegram_latency, args.sheets_latency, args.drive_latency)
+
+    if args.bots:
+        serve_bots(args, latency)
+        return
+
+    generator = LoadGenerator(args)
+    api = StandInBotAPI(latency, generator.on_reply)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    env = dict(os.environ, TELEGRAM_API_BASE_URL=f"http://127.0.0.1:{args.port}")
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--bots"] + sys.argv[1:], env=env)
+    try:
+        deadline = time.monotonic() + 120
+        while len(api.polling) < len(SCENARIOS):
+            if child.poll() is not None or time.monotonic() > deadline:
+                raise SystemExit("The bots did not start polling the stand-in server")
+            time.sleep(0.2)
+        asyncio.run(generator.run(api))
+    finally:
+        child.send_signal(signal.SIGTERM)
+        try:
+            child.wait(30)
+        except subprocess.TimeoutExpired:
+            child.kill()
+        server.shutdown()
+    report(generator, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,483 @@
+# local_store.py
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+import tracing
+from quota import may_have_landed
+from storage import run_io
+
+logger = logging.getLogger(__name__)
+
+# SQLite is the system of record for profiles and requests; the Google Sheets are
+# a mirror for the operations team, kept up to date from the outbox table.
+LOCAL_DB_PATH = os.environ.get("LOCAL_DB_PATH", "muya.db")
+# Other processes sharing the database (the requests bot) follow profile writes
+# through the profile_changes table, polled every PROFILE_CHANGES_POLL_SECONDS
+PROFILE_CHANGES_POLL_SECONDS = float(os.environ.get("PROFILE_CHANGES_POLL_SECONDS", "2"))
+PROFILE_CHANGES_KEEP_SECONDS = float(os.environ.get("PROFILE_CHANGES_KEEP_SECONDS", "86400"))
+SHEET_LOAD_TIMEOUT = float(os.environ.get("SHEET_LOAD_TIMEOUT", "120"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS professionals (
+    user_id    TEXT PRIMARY KEY,
+    row_json   TEXT NOT NULL,           -- {sheet column name: value}
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS requests (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id    TEXT,
+    row_json   TEXT NOT NULL,           -- the row as appended to the Requests sheet
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    sheet      TEXT NOT NULL,           -- "Professionals" or "Requests"
+    key        TEXT,                    -- user_id whose profile changed (Professionals)
+    payload    TEXT,                    -- row to append (Requests)
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_sheet ON outbox (sheet, id);
+CREATE TABLE IF NOT EXISTS profile_changes (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id    TEXT NOT NULL,           -- profile saved, updated or deleted
+    changed_at REAL NOT NULL
+);
+"""
+
+
+class LocalStore:
+    """Embedded SQLite store (WAL mode) with an outbox of changes still to reach the sheets."""
+
+    def __init__(self, path=LOCAL_DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # durable across crashes in WAL mode
+        self._conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with tracing.span("local_store.write"), self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        with tracing.span("local_store.read"), self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _enqueue(self, conn, sheet, key=None, payload=None):
+        cursor = conn.execute(
+            "INSERT INTO outbox (sheet, key, payload, created_at) VALUES (?, ?, ?, ?)",
+            (sheet, key, None if payload is None else json.dumps(payload, ensure_ascii=False), time.time()),
+        )
+        return cursor.lastrowid
+
+    def _profile_changed(self, conn, user_id):
+        """Queues the profile for the sheet mirror and records the change for other processes."""
+        self._enqueue(conn, "Professionals", key=str(user_id))
+        conn.execute("INSERT INTO profile_changes (user_id, changed_at) VALUES (?, ?)", (str(user_id), time.time()))
+
+    # --- Professionals ---
+    def get_professional(self, user_id):
+        rows = self._query("SELECT row_json FROM professionals WHERE user_id = ?", (str(user_id),))
+        return json.loads(rows[0][0]) if rows else None
+
+    def professionals(self):
+        """All profiles as (user_id, row)."""
+        return [(user_id, json.loads(row_json))
+                for user_id, row_json in self._query("SELECT user_id, row_json FROM professionals")]
+
+    def count_professionals(self):
+        return self._query("SELECT COUNT(*) FROM professionals")[0][0]
+
+    def save_professional(self, user_id, row):
+        """Creates or replaces the whole profile."""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO professionals (user_id, row_json, updated_at) VALUES (?, ?, ?)",
+                (str(user_id), json.dumps(row, ensure_ascii=False), time.time()),
+            )
+            self._profile_changed(conn, user_id)
+
+    def save_professionals(self, rows):
+        """save_professional() for many (user_id, row) pairs, in one transaction."""
+        with self._transaction() as conn:
+            for user_id, row in rows:
+                conn.execute(
+                    "INSERT OR REPLACE INTO professionals (user_id, row_json, updated_at) VALUES (?, ?, ?)",
+                    (str(user_id), json.dumps(row, ensure_ascii=False), time.time()),
+                )
+                self._profile_changed(conn, user_id)
+
+    def update_professional(self, user_id, fields):
+        """Merges {column name: value} into the profile. Returns False if there is no profile."""
+        with self._transaction() as conn:
+            found = conn.execute("SELECT row_json FROM professionals WHERE user_id = ?", (str(user_id),)).fetchone()
+            if not found:
+                return False
+            row = json.loads(found[0])
+            row.update(fields)
+            conn.execute(
+                "UPDATE professionals SET row_json = ?, updated_at = ? WHERE user_id = ?",
+                (json.dumps(row, ensure_ascii=False), time.time(), str(user_id)),
+            )
+            self._profile_changed(conn, user_id)
+            return True
+
+    def delete_professional(self, user_id):
+        with self._transaction() as conn:
+            deleted = conn.execute("DELETE FROM professionals WHERE user_id = ?", (str(user_id),)).rowcount
+            if deleted:
+                self._profile_changed(conn, user_id)
+            return bool(deleted)
+
+    def seed_professionals(self, rows):
+        """
+        Imports the (user_id, row) pairs read from the sheet that the store does not
+        have, without queueing them back to it. Profiles with changes still in the
+        outbox (a deletion not yet on the sheet) are left alone. Returns the user ids added.
+        """
+        with self._transaction() as conn:
+            pending = {key for (key,) in conn.execute("SELECT DISTINCT key FROM outbox WHERE sheet = 'Professionals'")}
+            added = []
+            for user_id, row in rows:
+                if str(user_id) in pending:
+                    continue
+                if conn.execute(
+                    "INSERT OR IGNORE INTO professionals (user_id, row_json, updated_at) VALUES (?, ?, ?)",
+                    (str(user_id), json.dumps(row, ensure_ascii=False), time.time()),
+                ).rowcount:
+                    added.append(str(user_id))
+        return added
+
+    def requests(self):
+        """All saved requests as (id, row), oldest first."""
+        return [(request_id, json.loads(row_json))
+                for request_id, row_json in self._query("SELECT id, row_json FROM requests ORDER BY id")]
+
+    # --- Changes, for other processes ---
+    def last_profile_change(self, before=None):
+        """Sequence number of the latest profile change (made before the wall time `before`), 0 if none."""
+        if before is None:
+            return self._query("SELECT COALESCE(MAX(seq), 0) FROM profile_changes")[0][0]
+        return self._query("SELECT COALESCE(MAX(seq), 0) FROM profile_changes WHERE changed_at < ?", (before,))[0][0]
+
+    def profile_changes(self, after_seq, limit=1000):
+        """(seq, user_id, current row or None if deleted) for changes after `after_seq`, oldest first."""
+        changes = self._query("SELECT seq, user_id FROM profile_changes WHERE seq > ? ORDER BY seq LIMIT ?",
+                              (after_seq, limit))
+        return [(seq, user_id, self.get_professional(user_id)) for seq, user_id in changes]
+
+    def prune_profile_changes(self, max_age=PROFILE_CHANGES_KEEP_SECONDS):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM profile_changes WHERE changed_at < ?", (time.time() - max_age,))
+
+    # --- Outbox ---
+    def outbox_entries(self, sheet, limit=None):
+        """Oldest pending entries for the sheet as (id, key, payload)."""
+        sql = "SELECT id, key, payload FROM outbox WHERE sheet = ? ORDER BY id"
+        params = (sheet,)
+        if limit:
+            sql += " LIMIT ?"
+            params = (sheet, limit)
+        return [(entry_id, key, None if payload is None else json.loads(payload))
+                for entry_id, key, payload in self._query(sql, params)]
+
+    def ack_outbox(self, entry_ids):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+
+    def outbox_depth(self, sheet=None):
+        if sheet is None:
+            return self._query("SELECT COUNT(*) FROM outbox")[0][0]
+        return self._query("SELECT COUNT(*) FROM outbox WHERE sheet = ?", (sheet,))[0][0]
+
+    def requests_journal(self, sheet="Requests"):
+        return RequestsJournal(self, sheet)
+
+
+class RequestsJournal:
+    """
+    write_queue.BatchAppender journal backed by the store: append() records the
+    request and its outbox entry in one transaction.
+    """
+
+    def __init__(self, store, sheet):
+        self.store = store
+        self.sheet = sheet
+
+    def replay(self):
+        return [(entry_id, payload) for entry_id, _, payload in self.store.outbox_entries(self.sheet)]
+
+    def append(self, row):
+        user_id = row[8] if len(row) > 8 else None  # "User ID" column of the Requests sheet
+        with self.store._transaction() as conn:
+            conn.execute(
+                "INSERT INTO requests (user_id, row_json, created_at) VALUES (?, ?, ?)",
+                (None if user_id is None else str(user_id), json.dumps(row, ensure_ascii=False), time.time()),
+            )
+            return self.store._enqueue(conn, self.sheet, payload=row)
+
+    def ack(self, entry_ids):
+        self.store.ack_outbox(entry_ids)
+
+
+def column_letter(number):
+    """1 -> A, 27 -> AA."""
+    letters = ""
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def first_appended_row(response):
+    """Row number where append_rows put its first row ("Professionals!A101:L103" -> 101), or None."""
+    try:
+        found = re.match(r"[A-Z]+(\d+)", response["updates"]["updatedRange"].split("!")[-1])
+    except (TypeError, KeyError, AttributeError):
+        return None
+    return int(found.group(1)) if found else None
+
+
+class ProfessionalsMirror:
+    """
+    Background task replaying the Professionals outbox onto the sheet.
+
+    The outbox only records which profiles changed; each sync writes their current
+    state from SQLite (a full-row batch_update, an append_rows for new profiles and
+    delete_rows for removed ones), so replaying an entry twice is harmless.
+
+    Row numbers come from the index, which can be minutes behind the sheet (rows
+    sorted, inserted or appended by hand or by another writer). Before a row is
+    updated or deleted its key cell is read back; on a mismatch the profile is left
+    for the next sync, which first re-reads the sheet into the index. So does a sync
+    after an append or delete that failed but may have landed, so the profile is
+    found on the sheet instead of being appended or deleted a second time.
+    """
+
+    def __init__(self, store, sheet, index, columns, batch_size=100, interval=2.0,
+                 base_delay=1.0, max_delay=60.0):
+        self.store = store
+        self.sheet = sheet          # storage.AsyncWorksheet
+        self.index = index          # sheet_index.SheetIndex, gives each user's row number
+        self.columns = columns      # callable returning the sheet's column names in order
+        self.batch_size = batch_size
+        self.interval = interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._wakeup = None
+        self._task = None
+        self._failures = 0
+        self._needs_reconcile = False
+        self.stats = {"synced_profiles": 0, "syncs": 0, "failed_syncs": 0, "last_sync_seconds": 0.0,
+                      "moved_rows": 0, "reconciles": 0}
+
+    def notify(self):
+        """Called after a local change so it is mirrored without waiting for the interval."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def metrics(self):
+        return dict(self.stats, queue_depth=self.store.outbox_depth("Professionals"))
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            while await self.sync_once():
+                pass
+        except Exception as e:
+            logger.error(f"Final Professionals sync failed, {self.store.outbox_depth('Professionals')} changes left: {e}")
+
+    async def _reconcile_index(self):
+        if await run_io(self.index.reconcile, timeout=SHEET_LOAD_TIMEOUT) is None:
+            raise RuntimeError("the sheet index changed while it was re-read")
+        self._needs_reconcile = False
+        self.stats["reconciles"] += 1
+
+    async def _rows_still_holding(self, targets):
+        """The users of {user_id: row number} whose row on the sheet still holds their key."""
+        if not targets:
+            return set()
+        key_column = column_letter(self.index.header.index(self.index.key_column) + 1)
+        found = await self.sheet.batch_get([f"{key_column}{row_idx}" for row_idx in targets.values()])
+        return {user_id for (user_id, _), cells in zip(targets.items(), found)
+                if cells and cells[0] and str(cells[0][0]).strip() == user_id}
+
+    async def _write(self, call, *args):
+        """A non-idempotent write; if it may have landed despite failing, the next sync re-reads the sheet."""
+        try:
+            return await call(*args)
+        except Exception as e:
+            if may_have_landed(e):
+                self._needs_reconcile = True
+            raise
+
+    async def sync_once(self):
+        entries = self.store.outbox_entries("Professionals", self.batch_size)
+        if not entries:
+            return 0
+        if self._needs_reconcile:
+            await self._reconcile_index()
+        started = time.monotonic()
+        columns = self.columns()
+        last_column = column_letter(len(columns))
+        user_ids = list(dict.fromkeys(key for _, key, _ in entries))
+        rows, targets, appends = {}, {}, []
+        for user_id in user_ids:
+            rows[user_id] = self.store.get_professional(user_id)
+            row_idx, _ = self.index.get(user_id)
+            if row_idx:
+                targets[user_id] = row_idx
+            elif rows[user_id] is not None:
+                appends.append([rows[user_id].get(column, "") for column in columns])
+
+        # Only touch rows that still hold the profile they are indexed for
+        verified = await self._rows_still_holding(targets)
+        moved = set(targets) - verified
+        if moved:
+            self._needs_reconcile = True
+            self.stats["moved_rows"] += len(moved)
+            logger.warning(f"{len(moved)} profile rows moved on the sheet, syncing them after re-reading it")
+        updates, deletes = [], []
+        for user_id in verified:
+            row_idx = targets[user_id]
+            if rows[user_id] is None:
+                deletes.append(row_idx)
+            else:
+                values = [rows[user_id].get(column, "") for column in columns]
+                updates.append((user_id, values, {"range": f"A{row_idx}:{last_column}{row_idx}", "values": [values]}))
+
+        if updates:
+            await self.sheet.batch_update([request for _, _, request in updates])
+            for user_id, values, _ in updates:
+                self.index.on_update(user_id, dict(zip(columns, values)))
+        if appends:
+            with self.index.rows_shifting():
+                first_row = first_appended_row(await self._write(self.sheet.append_rows, appends))
+                for offset, values in enumerate(appends):
+                    self.index.on_append(values, first_row + offset if first_row else None)
+        for row_idx in sorted(deletes, reverse=True):  # bottom-up so earlier deletes don't shift later ones
+            with self.index.rows_shifting():
+                await self._write(self.sheet.delete_rows, row_idx)
+                self.index.on_delete(row_idx)
+
+        done = [entry_id for entry_id, key, _ in entries if key not in moved]
+        self.store.ack_outbox(done)
+        elapsed = time.monotonic() - started
+        self.stats["syncs"] += 1
+        self.stats["synced_profiles"] += len(user_ids) - len(moved)
+        self.stats["last_sync_seconds"] = elapsed
+        logger.info(f"Mirrored {len(user_ids) - len(moved)} profile changes to the sheet in {elapsed:.2f}s "
+                    f"({len(updates)} updated, {len(appends)} added, {len(deletes)} deleted)")
+        return len(done)
+
+    async def _run(self):
+        while True:
+            if self._failures:
+                delay = min(self.max_delay, self.base_delay * 2 ** (self._failures - 1))
+                await asyncio.sleep(random.uniform(0, delay))
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            try:
+                while await self.sync_once() == self.batch_size:
+                    pass
+                self._failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failures += 1
+                self.stats["failed_syncs"] += 1
+                logger.error(f"Error mirroring profiles to the sheet (attempt {self._failures}): {e}")
+
+
+class ProfileChangeFeed:
+    """
+    Background task calling listener(user_id, row) for every profile written to the
+    store by any process (row is None for a deleted profile), within `interval`
+    seconds. It starts with the changes of the last `replay_seconds`, which may
+    not be on the sheet yet when the listener's index was loaded from it.
+    """
+
+    def __init__(self, store, listener, interval=PROFILE_CHANGES_POLL_SECONDS, replay_seconds=600):
+        self.store = store
+        self.listener = listener
+        self.interval = interval
+        self.replay_seconds = replay_seconds
+        self.last_seq = None
+        self._task = None
+
+    def poll_once(self):
+        if self.last_seq is None:
+            self.last_seq = self.store.last_profile_change(before=time.time() - self.replay_seconds)
+        changes = self.store.profile_changes(self.last_seq)
+        for seq, user_id, row in changes:
+            self.listener(user_id, row)
+            self.last_seq = seq
+        return len(changes)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        pruned = 0.0
+        while True:
+            try:
+                if self.poll_once():
+                    logger.debug(f"Applied profile changes up to {self.last_seq}")
+                if time.monotonic() - pruned > 3600:
+                    pruned = time.monotonic()
+                    self.store.prune_profile_changes()
+            except Exception as e:
+                logger.error(f"Error reading profile changes: {e}")
+            await asyncio.sleep(self.interval)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path=LOCAL_DB_PATH):
+    """One LocalStore per database file for the whole process."""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = LocalStore(path)
+        return store
@@ -0,0 +1,307 @@
+# metrics.py
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+import health
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# In-process metrics rendered in the Prometheus text format by GET /metrics.
+# Bot processes that do not serve HTTP themselves (the default subprocess mode)
+# write their metrics to metrics_<name>.json in HEALTH_STATE_DIR every
+# METRICS_STATE_WRITE_SECONDS; /metrics merges those in with a "process" label.
+METRICS_STATE_WRITE_SECONDS = float(os.environ.get("METRICS_STATE_WRITE_SECONDS", "15"))
+METRICS_STATE_MAX_AGE = float(os.environ.get("METRICS_STATE_MAX_AGE", "60"))  # older files are from dead processes
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_registry = []   # metrics in registration order
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    kind = "counter"
+
+    def samples(self, extra=()):
+        with _lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}"
+                for labels, value in values]
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}   # labels -> [bucket counts..., sum]
+        with _lock:
+            _registry.append(self)
+
+    def observe(self, seconds, *labels):
+        with _lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+            values[-1] += seconds
+
+    kind = "histogram"
+
+    def samples(self, extra=()):
+        with _lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        lines = []
+        for labels, counts in values:
+            for bound, count in zip(self.buckets, counts):
+                le = (("le", _format_value(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, tuple(extra) + le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels, extra)} {counts[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels, extra)} {counts[-2]}")
+        return lines
+
+
+class Gauge:
+    """Value read when /metrics is scraped: fn() returns a number or {label values tuple: number}."""
+
+    def __init__(self, name, help_text, labelnames=(), fn=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._sources = [fn] if fn else []
+        with _lock:
+            _registry.append(self)
+
+    def add_source(self, fn):
+        self._sources.append(fn)
+
+    kind = "gauge"
+
+    def samples(self, extra=()):
+        lines = []
+        for fn in list(self._sources):
+            try:
+                values = fn()
+            except Exception as e:
+                logger.error(f"Error reading gauge {self.name}: {e}")
+                continue
+            if not isinstance(values, dict):
+                values = {(): values}
+            for labels, value in values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}")
+        return lines
+
+
+def collect(extra=()):
+    """[(name, help, type, sample lines)] for every metric of this process."""
+    with _lock:
+        registry = list(_registry)
+    return [(metric.name, metric.help, metric.kind, metric.samples(extra)) for metric in registry]
+
+
+def _state_path(name):
+    return os.path.join(health.HEALTH_STATE_DIR, f"metrics_{name}.json")
+
+
+def _exported_families():
+    """Families written by the other live processes (see export_state)."""
+    if not health.HEALTH_STATE_DIR:
+        return []
+    families = []
+    for path in glob.glob(_state_path("*")):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if state["pid"] != os.getpid() and time.time() - state["written_at"] <= METRICS_STATE_MAX_AGE:
+            families.extend(state["families"])
+    return families
+
+
+def render():
+    merged = {}   # name -> (help, type, sample lines); each family is written once
+    for name, help_text, kind, samples in collect() + _exported_families():
+        merged.setdefault(name, (help_text, kind, []))[2].extend(samples)
+    lines = []
+    for name, (help_text, kind, samples) in merged.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + samples
+    return "\n".join(lines) + "\n"
+
+
+_export_stop = threading.Event()
+
+
+def export_state(name, interval=METRICS_STATE_WRITE_SECONDS):
+    """
+    Writes this process's metrics, labelled process=<name>, to metrics_<name>.json
+    every `interval` seconds, for the /metrics of an HTTP server in another process.
+    """
+    if not health.HEALTH_STATE_DIR:
+        return
+    path = _state_path(name)
+
+    def write():
+        state = {"pid": os.getpid(), "written_at": time.time(), "families": collect((("process", name),))}
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    def loop():
+        while not _export_stop.is_set():
+            try:
+                write()
+            except Exception as e:
+                logger.warning(f"Could not write metrics state {path}: {e}")
+            _export_stop.wait(interval)
+        try:
+            os.remove(path)  # stopped on purpose
+        except OSError:
+            pass
+
+    _export_stop.clear()
+    threading.Thread(target=loop, name="metrics-export", daemon=True).start()
+
+
+def stop_export():
+    _export_stop.set()
+
+
+# --- Metrics shared by the modules of this repo ---
+handler_updates = Counter("bot_handler_updates_total", "Updates handled, by bot and handler", ("bot", "handler"))
+handler_seconds = Histogram("bot_handler_seconds", "Handler latency", ("bot", "handler"))
+errors = Counter("bot_errors_total", "Exceptions raised by handlers and Google API calls, by type", ("source", "type"))
+google_api_seconds = Histogram("google_api_seconds", "Google Sheets/Drive call latency, by quota class and operation",
+                               ("quota_class", "operation"))
+active_conversations = Gauge("bot_active_conversations", "Conversations in progress, by state",
+                             ("bot", "conversation", "state"))
+queue_depth = Gauge("bot_queue_depth", "Items waiting in background queues", ("queue",))
+cache_lookups = Counter("bot_cache_lookups_total", "In-memory cache lookups, by cache and result (hit, miss)",
+                        ("cache", "result"))
+
+
+def _process_rss():
+    import psutil
+
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+Gauge("process_resident_memory_bytes", "Resident set size of this process", fn=_process_rss)
+
+
+def _quota_counters():
+    import quota
+
+    return {(key,): value for key, value in quota.metrics().items()}
+
+
+Gauge("bot_event_loop_lag_seconds", "Event loop scheduling delay over the last minute, by bot and quantile",
+      ("bot", "quantile"), fn=health.lag_percentiles)
+
+
+def _startup_phases():
+    import bot_runtime
+
+    return {(phase,): seconds for phase, seconds in bot_runtime.startup_phases.items()}
+
+
+Gauge("bot_startup_seconds", "Duration of each startup phase; <bot>.ready is seconds from process start",
+      ("phase",), fn=_startup_phases)
+
+
+Gauge("google_api_quota", "Google API quota counters (calls, throttled, retried, coalesced, failed)",
+      ("counter",), fn=_quota_counters)
+
+
+# --- Handler instrumentation ---
+def _wrap_handler(bot, handler):
+    callback = handler.callback
+    name = getattr(callback, "__name__", type(handler).__name__)
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            with tracing.trace(bot, name, update):
+                return await callback(update, context)
+        except Exception as e:
+            errors.inc(f"{bot}.{name}", type(e).__name__)
+            raise
+        finally:
+            health.note_update(bot)
+            handler_updates.inc(bot, name)
+            handler_seconds.observe(time.perf_counter() - started, bot, name)
+
+    handler.callback = timed
+
+
+def instrument_application(application, bot):
+    """
+    Wraps the callback of every handler registered on the application (including
+    the states of ConversationHandlers) to count updates, time them and trace
+    their external calls (see tracing.py), and exposes the number of conversations
+    in each state, as kept by the application's persistence (if it counts them,
+    like persistence.SQLitePersistence). Call once all handlers are added.
+    """
+    from telegram.ext import ConversationHandler
+
+    seen = set()
+
+    def visit(handler):
+        if id(handler) in seen:
+            return
+        seen.add(id(handler))
+        if isinstance(handler, ConversationHandler):
+            for child in handler.entry_points + handler.fallbacks:
+                visit(child)
+            for state_handlers in handler.states.values():
+                for child in state_handlers:
+                    visit(child)
+        elif getattr(handler, "callback", None) is not None:
+            _wrap_handler(bot, handler)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            visit(handler)
+
+    persistence = application.persistence
+    if hasattr(persistence, "conversation_states"):
+        active_conversations.add_source(
+            lambda: {(bot, name, state): count for (name, state), count in persistence.conversation_states().items()})
+    logger.info(f"[{bot}] Instrumented {len(seen)} handlers")
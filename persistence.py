@@ -0,0 +1,206 @@
+# persistence.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from local_store import LOCAL_DB_PATH
+from storage import run_io
+
+logger = logging.getLogger(__name__)
+
+# How often the Application hands changed user_data / conversation states to us
+PERSISTENCE_FLUSH_SECONDS = float(os.environ.get("PERSISTENCE_FLUSH_SECONDS", "10"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_data (
+    namespace TEXT NOT NULL,             -- bot name, so bots sharing a database don't collide
+    kind      TEXT NOT NULL,             -- "user", "chat" or "bot"
+    id        TEXT NOT NULL,
+    data      TEXT NOT NULL,
+    PRIMARY KEY (namespace, kind, id)
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    namespace TEXT NOT NULL,
+    name      TEXT NOT NULL,             -- ConversationHandler name
+    key       TEXT NOT NULL,             -- JSON of the (chat_id, user_id, ...) key
+    state     TEXT NOT NULL,             -- JSON of the state
+    PRIMARY KEY (namespace, name, key)
+);
+"""
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Conversation persistence in SQLite, one row per user / conversation key.
+
+    The Application only passes the users and conversations that changed since the
+    last round (every `update_interval` seconds); those rows are buffered and written
+    in a single transaction right after the round, off the event loop. Nothing is
+    rewritten for users whose state did not change. Empty user_data and ended
+    conversations are deleted, so the tables only hold live sessions.
+    """
+
+    def __init__(self, namespace, path=LOCAL_DB_PATH, update_interval=PERSISTENCE_FLUSH_SECONDS):
+        super().__init__(
+            # The bots only keep state in user_data; chat/bot data would just add writes
+            store_data=PersistenceInput(user_data=True, chat_data=False, bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._pending_data = {}          # (kind, id) -> JSON, or None to delete
+        self._pending_conversations = {} # (name, key JSON) -> state JSON, or None to delete
+        self._conversation_states = {}   # (name, key JSON) -> state, for metrics.active_conversations
+        self._flush_task = None
+
+    # --- Loading ---
+    def _load(self, kind):
+        started = time.monotonic()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, data FROM session_data WHERE namespace = ? AND kind = ?", (self.namespace, kind)
+            ).fetchall()
+        data = {int(row_id): json.loads(raw) for row_id, raw in rows}
+        logger.info(f"[{self.namespace}] Loaded {len(data)} {kind}_data entries in {time.monotonic() - started:.2f}s")
+        return data
+
+    async def get_user_data(self):
+        return self._load("user")
+
+    async def get_chat_data(self):
+        return self._load("chat")
+
+    async def get_bot_data(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM session_data WHERE namespace = ? AND kind = 'bot' AND id = ''", (self.namespace,)
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, state FROM conversations WHERE namespace = ? AND name = ?", (self.namespace, name)
+            ).fetchall()
+        conversations = {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+        for key, state in conversations.items():
+            self._conversation_states[(name, json.dumps(list(key)))] = state
+        return conversations
+
+    def conversation_states(self):
+        """{(conversation name, state): conversations in it}, as of the last persistence round."""
+        counts = {}
+        for (name, _), state in list(self._conversation_states.items()):
+            counts[(name, str(state))] = counts.get((name, str(state)), 0) + 1
+        return counts
+
+    # --- Incremental updates ---
+    def _schedule_flush(self):
+        # The Application awaits our update_* calls back to back; writing once the
+        # round is over turns all of its changes into one transaction.
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        await asyncio.sleep(0)
+        # Changes handed over while a write runs on the executor are written by the
+        # next pass, not left waiting for the next change
+        while self._pending_data or self._pending_conversations:
+            try:
+                await run_io(self._write_pending)
+            except Exception as e:
+                logger.error(f"[{self.namespace}] Error writing session data, retrying in {self.update_interval}s: {e}")
+                await asyncio.sleep(self.update_interval)
+
+    def _set(self, kind, item_id, data):
+        try:
+            raw = json.dumps(data, ensure_ascii=False) if data else None
+        except TypeError as e:  # a value that would not come back the same after a restart
+            raise TypeError(f"[{self.namespace}] {kind}_data of {item_id} cannot be stored as JSON: {e}") from e
+        self._pending_data[(kind, str(item_id))] = raw
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id, data):
+        self._set("user", user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._set("chat", chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._set("bot", "", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._set("user", user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._set("chat", chat_id, None)
+
+    async def update_conversation(self, name, key, new_state):
+        key = json.dumps(list(key))
+        self._pending_conversations[(name, key)] = None if new_state is None else json.dumps(new_state)
+        if new_state is None:
+            self._conversation_states.pop((name, key), None)
+        else:
+            self._conversation_states[(name, key)] = new_state
+        self._schedule_flush()
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _write_pending(self):
+        with self._lock:
+            data, self._pending_data = self._pending_data, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            if not data and not conversations:
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for (kind, item_id), raw in data.items():
+                    if raw is None:
+                        self._conn.execute("DELETE FROM session_data WHERE namespace = ? AND kind = ? AND id = ?",
+                                           (self.namespace, kind, item_id))
+                    else:
+                        self._conn.execute("INSERT OR REPLACE INTO session_data VALUES (?, ?, ?, ?)",
+                                           (self.namespace, kind, item_id, raw))
+                for (name, key), state in conversations.items():
+                    if state is None:
+                        self._conn.execute("DELETE FROM conversations WHERE namespace = ? AND name = ? AND key = ?",
+                                           (self.namespace, name, key))
+                    else:
+                        self._conn.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?)",
+                                           (self.namespace, name, key, state))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                # Keep the changes for the next attempt unless newer ones replaced them
+                self._pending_data = {**data, **self._pending_data}
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                raise
+
+    async def flush(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        self._write_pending()
+        logger.info(f"[{self.namespace}] Session data flushed")
@@ -0,0 +1,106 @@
+# phones.py
+import re
+import threading
+
+# Ethiopia: +251 followed by a 9-digit national number (9xxxxxxxx / 7xxxxxxxx mobile,
+# area code + subscriber for landlines), written locally with a leading 0.
+DEFAULT_COUNTRY_CODE = "251"
+NATIONAL_NUMBER_LENGTH = 9
+
+_SEPARATORS = re.compile(r"[\s().\-/]")
+_ETHIOPIC_DIGITS = str.maketrans("፩፪፫፬፭፮፯፰፱", "123456789")
+
+
+def normalize_phone(text, country_code=DEFAULT_COUNTRY_CODE):
+    """
+    E.164 form of a phone number as typed, or None if it cannot be one.
+    "0912 345 678", "+251912345678", "251-912-345678", "00251912345678" and
+    "912345678" all give "+251912345678".
+    """
+    if not text:
+        return None
+    cleaned = _SEPARATORS.sub("", str(text).strip().translate(_ETHIOPIC_DIGITS))
+    if cleaned.startswith("00"):
+        cleaned = "+" + cleaned[2:]
+    if cleaned.startswith("+"):
+        digits = cleaned[1:]
+        if not digits.isdigit():
+            return None
+    else:
+        if not cleaned.isdigit():
+            return None
+        if cleaned.startswith(country_code) and len(cleaned) == len(country_code) + NATIONAL_NUMBER_LENGTH:
+            digits = cleaned
+        elif cleaned.startswith("0") and len(cleaned) == NATIONAL_NUMBER_LENGTH + 1:
+            digits = country_code + cleaned[1:]
+        elif len(cleaned) == NATIONAL_NUMBER_LENGTH and cleaned[0] != "0":
+            digits = country_code + cleaned
+        else:
+            return None
+    if digits.startswith(country_code):
+        national = digits[len(country_code):]
+        if national.startswith("0"):          # "+251 0912..." typed with the trunk 0
+            national = national[1:]
+        if len(national) != NATIONAL_NUMBER_LENGTH or national[0] == "0":
+            return None
+        digits = country_code + national
+    elif not 8 <= len(digits) <= 15 or digits[0] == "0":
+        return None
+    return "+" + digits
+
+
+def is_valid_phone_number(phone_number: str) -> bool:
+    return normalize_phone(phone_number) is not None
+
+
+class PhoneIndex:
+    """
+    Hash index from normalized phone number to the keys (user ids, request ids)
+    recorded with it, so duplicates are found without scanning the sheet.
+    """
+
+    def __init__(self, phone_column="PHONE"):
+        self.phone_column = phone_column
+        self._keys = {}        # E.164 -> set of keys
+        self._phones = {}      # key -> E.164
+        self._lock = threading.Lock()
+
+    def add(self, key, phone):
+        phone = normalize_phone(phone)
+        key = str(key)
+        with self._lock:
+            self._remove(key)
+            if phone:
+                self._keys.setdefault(phone, set()).add(key)
+                self._phones[key] = phone
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(str(key))
+
+    def _remove(self, key):
+        phone = self._phones.pop(key, None)
+        if phone:
+            keys = self._keys.get(phone)
+            keys.discard(key)
+            if not keys:
+                del self._keys[phone]
+
+    def sync_row(self, key, row):
+        """Row listener: indexes the row's phone column, or forgets the key when row is None."""
+        if row is None:
+            self.remove(key)
+        else:
+            self.add(key, row.get(self.phone_column, ""))
+
+    def keys(self, phone):
+        """Keys recorded with this number (in any format)."""
+        phone = normalize_phone(phone)
+        with self._lock:
+            return set(self._keys.get(phone, ())) if phone else set()
+
+    def owners_other_than(self, phone, key):
+        return self.keys(phone) - {str(key)}
+
+    def __len__(self):
+        return len(self._phones)
@@ -0,0 +1,190 @@
+# professions.py
+import collections
+import functools
+import logging
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# --- Canonical taxonomy ---
+# id -> English name, Amharic name, and other spellings people actually type.
+# Add new professions/aliases here; the index is rebuilt at import time.
+PROFESSIONS = {
+    "doctor": {"en": "Doctor", "am": "ሐኪም", "aliases": ["physician", "general practitioner", "gp", "ዶክተር", "ዶ/ር", "dr", "medical doctor"]},
+    "oncologist": {"en": "Oncologist", "am": "ኦንኮሎጂስት", "aliases": ["cancer doctor", "የካንሰር ሐኪም"]},
+    "dentist": {"en": "Dentist", "am": "የጥርስ ሐኪም", "aliases": ["dental doctor", "ዴንቲስት"]},
+    "veterinarian": {"en": "Veterinarian", "am": "የእንስሳት ሐኪም", "aliases": ["vet", "veterinary doctor", "ቬተሪናሪ"]},
+    "nurse": {"en": "Nurse", "am": "ነርስ", "aliases": ["nursing", "ነርሲንግ"]},
+    "pharmacist": {"en": "Pharmacist", "am": "ፋርማሲስት", "aliases": ["pharmacy", "druggist", "ፋርማሲ"]},
+    "civil_engineer": {"en": "Civil Engineer", "am": "ሲቪል ኢንጂነር", "aliases": ["civil engineering", "ሲቪል መሐንዲስ"]},
+    "electrical_engineer": {"en": "Electrical Engineer", "am": "ኤሌክትሪካል ኢንጂነር", "aliases": ["electrical engineering", "ኤሌክትሪካል መሐንዲስ"]},
+    "mechanical_engineer": {"en": "Mechanical Engineer", "am": "ሜካኒካል ኢንጂነር", "aliases": ["mechanical engineering", "ሜካኒካል መሐንዲስ"]},
+    "architect": {"en": "Architect", "am": "አርክቴክት", "aliases": ["architecture", "አርኪቴክት"]},
+    "software_developer": {"en": "Software Developer", "am": "ሶፍትዌር ዴቨሎፐር", "aliases": ["programmer", "software engineer", "developer", "web developer", "ፕሮግራመር", "ሶፍትዌር ኢንጂነር"]},
+    "it_technician": {"en": "IT Technician", "am": "የአይቲ ባለሙያ", "aliases": ["it support", "computer technician", "network technician", "የኮምፒውተር ጥገና"]},
+    "graphic_designer": {"en": "Graphic Designer", "am": "ግራፊክስ ዲዛይነር", "aliases": ["graphics designer", "designer", "ግራፊክ ዲዛይነር"]},
+    "electrician": {"en": "Electrician", "am": "የኤሌክትሪክ ሰራተኛ", "aliases": ["electric technician", "ኤሌክትሪሺያን", "ኤሌክትሪክ ባለሙያ", "የመብራት ባለሙያ"]},
+    "plumber": {"en": "Plumber", "am": "የቧምቧ ባለሙያ", "aliases": ["plumbing", "ቧምቧ ሰራተኛ", "ፕላመር", "የውሃ ቧንቧ ባለሙያ"]},
+    "carpenter": {"en": "Carpenter", "am": "አናጺ", "aliases": ["woodworker", "furniture maker", "joiner", "የእንጨት ስራ ባለሙያ", "ካርፔንተር"]},
+    "mason": {"en": "Mason", "am": "ግንበኛ", "aliases": ["bricklayer", "construction worker", "ሜሰን", "የግንባታ ሰራተኛ"]},
+    "painter": {"en": "Painter", "am": "ቀለም ቀቢ", "aliases": ["house painter", "ቀለም ቀቢ ባለሙያ", "ፔይንተር"]},
+    "welder": {"en": "Welder", "am": "በያጅ", "aliases": ["welding", "metal worker", "ብየዳ ባለሙያ", "የብረት ስራ ባለሙያ"]},
+    "mechanic": {"en": "Mechanic", "am": "መካኒክ", "aliases": ["car mechanic", "auto mechanic", "garage", "የመኪና ጥገና ባለሙያ", "ጋራዥ"]},
+    "driver": {"en": "Driver", "am": "ሹፌር", "aliases": ["chauffeur", "taxi driver", "truck driver", "አሽከርካሪ"]},
+    "daily_laborer": {"en": "Daily Laborer", "am": "ተምላላሽ ሰራተኛ", "aliases": ["daily labourer", "laborer", "labourer", "helper", "የቀን ሰራተኛ", "ቀን ሰራተኛ"]},
+    "housemaid": {"en": "Housemaid", "am": "የቤት ሰራተኛ", "aliases": ["maid", "house keeper", "housekeeper", "cleaner", "ጽዳት ሰራተኛ"]},
+    "cook": {"en": "Cook", "am": "ምግብ አብሳይ", "aliases": ["chef", "ሼፍ", "ወጥ ቤት", "ምግብ ሰሪ"]},
+    "tailor": {"en": "Tailor", "am": "ልብስ ሰፊ", "aliases": ["seamstress", "dressmaker", "ቴለር", "የልብስ ስፌት ባለሙያ"]},
+    "barber": {"en": "Barber / Hairdresser", "am": "ፀጉር አስተካካይ", "aliases": ["barber", "hairdresser", "hair stylist", "beauty salon", "ፀጉር ቤት", "ባርበር"]},
+    "teacher": {"en": "Teacher / Tutor", "am": "መምህር", "aliases": ["teacher", "tutor", "instructor", "አስተማሪ", "ቲቸር", "ሞግዚት መምህር"]},
+    "accountant": {"en": "Accountant", "am": "ሂሳብ ሰራተኛ", "aliases": ["accounting", "bookkeeper", "auditor", "አካውንታንት", "የሂሳብ ባለሙያ"]},
+    "lawyer": {"en": "Lawyer", "am": "ጠበቃ", "aliases": ["attorney", "advocate", "legal advisor", "ሎየር", "የህግ ባለሙያ", "የህግ አማካሪ"]},
+    "translator": {"en": "Translator", "am": "ተርጓሚ", "aliases": ["interpreter", "translation", "ትርጉም"]},
+    "photographer": {"en": "Photographer", "am": "ፎቶ አንሺ", "aliases": ["photography", "videographer", "ፎቶግራፈር", "ቪዲዮ አንሺ"]},
+    "security_guard": {"en": "Security Guard", "am": "ጥበቃ", "aliases": ["guard", "watchman", "security", "ዘበኛ", "የጥበቃ ሰራተኛ"]},
+    "satellite_installer": {"en": "Satellite Dish Installer", "am": "የዲሽ ባለሙያ", "aliases": ["dish installer", "satellite technician", "ዲሽ ገጣሚ"]},
+}
+
+FUZZY_MATCH_THRESHOLD = 0.45
+
+# --- Normalization ---
+# Ge'ez syllables come in blocks of 8 (one per vowel order). Letters that sound the
+# same in Amharic are folded onto one series so that ሐኪም, ኀኪም and ሀኪም compare equal.
+_GEEZ_SERIES_FOLD = {
+    0x1210: 0x1200,  # ሐ -> ሀ
+    0x1280: 0x1200,  # ኀ -> ሀ
+    0x12B8: 0x1200,  # ኸ -> ሀ
+    0x1220: 0x1230,  # ሠ -> ሰ
+    0x12D0: 0x12A0,  # ዐ -> አ
+    0x1340: 0x1338,  # ፀ -> ጸ
+}
+# For the guttural series the 1st and 4th orders (ሀ/ሃ, አ/ኣ) are pronounced alike
+_GUTTURAL_SERIES = (0x1200, 0x12A0)
+
+
+def _fold_geez(char):
+    code = ord(char)
+    if not 0x1200 <= code < 0x1380:
+        return char
+    order = (code - 0x1200) % 8
+    base = code - order
+    base = _GEEZ_SERIES_FOLD.get(base, base)
+    if base in _GUTTURAL_SERIES and order == 3:
+        order = 0
+    return chr(base + order)
+
+
+_PUNCTUATION_RE = re.compile(r"[\s፡-፨/\\|,.;:!?()\[\]{}\"'`_\-–—]+")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_text(text):
+    """Casefolds, folds Ge'ez homophones and strips Latin/Ethiopic punctuation."""
+    text = unicodedata.normalize("NFC", str(text or "")).casefold()
+    text = "".join(_fold_geez(c) for c in text)
+    return " ".join(_PUNCTUATION_RE.sub(" ", text).split())
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _is_geez(char):
+    return 0x1200 <= ord(char) < 0x1380
+
+
+def _script_segments(text):
+    """Splits mixed text such as "civil engineer ሲቪል ኢንጂነር" into per-script runs."""
+    segments, current, current_geez = [], [], None
+    for word in text.split():
+        geez = any(_is_geez(c) for c in word)
+        if current and geez != current_geez:
+            segments.append(" ".join(current))
+            current = []
+        current.append(word)
+        current_geez = geez
+    if current:
+        segments.append(" ".join(current))
+    return segments
+
+
+class ProfessionIndex:
+    """
+    Exact alias table plus a trigram inverted index over every normalized alias.
+    resolve() tries an exact hit first and otherwise scores the aliases sharing
+    trigrams with the input (Dice coefficient), so misspellings still resolve.
+    """
+
+    def __init__(self, professions, threshold=FUZZY_MATCH_THRESHOLD):
+        self.professions = professions
+        self.threshold = threshold
+        self._exact = {}                                # normalized alias -> profession id
+        self._aliases = []                              # [(profession id, trigram count)]
+        self._postings = collections.defaultdict(list)  # trigram -> [alias number]
+        for profession_id, entry in professions.items():
+            for name in [profession_id.replace("_", " "), entry["en"], entry["am"], *entry.get("aliases", [])]:
+                self.add_alias(profession_id, name)
+
+    def add_alias(self, profession_id, name):
+        normalized = normalize_text(name)
+        if not normalized or normalized in self._exact:
+            return
+        self._exact[normalized] = profession_id
+        grams = _trigrams(normalized)
+        number = len(self._aliases)
+        self._aliases.append((profession_id, len(grams)))
+        for gram in grams:
+            self._postings[gram].append(number)
+
+    def _best_match(self, normalized):
+        if normalized in self._exact:
+            return self._exact[normalized], 1.0
+        grams = _trigrams(normalized)
+        shared = collections.Counter()
+        for gram in grams:
+            for number in self._postings.get(gram, ()):
+                shared[number] += 1
+        best_id, best_score = None, 0.0
+        for number, common in shared.items():
+            profession_id, size = self._aliases[number]
+            score = 2 * common / (len(grams) + size)
+            if score > best_score:
+                best_id, best_score = profession_id, score
+        return best_id, best_score
+
+    def resolve(self, text):
+        """Maps free text to (profession id, score); id is None when nothing is close enough."""
+        normalized = normalize_text(text)
+        if not normalized:
+            return None, 0.0
+        best_id, best_score = self._best_match(normalized)
+        segments = _script_segments(normalized)
+        if best_score < 1.0 and len(segments) > 1:
+            for segment in segments:
+                segment_id, score = self._best_match(segment)
+                if score > best_score:
+                    best_id, best_score = segment_id, score
+        if best_score < self.threshold:
+            return None, best_score
+        return best_id, best_score
+
+
+profession_index = ProfessionIndex(PROFESSIONS)
+
+
+@functools.lru_cache(maxsize=4096)
+def resolve_profession(text):
+    """Canonical profession id for free text, or None."""
+    return profession_index.resolve(text)[0]
+
+
+def profession_key(text):
+    """Key used to group professionals: the canonical id, or the normalized text if unknown."""
+    return resolve_profession(text) or normalize_text(text)
+
+
+def profession_label(profession_id):
+    entry = PROFESSIONS.get(profession_id)
+    return f"{entry['en']} / {entry['am']}" if entry else ""
@@ -0,0 +1,75 @@
+# profile_cache.py
+import collections
+import logging
+import os
+import threading
+import time
+
+from metrics import cache_lookups
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", "300"))
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "5000"))
+
+
+class ProfileCache:
+    """
+    Per-user profile rows kept in memory for `ttl` seconds, at most `max_entries`
+    of them (least recently used are evicted first). The bot writes through it:
+    every local save/update/delete of a profile also calls put/update/invalidate,
+    so a cached row is never older than the local store. Edits made by hand on
+    the sheet never reach either: misses are read from the store, and the mirror
+    writes the store's copy over the sheet row on the profile's next change.
+    """
+
+    def __init__(self, name="profile", ttl=PROFILE_CACHE_TTL, max_entries=PROFILE_CACHE_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()   # user_id -> (expires_at, row)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """The cached row (a copy), or None on a miss."""
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        cache_lookups.inc(self.name, "miss" if entry is None else "hit")
+        return dict(entry[1]) if entry is not None else None
+
+    def put(self, user_id, row):
+        key = str(user_id)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, dict(row))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def update(self, user_id, fields):
+        """Applies changed fields to a cached row in place; rows not cached are left alone."""
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1].update(fields)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def metrics(self):
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses}
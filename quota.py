@@ -0,0 +1,226 @@
+# quota.py
+import collections
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import health
+import tracing
+from metrics import errors, google_api_seconds
+from storage import DeadlineExceeded, current_deadline
+
+logger = logging.getLogger(__name__)
+
+# Google quotas are per minute and per service account. Each (account, quota class)
+# gets a token bucket refilled at the per-minute rate, holding at most QUOTA_BURST calls.
+QUOTA_RATES = {
+    "sheets_read": int(os.environ.get("SHEETS_READS_PER_MINUTE", "60")),
+    "sheets_write": int(os.environ.get("SHEETS_WRITES_PER_MINUTE", "60")),
+    "drive": int(os.environ.get("DRIVE_REQUESTS_PER_MINUTE", "600")),
+}
+QUOTA_BURST = int(os.environ.get("QUOTA_BURST", "10"))
+QUOTA_MAX_RETRIES = int(os.environ.get("QUOTA_MAX_RETRIES", "5"))
+QUOTA_BASE_DELAY = float(os.environ.get("QUOTA_BASE_DELAY", "1"))
+QUOTA_MAX_DELAY = float(os.environ.get("QUOTA_MAX_DELAY", "32"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate_per_minute, capacity):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """
+        Takes one token and returns how long the caller had to wait for it.
+        Raises DeadlineExceeded instead of waiting past `deadline` (time.monotonic()).
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            if deadline is not None and now + delay > deadline:
+                raise DeadlineExceeded(f"quota wait of {delay:.1f}s would pass the call's deadline")
+            time.sleep(delay)
+            waited += delay
+
+
+_lock = threading.Lock()
+_buckets = {}                 # (account, quota class) -> TokenBucket
+_in_flight = {}               # coalescing key -> Future of the read being made
+stats = collections.Counter() # calls, throttled, throttled_seconds, retried, coalesced, failed
+
+
+def bucket(account, quota_class):
+    with _lock:
+        found = _buckets.get((account, quota_class))
+        if found is None:
+            found = _buckets[(account, quota_class)] = TokenBucket(QUOTA_RATES[quota_class], QUOTA_BURST)
+        return found
+
+
+def account_of(creds):
+    """Quota key for the credentials: Google counts requests per service account."""
+    return getattr(creds, "service_account_email", None) or "default"
+
+
+def metrics():
+    return dict(stats)
+
+
+def status_code(exc):
+    """HTTP status of a gspread APIError or googleapiclient HttpError, if any."""
+    response = getattr(exc, "response", None)   # gspread
+    if response is not None and hasattr(response, "status_code"):
+        return response.status_code
+    resp = getattr(exc, "resp", None)           # googleapiclient
+    if resp is not None and hasattr(resp, "status"):
+        return int(resp.status)
+    return None
+
+
+def _retry_after(exc):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def may_have_landed(exc):
+    """
+    Whether a failed write may have been applied anyway: anything but a refusal
+    (4xx, 429 included) or a call that was never sent.
+    """
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    status = status_code(exc)
+    return status is None or status >= 500
+
+
+def call(account, quota_class, func, *args, idempotent=True, deadline=None, **kwargs):
+    """
+    Makes one blocking Google API call under the account's quota for the class.
+
+    429 responses are retried with jittered exponential backoff. 5xx responses are
+    only retried for idempotent calls: an append or a row delete may have gone
+    through even though the server answered 5xx. Waits and retries stop at
+    `deadline` (time.monotonic(); by default the one run_io set for this call), so
+    no attempt is sent after the caller has given up on it.
+    """
+    if deadline is None:
+        deadline = current_deadline()
+    limiter = bucket(account, quota_class)
+    name = getattr(func, "__name__", repr(func))
+    for attempt in range(QUOTA_MAX_RETRIES + 1):
+        throttle_started = time.perf_counter()
+        waited = limiter.acquire(deadline)
+        if waited:
+            tracing.record(f"{quota_class}.throttled", throttle_started, waited)
+        with _lock:
+            stats[f"{quota_class}_calls"] += 1
+            if waited:
+                stats[f"{quota_class}_throttled"] += 1
+                stats[f"{quota_class}_throttled_seconds"] += waited
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            health.note_google_success(quota_class)
+            return result
+        except Exception as e:
+            status = status_code(e)
+            retryable = status == 429 or (idempotent and status in RETRYABLE_STATUSES)
+            delay = _retry_after(e) or random.uniform(0, min(QUOTA_MAX_DELAY, QUOTA_BASE_DELAY * 2 ** attempt))
+            if deadline is not None and time.monotonic() + delay > deadline:
+                retryable = False  # the caller would have given up before the retry
+            if not retryable or attempt == QUOTA_MAX_RETRIES:
+                with _lock:
+                    stats[f"{quota_class}_failed"] += 1
+                errors.inc(f"google.{quota_class}", type(e).__name__)
+                raise
+            with _lock:
+                stats[f"{quota_class}_retried"] += 1
+            logger.warning(f"Google API {name} returned {status}, retry {attempt + 1} in {delay:.1f}s")
+        finally:
+            elapsed = time.perf_counter() - started
+            google_api_seconds.observe(elapsed, quota_class, name)
+            tracing.record(f"{quota_class}.{name}", started, elapsed)
+        with tracing.span(f"{quota_class}.backoff"):
+            time.sleep(delay)
+
+
+def coalesced(key, func, *args, **kwargs):
+    """
+    Runs func, unless an identical call (same key) is already in flight, in which
+    case it waits for that call and returns its result. The result object is shared
+    between the callers, so they must not modify it.
+    """
+    with _lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+        else:
+            stats["coalesced"] += 1
+    if not leader:
+        return future.result()
+    try:
+        result = func(*args, **kwargs)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _lock:
+            _in_flight.pop(key, None)
+
+
+class QuotaWorksheet:
+    """
+    gspread worksheet proxy that runs every API call through the account's quota:
+    reads share the sheets_read bucket and identical concurrent reads are coalesced,
+    writes use the sheets_write bucket. Other attributes pass straight through.
+    """
+
+    READS = ("get_all_values", "get_all_records", "get_values", "get", "batch_get", "row_values", "col_values",
+             "acell", "cell")
+    WRITES = {  # method -> safe to retry after a 5xx
+        "update": True, "batch_update": True, "update_cell": True, "update_acell": True, "clear": True,
+        "append_row": False, "append_rows": False, "insert_row": False, "insert_rows": False,
+        "delete_rows": False,
+    }
+
+    def __init__(self, worksheet, account):
+        self._worksheet = worksheet
+        self._account = account
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if name in self.READS:
+            def read(*args, **kwargs):
+                key = (self._worksheet.spreadsheet.id, self._worksheet.id, name, repr(args), repr(sorted(kwargs.items())))
+                return coalesced(key, call, self._account, "sheets_read", attr, *args, **kwargs)
+            return read
+        if name in self.WRITES:
+            def write(*args, **kwargs):
+                return call(self._account, "sheets_write", attr, *args, idempotent=self.WRITES[name], **kwargs)
+            return write
+        return attr
@@ -0,0 +1,169 @@
+# resources.py
+import collections
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import psutil
+
+from health import HEALTH_STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+# One sample of every process in the tree every RESOURCE_SAMPLE_SECONDS, the last
+# RESOURCE_SAMPLES of them kept (an hour at the defaults)
+RESOURCE_SAMPLE_SECONDS = float(os.environ.get("RESOURCE_SAMPLE_SECONDS", "10"))
+RESOURCE_SAMPLES = int(os.environ.get("RESOURCE_SAMPLES", "360"))
+STATE_FILE = "resources.json"
+
+_sampler = None
+
+
+def _short_command(process):
+    """Short label for a process: "python3 Mrequests.py" -> "Mrequests.py", "gunicorn ..." -> "gunicorn"."""
+    cmdline = process.cmdline()
+    if not cmdline:
+        return process.name()
+    if "python" not in os.path.basename(cmdline[0]):
+        return os.path.basename(cmdline[0])
+    args = iter(cmdline[1:])
+    for part in args:
+        if part == "-m":
+            return next(args, "python")
+        if part == "-c":
+            return "python -c"
+        if not part.startswith("-"):
+            return os.path.basename(part)
+    return process.name()
+
+
+class ResourceSampler:
+    """
+    Samples this process and every process it started (recursively): RSS, CPU time
+    and CPU use since the last sample, threads, open file descriptors and open
+    files in the temp directory. Samples go into a ring buffer; nothing is logged.
+    """
+
+    def __init__(self, interval=RESOURCE_SAMPLE_SECONDS, size=RESOURCE_SAMPLES, state_dir=HEALTH_STATE_DIR):
+        self.interval = interval
+        self.samples = collections.deque(maxlen=size)
+        self.state_path = os.path.join(state_dir, STATE_FILE) if state_dir else None
+        self._root = psutil.Process(os.getpid())
+        self._processes = {}    # pid -> psutil.Process, kept so CPU deltas span samples
+        self._cpu_seconds = {}  # pid -> CPU seconds at the previous sample
+        self._last_sampled = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _tree(self):
+        try:
+            children = self._root.children(recursive=True)
+        except psutil.Error:
+            children = []
+        current = {}
+        for process in [self._root] + children:
+            current[process.pid] = self._processes.get(process.pid, process)
+        self._processes = current
+        return list(current.values())
+
+    def sample(self):
+        now = time.time()
+        elapsed = now - self._last_sampled if self._last_sampled else None
+        temp_dir = tempfile.gettempdir()
+        processes = []
+        cpu_seconds = {}
+        for process in self._tree():
+            try:
+                with process.oneshot():
+                    cpu = process.cpu_times()
+                    used = cpu.user + cpu.system
+                    open_files = process.open_files()
+                    previous = self._cpu_seconds.get(process.pid)
+                    processes.append({
+                        "pid": process.pid,
+                        "command": _short_command(process),
+                        "rss_bytes": process.memory_info().rss,
+                        "cpu_seconds": round(used, 2),
+                        "cpu_percent": round(100 * (used - previous) / elapsed, 1)
+                                       if previous is not None and elapsed else None,
+                        "threads": process.num_threads(),
+                        "fds": process.num_fds() if hasattr(process, "num_fds") else None,
+                        "temp_files": sum(f.path.startswith(temp_dir) for f in open_files),
+                    })
+                    cpu_seconds[process.pid] = used
+            except psutil.Error:
+                continue  # exited between listing and sampling
+        try:
+            temp_dir_files = len(os.listdir(temp_dir))
+        except OSError:
+            temp_dir_files = None
+        entry = {"time": now, "processes": processes, "temp_dir_files": temp_dir_files}
+        with self._lock:
+            self._cpu_seconds = cpu_seconds
+            self._last_sampled = now
+            self.samples.append(entry)
+        return entry
+
+    def snapshot(self, limit=None):
+        with self._lock:
+            samples = list(self.samples)
+        if limit:
+            samples = samples[-limit:]
+        return {"interval": self.interval, "capacity": self.samples.maxlen, "samples": samples}
+
+    def _write_state(self):
+        try:
+            with open(self.state_path + ".tmp", "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(self.state_path + ".tmp", self.state_path)
+        except OSError as e:
+            logger.warning(f"Could not write resource samples {self.state_path}: {e}")
+
+    def _run(self):
+        failed = False
+        while not self._stop.is_set():
+            try:
+                self.sample()
+                if self.state_path:
+                    self._write_state()
+                failed = False
+            except Exception as e:
+                if not failed:  # once per run of failures, not every interval
+                    logger.error(f"Resource sampling failed: {e}")
+                failed = True
+            self._stop.wait(self.interval)
+
+    def start(self):
+        threading.Thread(target=self._run, name="resources", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def start_sampler(**kwargs):
+    """Starts the process-wide sampler (once); the health server reads it at GET /health/resources."""
+    global _sampler
+    if _sampler is None:
+        _sampler = ResourceSampler(**kwargs)
+        _sampler.start()
+    return _sampler
+
+
+def read_samples(limit=None):
+    """Samples from the sampler in this process, or from the state file written by the entrypoint's."""
+    if _sampler is not None:
+        return _sampler.snapshot(limit)
+    path = os.path.join(HEALTH_STATE_DIR, STATE_FILE) if HEALTH_STATE_DIR else None
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if limit:
+        state["samples"] = state["samples"][-limit:]
+    return state
@@ -0,0 +1,333 @@
+# sheet_index.py
+import contextlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Warm restarts: each shared index keeps a snapshot file next to the local database,
+# so a restarted bot can take the rows from disk instead of re-reading the sheet.
+# A snapshot is only used while its rows are fresher than SHEET_SNAPSHOT_MAX_AGE
+# (the same staleness the reconcile loop already allows).
+SHEET_SNAPSHOT_DIR = os.environ.get("SHEET_SNAPSHOT_DIR") or os.path.dirname(
+    os.path.abspath(os.environ.get("LOCAL_DB_PATH", "muya.db")))
+SHEET_SNAPSHOT_MAX_AGE = float(os.environ.get("SHEET_SNAPSHOT_MAX_AGE", "300"))
+SHEET_SNAPSHOT_SECONDS = float(os.environ.get("SHEET_SNAPSHOT_SECONDS", "30"))
+# Snapshot files are per process (each one appends and deletes rows the others only
+# learn about on reconcile), named after the script that was started, which stays
+# the same across restarts
+SHEET_SNAPSHOT_OWNER = os.environ.get("SHEET_SNAPSHOT_OWNER") or \
+    os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+
+
+class SheetIndex:
+    """
+    Resident copy of a worksheet keyed by one column (e.g. "User ID").
+
+    Lookups are served from memory: key -> (row number, row dict). The bot keeps
+    the index current by calling on_append / on_update / on_delete after its own
+    writes (appends and deletes inside rows_shifting()), and reconcile() re-reads
+    the sheet to pick up edits made by hand.
+    Listeners added with subscribe() are called as listener(key, row) for every
+    row that appears or changes, and listener(key, None) for every row removed.
+    """
+
+    def __init__(self, sheet, key_column="User ID"):
+        self.sheet = sheet
+        self.key_column = key_column
+        self.header = []
+        self._rows = {}        # key -> [row_idx, row dict]
+        self._last_row = 1     # last used row in the sheet (1 = header only)
+        self._version = 0      # bumped on every local mutation
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._reconcile_thread = None
+        self.loaded = False
+        self.fetched_at = None         # wall time the rows were last read from the sheet
+        self.snapshot_path = None
+        self._snapshot_dirty = False
+        self._shifting = 0             # appends/deletes in flight, see rows_shifting()
+        self._snapshot_thread = None
+        self._load_lock = threading.Lock()   # bots sharing the index load it once
+
+    def subscribe(self, listener):
+        """Adds a listener; if the index is already loaded it is replayed the current rows."""
+        self._listeners.append(listener)
+        with self._lock:
+            current = [(key, dict(entry[1])) for key, entry in self._rows.items()] if self.loaded else []
+        for key, row in current:
+            listener(key, row)
+
+    def _notify(self, events):
+        # Called outside the lock so listeners may read the index
+        for key, row in events:
+            for listener in self._listeners:
+                try:
+                    listener(key, row)
+                except Exception as e:
+                    logger.error(f"Sheet index listener failed for {key}: {e}")
+
+    # --- Loading ---
+    def _fetch(self):
+        values = self.sheet.get_all_values()
+        header = values[0] if values else []
+        rows = {}
+        for idx, raw in enumerate(values[1:], start=2):
+            row = dict(zip(header, raw))
+            key = str(row.get(self.key_column, "")).strip()
+            if key and key not in rows:  # first match wins, like the old linear scan
+                rows[key] = [idx, row]
+        return header, rows, max(len(values), 1)
+
+    def load(self):
+        """Reads the whole sheet once and builds the index."""
+        started = time.monotonic()
+        header, rows, last_row = self._fetch()
+        with self._lock:
+            removed = self._rows.keys() - rows.keys()
+            self.header, self._rows, self._last_row = header, rows, last_row
+            self._version += 1
+            self.loaded = True
+            self.fetched_at = time.time()
+            self._snapshot_dirty = True
+        self._notify([(key, dict(entry[1])) for key, entry in rows.items()] + [(key, None) for key in removed])
+        logger.info(f"Loaded {len(rows)} rows into {self.key_column} index in {time.monotonic() - started:.2f}s")
+
+    def reconcile(self):
+        """
+        Re-reads the sheet and replaces the index with what is actually there.
+        If the bot wrote to the sheet while the snapshot was being downloaded the
+        snapshot is discarded; the next reconcile will pick the changes up.
+        Returns (added, removed, changed) key sets, or None if skipped.
+        """
+        with self._lock:
+            version = self._version
+        header, rows, last_row = self._fetch()
+        with self._lock:
+            if version != self._version:
+                logger.info("Sheet index changed during reconcile, skipping this round")
+                return None
+            old = self._rows
+            added = rows.keys() - old.keys()
+            removed = old.keys() - rows.keys()
+            changed = {k for k in rows.keys() & old.keys() if rows[k] != old[k]}
+            self.header, self._rows, self._last_row = header, rows, last_row
+            self._version += 1
+            self.loaded = True
+            self.fetched_at = time.time()
+            self._snapshot_dirty = True
+        self._notify([(key, dict(rows[key][1])) for key in added | changed] + [(key, None) for key in removed])
+        if added or removed or changed:
+            logger.info(f"Sheet index reconciled: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+        return set(added), set(removed), changed
+
+    def run_reconcile_loop(self, interval):
+        """Starts a daemon thread calling reconcile() every `interval` seconds (once per index)."""
+        if self._reconcile_thread is not None:
+            return self._reconcile_thread
+
+        def loop():
+            # Rows restored from a snapshot are already some seconds old
+            first_wait = interval - (time.time() - self.fetched_at) if self.fetched_at else interval
+            time.sleep(max(0, min(interval, first_wait)))
+            while True:
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    logger.error(f"Error reconciling sheet index: {e}")
+                time.sleep(interval)
+
+        self._reconcile_thread = threading.Thread(target=loop, name="sheet-index-reconcile", daemon=True)
+        self._reconcile_thread.start()
+        return self._reconcile_thread
+
+    # --- Snapshots (warm restarts) ---
+    def enable_snapshots(self, path):
+        """Keeps a snapshot of the index in `path`, rewritten at most every SHEET_SNAPSHOT_SECONDS."""
+        if self._snapshot_thread is not None:
+            return
+        self.snapshot_path = path
+
+        def loop():
+            while True:
+                time.sleep(SHEET_SNAPSHOT_SECONDS)
+                if self._snapshot_dirty:
+                    try:
+                        self.save_snapshot()
+                    except Exception as e:
+                        logger.error(f"Error saving sheet index snapshot: {e}")
+
+        self._snapshot_thread = threading.Thread(target=loop, name="sheet-index-snapshot", daemon=True)
+        self._snapshot_thread.start()
+
+    def save_snapshot(self):
+        if not self.snapshot_path or not self.loaded:
+            return
+        with self._lock:
+            if self._shifting:
+                return  # row numbers are about to change; saved on a later round
+            state = {"key_column": self.key_column, "header": list(self.header), "last_row": self._last_row,
+                     "fetched_at": self.fetched_at,
+                     "rows": {key: [entry[0], dict(entry[1])] for key, entry in self._rows.items()}}
+            version = self._version
+            self._snapshot_dirty = False
+        payload = json.dumps(state, ensure_ascii=False)  # outside the lock: lookups keep going
+        with open(self.snapshot_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(payload)
+        with self._lock:
+            if version != self._version or self._shifting:
+                return  # changed while writing; the next round saves the new state
+            os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
+
+    @contextlib.contextmanager
+    def rows_shifting(self):
+        """
+        Wrap our own append/delete calls and their on_append/on_delete: the snapshot
+        is dropped before the request goes out and not saved again until it is done,
+        so a crash in between cannot leave a snapshot without the new rows.
+        """
+        with self._lock:
+            self._shifting += 1
+        self._invalidate_snapshot()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._shifting -= 1
+
+    def _invalidate_snapshot(self):
+        # Our own appends/deletes shift row numbers: a snapshot taken before them must
+        # not be restored, so drop it until the snapshot thread writes a new one. Done
+        # on every call: the file may have been written since the flag was last set.
+        if self.snapshot_path:
+            self._snapshot_dirty = True
+            try:
+                os.remove(self.snapshot_path)
+            except OSError:
+                pass
+
+    def restore_snapshot(self, max_age=SHEET_SNAPSHOT_MAX_AGE):
+        """Loads the index from its snapshot if that is fresh enough; returns whether it did."""
+        if not self.snapshot_path:
+            return False
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        age = time.time() - (state.get("fetched_at") or 0)
+        if state.get("key_column") != self.key_column or age > max_age:
+            logger.info(f"Sheet index snapshot not used (age {age:.0f}s)")
+            return False
+        rows = state["rows"]
+        with self._lock:
+            self.header, self._rows, self._last_row = state["header"], rows, state["last_row"]
+            self._version += 1
+            self.loaded = True
+            self.fetched_at = state["fetched_at"]
+        self._notify([(key, dict(entry[1])) for key, entry in rows.items()])
+        logger.info(f"Restored {len(rows)} rows into {self.key_column} index from snapshot ({age:.0f}s old)")
+        return True
+
+    def load_warm(self):
+        """restore_snapshot() if possible, otherwise load() from the sheet; no-op once loaded."""
+        with self._load_lock:
+            if not self.loaded and not self.restore_snapshot():
+                self.load()
+
+    # --- Lookups ---
+    def get(self, key):
+        """Returns (row_idx, row dict) for the key, or (None, None)."""
+        with self._lock:
+            entry = self._rows.get(str(key))
+            if entry is None:
+                return None, None
+            return entry[0], dict(entry[1])
+
+    def items(self):
+        """Snapshot of (key, row dict) for every indexed row."""
+        with self._lock:
+            return [(key, dict(entry[1])) for key, entry in self._rows.items()]
+
+    def __contains__(self, key):
+        with self._lock:
+            return str(key) in self._rows
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rows)
+
+    # --- Keeping the index in step with our own writes ---
+    def on_append(self, values, row_idx=None):
+        """
+        Records a row appended with append_row(values), at `row_idx` as reported by
+        the API (the next row after the last one known when it is not given).
+        """
+        with self._lock:
+            row_idx = row_idx or self._last_row + 1
+            self._last_row = max(self._last_row, row_idx)
+            row = dict(zip(self.header, [str(v) for v in values]))
+            key = str(row.get(self.key_column, "")).strip()
+            added = bool(key) and key not in self._rows
+            if added:
+                self._rows[key] = [row_idx, row]
+            self._version += 1
+        self._invalidate_snapshot()
+        if added:
+            self._notify([(key, dict(row))])
+        return row_idx
+
+    def on_update(self, key, fields):
+        """Merges {column name: value} into the cached row for the key."""
+        with self._lock:
+            entry = self._rows.get(str(key))
+            if entry is None:
+                return
+            entry[1].update({name: str(value) for name, value in fields.items()})
+            self._version += 1
+            row = dict(entry[1])
+            self._snapshot_dirty = True  # row numbers unchanged, the old snapshot stays usable
+        self._notify([(str(key), row)])
+
+    def on_delete(self, row_idx):
+        """Drops the row and shifts every row below it up by one."""
+        removed = []
+        with self._lock:
+            for key, entry in list(self._rows.items()):
+                if entry[0] == row_idx:
+                    del self._rows[key]
+                    removed.append((key, None))
+                elif entry[0] > row_idx:
+                    entry[0] -= 1
+            self._last_row = max(self._last_row - 1, 1)
+            self._version += 1
+        self._invalidate_snapshot()
+        self._notify(removed)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_index(sheet, key_column="User ID"):
+    """
+    One SheetIndex per worksheet and key column for the whole process, so bots
+    hosted together load and reconcile a sheet once instead of once each.
+    """
+    # A google_clients.LazyWorksheet names its sheet without opening it
+    sheet_key = getattr(sheet, "shared_key", None) or (sheet.spreadsheet.id, sheet.id)
+    key = (sheet_key, key_column)
+    with _shared_lock:
+        index = _shared.get(key)
+        if index is None:
+            index = _shared[key] = SheetIndex(sheet, key_column)
+            title = getattr(sheet, "title", None)
+            if title:
+                slug = re.sub(r"[^A-Za-z0-9]+", "_", f"{SHEET_SNAPSHOT_OWNER}_{title}_{key_column}").strip("_").lower()
+                index.enable_snapshots(os.path.join(SHEET_SNAPSHOT_DIR, f"sheet_snapshot_{slug}.json"))
+        return index
@@ -0,0 +1,101 @@
+# storage.py
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# gspread and the Drive client are blocking; run them on a bounded pool so a slow
+# Google round trip never freezes the event loop for every other user.
+STORAGE_MAX_WORKERS = int(os.environ.get("STORAGE_MAX_WORKERS", "8"))
+STORAGE_TIMEOUT = float(os.environ.get("STORAGE_TIMEOUT", "30"))
+
+_executor = ThreadPoolExecutor(max_workers=STORAGE_MAX_WORKERS, thread_name_prefix="storage")
+
+
+class StorageTimeout(TimeoutError):
+    """Raised when a Sheets/Drive call does not finish within its timeout."""
+
+
+class DeadlineExceeded(StorageTimeout):
+    """Raised on the worker thread when waiting for quota would run past the call's deadline; nothing was sent."""
+
+
+# time.monotonic() by which the storage call running in this context has to finish
+_deadline = contextvars.ContextVar("storage_deadline", default=None)
+
+
+def current_deadline():
+    return _deadline.get()
+
+
+async def run_io(func, *args, timeout=None, hard_timeout=True, **kwargs):
+    """
+    Runs a blocking call on the storage executor and awaits it.
+
+    The call gets a deadline `timeout` seconds from now, which quota.call keeps to:
+    it stops waiting and retrying instead of running past it. With hard_timeout the
+    awaiting handler also gets StorageTimeout when the timeout passes while a request
+    is still in flight; the worker thread cannot be interrupted and finishes (or
+    fails) in the background. Writes that must not be sent twice (appends, row
+    deletes) use hard_timeout=False, so the caller always learns how they ended.
+    """
+    timeout = timeout or STORAGE_TIMEOUT
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the caller's context so the worker's spans land in its update trace
+    context = contextvars.copy_context()
+    context.run(_deadline.set, time.monotonic() + timeout)
+    future = loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
+    if not hard_timeout:
+        return await future
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        name = getattr(func, "__qualname__", repr(func))
+        logger.error(f"Storage call {name} timed out after {timeout}s")
+        raise StorageTimeout(f"{name} timed out after {timeout}s")
+
+
+class AsyncWorksheet:
+    """Awaitable wrapper around a gspread worksheet; each call runs on the storage executor."""
+
+    def __init__(self, sheet, timeout=None):
+        self.sheet = sheet
+        self.timeout = timeout
+
+    # Appends and row deletes are not safe to repeat: they are awaited until they end
+    async def append_row(self, values, **kwargs):
+        return await run_io(self.sheet.append_row, values, timeout=self.timeout, hard_timeout=False, **kwargs)
+
+    async def append_rows(self, values, **kwargs):
+        return await run_io(self.sheet.append_rows, values, timeout=self.timeout, hard_timeout=False, **kwargs)
+
+    async def update(self, *args, **kwargs):
+        return await run_io(self.sheet.update, *args, timeout=self.timeout, **kwargs)
+
+    async def batch_update(self, data, **kwargs):
+        return await run_io(self.sheet.batch_update, data, timeout=self.timeout, **kwargs)
+
+    async def delete_rows(self, start_index, end_index=None):
+        return await run_io(self.sheet.delete_rows, start_index, end_index, timeout=self.timeout, hard_timeout=False)
+
+    async def get(self, range_name, **kwargs):
+        return await run_io(self.sheet.get, range_name, timeout=self.timeout, **kwargs)
+
+    async def batch_get(self, ranges, **kwargs):
+        return await run_io(self.sheet.batch_get, ranges, timeout=self.timeout, **kwargs)
+
+    async def get_all_records(self, **kwargs):
+        return await run_io(self.sheet.get_all_records, timeout=self.timeout, **kwargs)
+
+    async def get_all_values(self, **kwargs):
+        return await run_io(self.sheet.get_all_values, timeout=self.timeout, **kwargs)
+
+
+def shutdown(wait=True):
+    """Stops accepting new storage calls and optionally waits for in-flight ones."""
+    _executor.shutdown(wait=wait)
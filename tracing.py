@@ -0,0 +1,89 @@
+# tracing.py
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+slow_log = logging.getLogger("slow_updates")
+
+# Updates taking longer than this are written to the slow_updates log as one JSON
+# line with the time spent in each phase (telegram, sheets_read, drive, ...).
+SLOW_UPDATE_SECONDS = float(os.environ.get("SLOW_UPDATE_SECONDS", "2"))
+
+_current = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Spans recorded while one update is handled; span names are "<phase>.<operation>"."""
+
+    def __init__(self, bot, handler, update):
+        self.bot = bot
+        self.handler = handler
+        self.update_id = getattr(update, "update_id", None)
+        user = getattr(update, "effective_user", None)
+        self.user_id = getattr(user, "id", None)
+        self.started = time.perf_counter()
+        self.spans = []      # (name, start offset, duration) in seconds
+        self.finished = False
+
+    def add(self, name, started, duration):
+        if not self.finished:   # background tasks may outlive the update
+            self.spans.append((name, started - self.started, duration))
+
+    def phases(self):
+        totals = {}
+        for name, _, duration in self.spans:
+            phase = name.split(".", 1)[0]
+            totals[phase] = totals.get(phase, 0.0) + duration
+        return totals
+
+    def to_json(self, total):
+        phases = self.phases()
+        phases["other"] = max(0.0, total - sum(phases.values()))
+        return json.dumps({
+            "bot": self.bot,
+            "handler": self.handler,
+            "update_id": self.update_id,
+            "user_id": self.user_id,
+            "total_ms": round(total * 1000, 1),
+            "phases_ms": {phase: round(seconds * 1000, 1) for phase, seconds in phases.items()},
+            "spans": [[name, round(start * 1000, 1), round(duration * 1000, 1)] for name, start, duration in self.spans],
+        })
+
+
+@contextlib.contextmanager
+def trace(bot, handler, update):
+    """Traces the update being handled, unless an outer handler is already tracing it."""
+    if _current.get() is not None:
+        yield None
+        return
+    current = Trace(bot, handler, update)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+        current.finished = True
+        total = time.perf_counter() - current.started
+        if total >= SLOW_UPDATE_SECONDS:
+            slow_log.warning(current.to_json(total))
+
+
+def record(name, started, duration):
+    """Adds a finished span (perf_counter start, seconds) to the current update, if any."""
+    current = _current.get()
+    if current is not None:
+        current.add(name, started, duration)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Times the block as a span of the current update; usable around awaits."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, started, time.perf_counter() - started)
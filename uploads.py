@@ -0,0 +1,64 @@
+# uploads.py
+import asyncio
+import collections
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "4"))
+
+
+class UploadTracker:
+    """
+    Runs file uploads as background tasks, at most `max_concurrency` at a time,
+    and remembers them per (user, kind) so the conversation can reply straight away
+    and wait for the results later, when the user presses Done.
+    """
+
+    def __init__(self, max_concurrency=UPLOAD_CONCURRENCY):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = collections.defaultdict(list)   # (user_id, kind) -> [(label, task)]
+
+    async def _limited(self, coro):
+        async with self._semaphore:
+            return await coro
+
+    def submit(self, user_id, kind, label, coro):
+        """Schedules an upload coroutine that returns a link."""
+        task = asyncio.create_task(self._limited(coro))
+        self._tasks[(user_id, kind)].append((label, task))
+        return task
+
+    def pending(self, user_id, kind=None):
+        """Number of uploads submitted for the user (and kind) that have not been collected yet."""
+        return sum(len(tasks) for (uid, k), tasks in self._tasks.items()
+                   if uid == user_id and (kind is None or k == kind))
+
+    def depth(self):
+        """Uploads still running or waiting for a slot, across all users."""
+        return sum(not task.done() for tasks in self._tasks.values() for _, task in tasks)
+
+    async def collect(self, user_id, kind):
+        """
+        Waits for the user's outstanding uploads of this kind.
+        Returns (links, failed) where failed is a list of (label, exception).
+        """
+        entries = self._tasks.pop((user_id, kind), [])
+        if not entries:
+            return [], []
+        results = await asyncio.gather(*(task for _, task in entries), return_exceptions=True)
+        links, failed = [], []
+        for (label, _), result in zip(entries, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Upload of {label} for user {user_id} failed: {result!r}")
+                failed.append((label, result))
+            else:
+                links.append(result)
+        return links, failed
+
+    def discard(self, user_id, kind=None):
+        """Cancels and forgets the user's outstanding uploads (e.g. on /cancel)."""
+        for key in [k for k in self._tasks if k[0] == user_id and (kind is None or k[1] == kind)]:
+            for _, task in self._tasks.pop(key):
+                task.cancel()
@@ -0,0 +1,222 @@
+# write_queue.py
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from quota import may_have_landed
+
+logger = logging.getLogger(__name__)
+
+
+class FileJournal:
+    """
+    JSON-lines file holding rows that have not reached the sheet yet.
+    Entries are (id, row); acknowledged entries are dropped by rewriting the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = collections.OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()   # append() runs on executor threads
+
+    def replay(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self._entries[self._next_id] = json.loads(line)
+                        self._next_id += 1
+        return list(self._entries.items())
+
+    def append(self, row):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+                fd = os.dup(f.fileno())
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = row
+        # Outside the lock, so appends arriving together share the disk flush
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return entry_id
+
+    def ack(self, entry_ids):
+        with self._lock:
+            for entry_id in entry_ids:
+                self._entries.pop(entry_id, None)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for row in self._entries.values():
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+
+class BatchAppender:
+    """
+    Write-behind queue for sheet appends.
+
+    enqueue() records the row in a durable journal (a FileJournal at journal_path,
+    or any object with the same replay/append/ack methods) and returns immediately, so
+    the user gets their reply without waiting on Google. A background task flushes
+    queued rows with a single append_rows call every `batch_size` rows or every
+    `flush_interval` seconds, retrying with exponential backoff on failure. Rows stay
+    in the journal until Google has accepted them, so a restart replays them.
+
+    An append that failed without a clear refusal may still have reached the sheet.
+    With `row_key` (row -> key) and `sheet_keys` (coroutine returning the keys on the
+    sheet) the next flush first drops the rows already there instead of sending them twice.
+    """
+
+    def __init__(self, sheet, journal_path=None, batch_size=50, flush_interval=2.0,
+                 base_delay=1.0, max_delay=60.0, journal=None, row_key=None, sheet_keys=None):
+        self.sheet = sheet                # storage.AsyncWorksheet
+        self.journal = journal or FileJournal(journal_path)
+        self.row_key = row_key
+        self.sheet_keys = sheet_keys
+        self._unconfirmed = False         # the last append failed but may have landed
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._pending = collections.deque()   # (journal entry id, row)
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self._failures = 0               # consecutive failed flushes
+        self.stats = {
+            "enqueued": 0,
+            "flushed_rows": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+            "total_flush_seconds": 0.0,
+        }
+        self._pending.extend(self.journal.replay())
+        if self._pending:
+            logger.info(f"Replayed {len(self._pending)} unsent rows from the journal")
+
+    # --- Public API ---
+    async def enqueue(self, row):
+        """Queues one row for appending. Durable once this returns."""
+        # The journal write (and its fsync) runs off the event loop, on the default
+        # executor rather than the storage one, so it never waits behind Google calls
+        entry_id = await asyncio.get_running_loop().run_in_executor(None, self.journal.append, row)
+        self._pending.append((entry_id, row))
+        self.stats["enqueued"] += 1
+        if self._wakeup is not None and len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def metrics(self):
+        flushes = self.stats["flushes"]
+        return dict(
+            self.stats,
+            queue_depth=self.depth,
+            avg_flush_seconds=self.stats["total_flush_seconds"] / flushes if flushes else 0.0,
+        )
+
+    def start(self):
+        """Starts the background flusher on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the flusher after one last flush attempt. A flush already running is
+        awaited, not cancelled: its append_rows finishes on the executor either way,
+        and flushing its batch again would append the rows twice.
+        """
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        try:
+            while self._pending and await self.flush():
+                pass
+        except Exception as e:
+            logger.error(f"Final flush failed, {self.depth} rows left in the journal: {e}")
+
+    async def flush(self):
+        """Appends up to batch_size queued rows in one API call."""
+        if self._unconfirmed:
+            await self._drop_landed_rows()
+        if not self._pending:
+            return 0
+        batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+        started = time.monotonic()
+        try:
+            await self.sheet.append_rows([row for _, row in batch])
+        except Exception as e:
+            self._unconfirmed = self.sheet_keys is not None and may_have_landed(e)
+            raise
+        elapsed = time.monotonic() - started
+        for _ in batch:
+            self._pending.popleft()
+        await self._ack([entry_id for entry_id, _ in batch])
+        self.stats["flushes"] += 1
+        self.stats["flushed_rows"] += len(batch)
+        self.stats["last_flush_seconds"] = elapsed
+        self.stats["total_flush_seconds"] += elapsed
+        self.stats["max_flush_seconds"] = max(self.stats["max_flush_seconds"], elapsed)
+        logger.info(f"Flushed {len(batch)} rows in {elapsed:.2f}s, {self.depth} still queued")
+        return len(batch)
+
+    async def _ack(self, entry_ids):
+        await asyncio.get_running_loop().run_in_executor(None, self.journal.ack, entry_ids)
+
+    async def _drop_landed_rows(self):
+        """Acknowledges the queued rows a failed append did write after all."""
+        on_sheet = await self.sheet_keys()
+        landed = [(entry_id, row) for entry_id, row in self._pending if self.row_key(row) in on_sheet]
+        if landed:
+            landed_ids = {entry_id for entry_id, _ in landed}
+            self._pending = collections.deque(entry for entry in self._pending if entry[0] not in landed_ids)
+            await self._ack(list(landed_ids))
+            self.stats["flushed_rows"] += len(landed)
+            logger.warning(f"{len(landed)} rows of a failed append were on the sheet already, not sending them again")
+        self._unconfirmed = False
+
+    async def _run(self):
+        while not self._stopping:
+            wait = None
+            if self._failures:
+                # Exponential backoff with full jitter after a failed flush
+                wait = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (self._failures - 1)))
+            elif len(self._pending) < self.batch_size:
+                wait = self.flush_interval
+            if wait is not None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)  # stop() sets it too
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            if self._stopping:
+                return  # stop() makes the last flush
+            try:
+                while await self.flush() == self.batch_size and not self._stopping:
+                    pass  # keep draining full batches
+                self._failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failures += 1
+                self.stats["failed_flushes"] += 1
+                logger.error(f"Error flushing {self.depth} queued rows (attempt {self._failures}): {e}")